@@ -1,26 +1,40 @@
 import asyncio
 import logging
 import re
-from datetime import datetime, timedelta
+from collections import deque
+from datetime import time, timedelta
 from inspect import Parameter
+from statistics import mean
+from zoneinfo import ZoneInfo
 
 import arrow
 import discord
 from discord.ext import commands, tasks
 from discord.utils import sleep_until, utcnow
 from pytimeparse.timeparse import timeparse
-from pytz import timezone
 from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from common.utils import Icons
-from models import Reminder, async_session
+from common.admission import Priority
+from common.pipeline import MessageFacts
+from common.timing import next_local_time, send_at
+from common.utils import LINK_HOSTS, Icons
+from models import Reminder, async_session, insert_returning
 
 
 class Auto(commands.Cog):
     """All things automated™"""
 
     QUEUED_REMINDERS = {}
+    TIKTOK_LINK = re.compile(r"https?://(www\.)?tiktok\.com/(t/([a-zA-Z0-9]+)|@(.*?)/video/(\d+))(.*?)/?")
+    TWITTER_LINK = re.compile(r"https?://(www\.)?(twitter|x)\.com/([a-zA-Z0-9_]+)/status/(\d+)")
+    REDDIT_LINK = re.compile(
+        r"https?://(www\.|old\.)?reddit\.com/(((r|u|user)/([a-zA-Z0-9_]+)(/s/|/comments/)?([a-zA-Z0-9_]+)(/[a-zA-Z0-9_]+)?(/[a-zA-Z0-9_]+)?)|([a-zA-Z0-9]+))/?"
+    )
+    REDDIT_PROFILE_LINK = re.compile(r"https?://(www\.|old\.)?reddit\.com/(r|u|user)/([a-zA-Z0-9_]+)/?$")
+    # "America/New_York" accounts for daylight savings ("US/Eastern" is EST only)
+    SNIPE_TIMEZONE = ZoneInfo("America/New_York")
+    SNIPE_TIMES = [time(0, 34), time(12, 34)]
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
@@ -28,9 +42,22 @@ class Auto(commands.Cog):
         self.snipe_location = None
         self.snipe_time = None
         self.sent_message = None
+        self.last_snipe_time = None
+        # How late each recent snipe landed (in seconds, going by Discord's timestamp on the message)
+        self.snipe_delays: deque[float] = deque(maxlen=20)
         self.check_reminders.start()
 
+    async def cog_load(self) -> None:
+        self.bot.message_pipeline.add_stage(
+            "link embeds",
+            self.rewrite_links,
+            requires=("in_guild", "from_user", "has_url"),
+            order=100,
+            priority=Priority.LOW,
+        )
+
     async def cog_unload(self) -> None:
+        self.bot.message_pipeline.remove_stage("link embeds")
         self.send_snipe.cancel()
 
     def get_snipe_channel(self, guild: discord.Guild, channel_id: str) -> discord.TextChannel:
@@ -89,12 +116,14 @@ class Auto(commands.Cog):
         session: AsyncSession
         async with async_session() as session:
             async with session.begin():
-                new_reminder = Reminder(
-                    reminder_text=text, reminder_time=remind_offset, user_id=ctx.author.id, channel_id=ctx.channel.id
+                new_reminder: Reminder = await insert_returning(
+                    session,
+                    Reminder,
+                    reminder_text=text,
+                    reminder_time=remind_offset,
+                    user_id=ctx.author.id,
+                    channel_id=ctx.channel.id,
                 )
-                session.add(new_reminder)
-                await session.commit()
-            await session.refresh(new_reminder)
 
         if parsed_offset < timedelta(minutes=30) and new_reminder.reminder_id not in Auto.QUEUED_REMINDERS:
             Auto.QUEUED_REMINDERS[new_reminder.reminder_id] = self.bot.loop.create_task(
@@ -201,9 +230,16 @@ class Auto(commands.Cog):
         if not self.snipe_location:
             raise commands.BadArgument("No snipe has been set.")
 
-        snipe_details = f"{Icons.ALERT} Sending snipe to guild '{self.snipe_location.guild.name}'"
-        +f" (id: {self.snipe_location.guild.id}) on channel '{self.snipe_location.name}'"
-        +f" (id: {self.snipe_location.id}) at `{self.snipe_time}`."
+        snipe_details = (
+            f"{Icons.ALERT} Sending snipe to guild '{self.snipe_location.guild.name}'"
+            f" (id: {self.snipe_location.guild.id}) on channel '{self.snipe_location.name}'"
+            f" (id: {self.snipe_location.id}) at `{self.snipe_time}`."
+        )
+        if self.snipe_delays:
+            snipe_details += (
+                f"\nLast {len(self.snipe_delays)} sends landed `{self.snipe_delays[-1] * 1000:+.0f}ms` off"
+                f" (average `{mean(self.snipe_delays) * 1000:+.0f}ms`, worst `{max(self.snipe_delays) * 1000:+.0f}ms`)"
+            )
         embed: discord.Embed = self.bot.create_embed(description=snipe_details)
         await ctx.send(embed=embed)
 
@@ -230,8 +266,10 @@ class Auto(commands.Cog):
 
         self.snipe_location = sniped_channel
         await self.setup_snipe()
-        snipe_details = f"{Icons.ALERT} Sending snipe to guild '{sniped_guild.name}' (id: {sniped_guild.id})"
-        +f" on channel '{sniped_channel.name}' (id: {sniped_channel.id})."
+        snipe_details = (
+            f"{Icons.ALERT} Sending snipe to guild '{sniped_guild.name}' (id: {sniped_guild.id})"
+            f" on channel '{sniped_channel.name}' (id: {sniped_channel.id})."
+        )
         embed: discord.Embed = self.bot.create_embed(description=snipe_details)
         await ctx.send(embed=embed)
 
@@ -303,46 +341,37 @@ class Auto(commands.Cog):
     @tasks.loop()
     async def send_snipe(self) -> None:
         if self.snipe_location:
-            # Account for daylight savings ("US/Eastern" is EST only)
-            adjusted_timezone = timezone("America/New_York")
-            utc = timezone("UTC")
-
-            now = datetime.now(adjusted_timezone)
-            today_midnight = adjusted_timezone.localize(datetime(now.year, now.month, now.day, 0, 34))
-            today_noon = adjusted_timezone.localize(datetime(now.year, now.month, now.day, 12, 34))
-            tomorrow_midnight = adjusted_timezone.localize(datetime(now.year, now.month, now.day + 1, 0, 34))
-
-            if now <= today_midnight:
-                wait_time = today_midnight
-            elif now <= today_noon:
-                wait_time = today_noon
-            else:
-                wait_time = tomorrow_midnight
-
-            self.snipe_time = wait_time
+            # Never aim for the same time twice, even if the last send finished before the time it was aiming for
+            after = max(utcnow(), self.last_snipe_time) if self.last_snipe_time else utcnow()
+            self.snipe_time = next_local_time(Auto.SNIPE_TIMES, Auto.SNIPE_TIMEZONE, after)
             self.log.debug(
                 "Sending snipe at '%s' local time ('%s' utc)",
                 self.snipe_time,
-                self.snipe_time.astimezone(utc),
+                self.snipe_time.astimezone(ZoneInfo("UTC")),
             )
-            self.log.debug(
-                "now: %s, today 12am: %s, today 12pm: %s, tomrrow 12am: %s",
-                now,
-                today_midnight,
-                today_noon,
-                tomorrow_midnight,
+            channel = self.snipe_location
+            self.sent_message = await send_at(
+                self.snipe_time,
+                lambda: self.send_snipe_message(channel),
+                warm=lambda: self.bot.fetch_channel(channel.id),
             )
-            await sleep_until(wait_time)
-
-            # Something could have happened in the meantime, so check the channel
-            if self.bot.get_channel(self.snipe_location.id) and self.check_snipe_permission(self.snipe_location):
-                self.sent_message = await self.snipe_location.send("12:34")
-            else:
-                self.log.error("Channel is inaccessible; stopping snipe")
-                self.snipe_location = None
-                self.snipe_time = None
-                self.sent_message = None
-                self.send_snipe.cancel()
+            self.last_snipe_time = self.snipe_time
+            if self.sent_message:
+                delay = (self.sent_message.created_at - self.snipe_time).total_seconds()
+                self.snipe_delays.append(delay)
+                self.log.info("Snipe landed %+.0fms from %s", delay * 1000, self.snipe_time)
+
+    async def send_snipe_message(self, channel: discord.TextChannel) -> discord.Message | None:
+        # Something could have happened in the meantime, so check the channel
+        if self.bot.get_channel(channel.id) and self.check_snipe_permission(channel):
+            return await channel.send("12:34")
+
+        self.log.error("Channel is inaccessible; stopping snipe")
+        self.snipe_location = None
+        self.snipe_time = None
+        self.sent_message = None
+        self.send_snipe.cancel()
+        return None
 
     @check_reminders.before_loop
     @send_snipe.before_loop
@@ -356,10 +385,21 @@ class Auto(commands.Cog):
             message_deleter = None
             bot_permissions = message.channel.permissions_for(message.guild.me)
             if bot_permissions.view_audit_log:
-                async for entry in message.guild.audit_logs(limit=20, action=discord.AuditLogAction.message_delete):
-                    if entry.target == message.guild.me:
-                        message_deleter = entry.user
-                        break
+                entry = await self.bot.audit_log.wait_for(
+                    message.guild.id,
+                    discord.AuditLogAction.message_delete,
+                    message.guild.me.id,
+                    after=utcnow() - timedelta(seconds=30),
+                    timeout=2.0,
+                )
+                if entry:
+                    message_deleter = entry.user or message.guild.get_member(entry.user_id)
+                else:
+                    # Repeat deletions get merged into an older entry without an event, so ask the API
+                    async for entry in message.guild.audit_logs(limit=20, action=discord.AuditLogAction.message_delete):
+                        if entry.target == message.guild.me:
+                            message_deleter = entry.user
+                            break
 
             # Checking who deleted the message requires the Audit Log permission
             if not message_deleter:
@@ -369,35 +409,35 @@ class Auto(commands.Cog):
                     f"{message_deleter.mention} stop deleting my message :confused:"
                 )
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message) -> None:
-        if not message.guild or message.author.bot:
+    async def rewrite_links(self, facts: MessageFacts) -> None:
+        """Message stage that reposts social media links with sites that embed properly"""
+        message = facts.message
+        settings = self.bot.guild_settings.get(message.guild.id)
+        if not settings.link_embeds:
             return
 
-        if tiktok_link := re.search(
-            r"https?://(www\.)?tiktok\.com/(t/([a-zA-Z0-9]+)|@(.*?)/video/(\d+))(.*?)/?", message.content
-        ):
+        if tiktok_link := Auto.TIKTOK_LINK.search(message.content):
             await asyncio.sleep(1)
             await message.edit(suppress=True)  # hide the fake video preview from tiktok
 
-            tiktok_embed = tiktok_link.group(0).replace("tiktok.com/", "tnktok.com/", 1)
+            tiktok_host = settings.tiktok_host or LINK_HOSTS["tiktok"]
+            tiktok_embed = tiktok_link.group(0).replace("tiktok.com/", f"{tiktok_host}/", 1)
             await message.channel.send(f"[[View on Tiktok]]({tiktok_embed})", mention_author=False, view=EmbedView())
             return
 
-        if twitter_link := re.search(
-            r"https?://(www\.)?(twitter|x)\.com/([a-zA-Z0-9_]+)/status/(\d+)", message.content
-        ):
+        if twitter_link := Auto.TWITTER_LINK.search(message.content):
             await asyncio.sleep(1)
             await message.edit(suppress=True)
 
+            twitter_host = settings.twitter_host or LINK_HOSTS["twitter"]
             twitter_embed = twitter_link.group(0)
             if "x.com/" in twitter_embed:
-                twitter_embed = twitter_embed.replace("x.com/", "fxtwitter.com/", 1)
+                twitter_embed = twitter_embed.replace("x.com/", f"{twitter_host}/", 1)
                 await message.channel.send(
                     f"[[View on Twitter/X]]({twitter_embed})", mention_author=False, view=EmbedView()
                 )
             elif "twitter.com/":
-                twitter_embed = twitter_embed.replace("twitter.com/", "fxtwitter.com/", 1)
+                twitter_embed = twitter_embed.replace("twitter.com/", f"{twitter_host}/", 1)
                 await message.channel.send(
                     f"[[View on Twitter/X]]({twitter_embed})", mention_author=False, view=EmbedView()
                 )
@@ -405,19 +445,17 @@ class Auto(commands.Cog):
                 self.log.error("Twitter link embed failed with link: '%s' (found: '%s')", twitter_link, twitter_embed)
             return
 
-        if reddit_link := re.search(
-            r"https?://(www\.|old\.)?reddit\.com/(((r|u|user)/([a-zA-Z0-9_]+)(/s/|/comments/)?([a-zA-Z0-9_]+)(/[a-zA-Z0-9_]+)?(/[a-zA-Z0-9_]+)?)|([a-zA-Z0-9]+))/?",
-            message.content,
-        ):
+        if reddit_link := Auto.REDDIT_LINK.search(message.content):
             await asyncio.sleep(1)
-            if re.search(r"https?://(www\.|old\.)?reddit\.com/(r|u|user)/([a-zA-Z0-9_]+)/?$", message.content):
+            if Auto.REDDIT_PROFILE_LINK.search(message.content):
                 return
             await message.edit(suppress=True)
 
+            reddit_host = settings.reddit_host or LINK_HOSTS["reddit"]
             if "old.reddit.com/" in reddit_link.group(0):
-                reddit_embed = reddit_link.group(0).replace("old.reddit.com/", "vxreddit.com/", 1)
+                reddit_embed = reddit_link.group(0).replace("old.reddit.com/", f"{reddit_host}/", 1)
             else:
-                reddit_embed = reddit_link.group(0).replace("reddit.com/", "vxreddit.com/", 1)
+                reddit_embed = reddit_link.group(0).replace("reddit.com/", f"{reddit_host}/", 1)
             await message.channel.send(f"[[View on Reddit]]({reddit_embed})", mention_author=False, view=EmbedView())
             return
 
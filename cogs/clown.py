@@ -9,9 +9,10 @@ from discord.utils import sleep_until, utcnow
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from common.exception import MissingClown, MissingData, MissingVoicePermissions
+from common.exception import MissingClown, MissingData, MissingVoicePermissions, Unavailable
+from common.resilience import Dependency
 from common.utils import Icons
-from models import Clown, async_session
+from models import Clown, async_session, upsert
 
 
 class ClownWeek(commands.Cog):
@@ -21,6 +22,8 @@ class ClownWeek(commands.Cog):
     GUILD_CLOWNS = None
     IDLE_PLAYERS = {}
     WAVELINK_NODE_NAME = "CLOWN"
+    HONK_URL = "https://www.youtube.com/watch?v=x3SxEOvAOEg"
+    LAVALINK = Dependency("Lavalink", timeout=10, max_concurrency=5, reset_after=60)
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
@@ -297,15 +300,13 @@ class ClownWeek(commands.Cog):
         session: AsyncSession
         async with async_session() as session:
             async with session.begin():
-                if clown_data is None:
-                    session.add(Clown(guild_id=ctx.guild.id, clown_id=user.id, previous_clown_id=user.id))
-                else:
-                    await session.execute(
-                        update(Clown)
-                        .where(Clown.guild_id == ctx.guild.id)
-                        .values(clown_id=user.id, previous_clown_id=clown_data.clown_id)
-                    )
-                await session.commit()
+                # The previous clown comes from the row itself, not the (possibly stale) cache
+                await upsert(
+                    session,
+                    Clown,
+                    {"guild_id": ctx.guild.id, "clown_id": user.id, "previous_clown_id": user.id},
+                    set_={"previous_clown_id": Clown.clown_id},
+                )
         await self.update_cache()
 
         # Display who the new clown is
@@ -373,8 +374,8 @@ class ClownWeek(commands.Cog):
             missing_perms = "`, `".join(perm for perm, val in required_permissions.items() if not val)
             raise MissingVoicePermissions(f"I'm missing `{missing_perms}` permission(s) for the voice channel.")
 
+        tracks = await ClownWeek.LAVALINK.call(wavelink.Pool.fetch_tracks, ClownWeek.HONK_URL)
         player = await found_channel.connect(cls=wavelink.Player)
-        tracks = await wavelink.Pool.fetch_tracks("https://www.youtube.com/watch?v=x3SxEOvAOEg")
         await player.play(tracks[0])
 
     @honk.error
@@ -424,7 +425,11 @@ class ClownWeek(commands.Cog):
             return
 
         player: wavelink.Player = member.guild.voice_client
-        tracks = await wavelink.Pool.fetch_tracks("https://www.youtube.com/watch?v=x3SxEOvAOEg")
+        try:
+            tracks = await ClownWeek.LAVALINK.call(wavelink.Pool.fetch_tracks, ClownWeek.HONK_URL)
+        except Unavailable as exc:
+            self.log.warning("Unable to honk at the clown - %s", exc)
+            return
 
         # Clown connects to voice from disconnected state
         if not before.channel and after.channel:
@@ -1,4 +1,4 @@
-from difflib import get_close_matches
+from time import monotonic
 
 import discord
 from discord.ext import commands
@@ -6,6 +6,56 @@ from discord.ext import commands
 from common.utils import Icons
 
 
+class HelpCache:
+    """The parts of the help pages that only change when extensions are (re)loaded.
+
+    Which commands someone can see is the only thing worked out per request, and that is
+    memoized per guild, permission set and set of roles for `VISIBLE_TTL` seconds.
+    """
+
+    VISIBLE_TTL = 300
+    MAX_VISIBLE = 1024
+
+    def __init__(self):
+        self.generation = None
+        self.all_commands: list[commands.Command] = []
+        # Command -> (signature, short doc) for the fields of cog and group pages
+        self.fields: dict[commands.Command, tuple[str, str]] = {}
+        self.help_texts: dict[commands.Command, tuple[str, str]] = {}
+        self.cog_commands: dict[commands.Cog, list[commands.Command]] = {}
+        self.group_commands: dict[commands.Group, list[commands.Command]] = {}
+        self.visible: dict[tuple, tuple[float, frozenset[commands.Command]]] = {}
+
+    def refresh(self, help_command: "PinguHelp", bot: commands.Bot) -> None:
+        if self.generation == bot.extension_generation:
+            return
+
+        self.all_commands = sorted(
+            (command for command in bot.walk_commands() if not command.hidden), key=lambda c: c.qualified_name
+        )
+        self.fields = {
+            command: (help_command.get_command_signature(command), help_command.get_help_short_doc(command))
+            for command in self.all_commands
+        }
+        self.help_texts = {
+            command: (help_command.get_command_signature(command), help_command.get_help_text(command))
+            for command in bot.walk_commands()
+        }
+        self.cog_commands = {
+            cog: sorted((command for command in cog.get_commands() if not command.hidden), key=lambda c: c.name)
+            for cog in bot.cogs.values()
+        }
+        self.group_commands = {
+            command: sorted(
+                (subcommand for subcommand in command.commands if not subcommand.hidden), key=lambda c: c.name
+            )
+            for command in bot.walk_commands()
+            if isinstance(command, commands.Group)
+        }
+        self.visible.clear()
+        self.generation = bot.extension_generation
+
+
 class PinguHelp(commands.HelpCommand):
     """Clean embed-style help pages"""
 
@@ -13,6 +63,11 @@ class PinguHelp(commands.HelpCommand):
         super().__init__(*args, **kwargs)
         self.embed_colour = embed_colour
 
+    @property
+    def cache(self) -> HelpCache:
+        # The library makes a new copy of this class for every invocation, so the cache lives on the cog
+        return self.cog.help_cache
+
     def get_description(self):
         return f"Use {self.invoked_with} `[command]` to see more info."
 
@@ -45,24 +100,41 @@ class PinguHelp(commands.HelpCommand):
         return "..."
 
     def get_help_embed(self, command):
-        help_embed = discord.Embed(
-            title=self.get_command_signature(command),
-            description=self.get_help_text(command),
-            colour=self.embed_colour,
-        )
+        if command not in self.cache.help_texts:
+            self.cache.help_texts[command] = (self.get_command_signature(command), self.get_help_text(command))
+        title, description = self.cache.help_texts[command]
+        help_embed = discord.Embed(title=title, description=description, colour=self.embed_colour)
         help_embed.set_footer(text=self.get_footer())
         return help_embed
 
+    async def get_visible_commands(self) -> frozenset[commands.Command]:
+        """Every command that the person asking passes the checks for"""
+        self.cache.refresh(self, self.context.bot)
+        ctx = self.context
+        permissions = ctx.channel.permissions_for(ctx.author).value if ctx.guild else None
+        # Role checks (like commands.has_role) go by which roles someone has, not just the permissions they add up to
+        roles = frozenset(role.id for role in ctx.author.roles) if ctx.guild else None
+        key = (ctx.guild and ctx.guild.id, permissions, roles, await ctx.bot.is_owner(ctx.author))
+
+        cached = self.cache.visible.get(key)
+        if cached and cached[0] > monotonic():
+            return cached[1]
+        visible_commands = frozenset(await self.filter_commands(self.cache.all_commands))
+        if len(self.cache.visible) >= HelpCache.MAX_VISIBLE:
+            self.cache.visible.clear()
+        self.cache.visible[key] = (monotonic() + HelpCache.VISIBLE_TTL, visible_commands)
+        return visible_commands
+
     async def send_bot_help(self, mapping):
         embed = discord.Embed(title="Pingu Commands", colour=self.embed_colour)
         embed.description = self.get_description()
         embed.set_footer(text=self.get_footer())
 
-        # mapping != dict
-        for cog, cog_commands in mapping.items():
+        visible = await self.get_visible_commands()
+        for cog, cog_commands in self.cache.cog_commands.items():
             # Skip cogs with no class docstring
-            if cog and cog.description:
-                visible_commands = await self.filter_commands(cog_commands, sort=True)
+            if cog.description:
+                visible_commands = [command for command in cog_commands if command in visible]
                 # Skip cogs with no visible commands (either hidden or denied because of cog_check)
                 if visible_commands:
                     formatted_commands = "`, `".join(command.name for command in visible_commands)
@@ -76,13 +148,10 @@ class PinguHelp(commands.HelpCommand):
             embed.description = cog.description
         embed.set_footer(text=self.get_footer())
 
-        visible_commands = await self.filter_commands(cog.get_commands(), sort=True)
-        for command in visible_commands:
-            embed.add_field(
-                name=self.get_command_signature(command),
-                value=self.get_help_short_doc(command),
-                inline=False,
-            )
+        visible = await self.get_visible_commands()
+        visible_commands = [command for command in self.cache.cog_commands.get(cog, ()) if command in visible]
+        for name, value in (self.cache.fields[command] for command in visible_commands):
+            embed.add_field(name=name, value=value, inline=False)
         await self.get_destination().send(embed=embed)
 
     async def send_group_help(self, group):
@@ -92,20 +161,13 @@ class PinguHelp(commands.HelpCommand):
         overflow_embed.title = None
         overflow_embed.description = None
 
-        visible_commands = await self.filter_commands(group.commands, sort=True)
-        for idx, command in enumerate(visible_commands):
+        visible = await self.get_visible_commands()
+        visible_commands = [command for command in self.cache.group_commands.get(group, ()) if command in visible]
+        for idx, (name, value) in enumerate((self.cache.fields[command] for command in visible_commands)):
             if idx > max_embeds:
-                overflow_embed.add_field(
-                    name=self.get_command_signature(command),
-                    value=self.get_help_short_doc(command),
-                    inline=False,
-                )
+                overflow_embed.add_field(name=name, value=value, inline=False)
             else:
-                embed.add_field(
-                    name=self.get_command_signature(command),
-                    value=self.get_help_short_doc(command),
-                    inline=False,
-                )
+                embed.add_field(name=name, value=value, inline=False)
 
         if len(visible_commands) > max_embeds:
             embed.set_footer(text=None)
@@ -119,14 +181,25 @@ class PinguHelp(commands.HelpCommand):
         await self.get_destination().send(embed=embed)
 
     def command_not_found(self, string: str):
-        commands_list = [str(command) for command in self.context.bot.commands]
-        suggestions = "`\n- `".join(get_close_matches(string, commands_list))
+        command_suggestions = self.context.bot.command_suggestions
+        command_suggestions.refresh(self.context.bot)
+        suggestions = "`\n- `".join(command_suggestions.suggest(string))
         if suggestions:
             return f"There's no command called `{string}`, but did you mean...\n- `{suggestions}`"
         else:
             return f"{Icons.ERROR} There's no command called `{string}`"
 
     def subcommand_not_found(self, command, string: str):
+        command_suggestions = self.context.bot.command_suggestions
+        command_suggestions.refresh(self.context.bot)
+        suggestions = [
+            suggestion
+            for suggestion in command_suggestions.suggest(f"{command.qualified_name} {string}")
+            if suggestion != command.qualified_name
+        ]
+        if suggestions:
+            formatted_suggestions = "`\n- `".join(suggestions)
+            return f"There's no command called `{command}` `{string}`, but did you mean...\n- `{formatted_suggestions}`"
         return f"{Icons.ERROR} There's no command called `{command}` `{string}`."
 
 
@@ -136,12 +209,18 @@ class Help(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self._original_help_command = bot.help_command
+        self.help_cache = HelpCache()
         bot.help_command = PinguHelp(embed_colour=self.bot.embed_colour)
         bot.help_command.cog = self
 
     def cog_unload(self):
         self.bot.help_command = self._original_help_command
 
+    @commands.Cog.listener()
+    async def on_extensions_changed(self):
+        # Render the pages now instead of on the next help command
+        self.help_cache.refresh(self.bot.help_command, self.bot)
+
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(Help(bot))
@@ -10,21 +10,38 @@ from discord.ext import commands
 from discord.utils import utcnow
 from humanize import naturalsize
 from playwright.async_api import async_playwright
-from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from common.admission import Priority
+from common.budget import ConcurrencyBudget, concurrency_budget
+from common.buffer import MISSING, WriteBehindBuffer
+from common.exception import Overloaded, Unavailable
+from common.resilience import DEPENDENCIES, BreakerState, Dependency
 from common.utils import Icons
-from models import Nickname, async_session
+from models import Nickname, async_session, pool_status, query_stats, upsert
 
 
 class Misc(commands.Cog):
     """Commands not in a specific category"""
 
+    # Every /word launches a browser, and banners cost a REST call
+    WORD_BUDGET = ConcurrencyBudget(limit=2, per_guild=1, queue_size=5)
+    YOINK_BANNER_BUDGET = ConcurrencyBudget(limit=4, per_guild=2, queue_size=10)
+    MERRIAM_WEBSTER = Dependency("Merriam-Webster", timeout=45, max_concurrency=2, reset_after=120)
+
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.log = logging.getLogger(__name__)
         self.proc = psutil.Process()
         self.proc.cpu_percent()
+        # Member leaves come in bursts during raids and prunes, so batch the writes
+        self.nickname_buffer = WriteBehindBuffer(self.write_nicknames, delay=0.25, max_size=500)
+
+    async def cog_load(self) -> None:
+        self.nickname_buffer.start()
+
+    async def cog_unload(self) -> None:
+        await self.nickname_buffer.close()
 
     @app_commands.command(name="word")
     async def word_daily(self, interaction: discord.Interaction, date: str = None):
@@ -59,6 +76,32 @@ class Misc(commands.Cog):
 
         await interaction.response.defer()
         url = f"https://www.merriam-webster.com/word-of-the-day/{lookup_date}"
+
+        async def on_queued(position: int) -> None:
+            await interaction.followup.send(
+                f"Lots of people are using this right now. You're #{position} in line.", ephemeral=True
+            )
+
+        try:
+            async with Misc.WORD_BUDGET.slot(interaction.guild_id, on_queued):
+                word_info = await Misc.MERRIAM_WEBSTER.call(self.get_word_of_the_day, url)
+        except (Overloaded, Unavailable) as error:
+            await interaction.followup.send(str(error))
+            return
+        if not word_info:
+            await interaction.followup.send(
+                "Sorry, something went wrong or the website is not available. Try again later."
+            )
+            return
+
+        word, attribute, pronunciation, definition = word_info
+        description = f"*{attribute}* | {pronunciation}\n\n{definition}"
+        embed: discord.Embed = self.bot.create_embed(title=word, description=description, url=url)
+        embed.set_footer(text=f"Word of the day for {lookup_date.strftime('%B %-d, %Y')}")
+        await interaction.followup.send(embed=embed)
+
+    async def get_word_of_the_day(self, url: str) -> tuple[str, str, str, str] | None:
+        """Helper function that scrapes the word, attribute, pronunciation and definition off the page"""
         async with async_playwright() as p:
             browser = await p.chromium.launch()
             page = await browser.new_page()
@@ -77,20 +120,12 @@ class Misc(commands.Cog):
                 content_locator = page.locator('[class="wod-definition-container"]')
                 definition = await content_locator.locator(":nth-match(p, 1)").text_content()
             except TimeoutError:
-                await interaction.followup.send(
-                    "Sorry, something went wrong or the website is not available. Try again later."
-                )
-                await browser.close()
-                return
-            else:
+                return None
+            finally:
                 await browser.close()
+        return word, attribute, pronunciation, definition
 
-        description = f"*{attribute}* | {pronunciation}\n\n{definition}"
-        embed: discord.Embed = self.bot.create_embed(title=word, description=description, url=url)
-        embed.set_footer(text=f"Word of the day for {lookup_date.strftime('%B %-d, %Y')}")
-        await interaction.followup.send(embed=embed)
-
-    @commands.command(name="status", aliases=["about", "stats"])
+    @commands.command(name="status", aliases=["about", "stats"], extras={"priority": Priority.LOW})
     @commands.cooldown(rate=1, per=3.0, type=commands.BucketType.channel)
     async def pingu_status(self, ctx: commands.Context) -> None:
         """Show some detailed info about Pingu"""
@@ -143,6 +178,21 @@ class Misc(commands.Cog):
         bot_threads.sort()
         bot_pids = ", ".join(str(thread_id) for thread_id in bot_threads)
 
+        # Database connection pool
+        db_pool = pool_status()
+        breaker_icons = {BreakerState.CLOSED: "🟢", BreakerState.HALF_OPEN: "🟡", BreakerState.OPEN: "🔴"}
+
+        # Course schedules cached ahead of time
+        if schedules := self.bot.get_cog("Schedules"):
+            prefetch = schedules.prefetch_stats
+            prefetch_progress = (
+                f"**Prefetched:** {prefetch['done']}/{prefetch['queued']}\n"
+                + f"**Failed:** {prefetch['failed']}\n"
+                + f"**Running:** {'Yes' if schedules.prefetch_task and not schedules.prefetch_task.done() else 'No'}"
+            )
+        else:
+            prefetch_progress = "Not loaded"
+
         # Uptime calculations
         diff = utcnow() - self.bot.boot_time
         hrs, remainder = divmod(int(diff.total_seconds()), 3600)
@@ -191,12 +241,68 @@ class Misc(commands.Cog):
                 "Processes",
                 f"**PIDs:** {bot_pids}\n" + f"**Threads:** {len(bot_threads)}\n" + f"**Uptime:**\n{total_uptime}",
             ),
+            (
+                "Database",
+                f"**Pool:** {db_pool['checked_out']}/{db_pool['size']} in use\n"
+                + f"**Overflow:** {db_pool['overflow']}\n"
+                + f"**Avg Wait:** {db_pool['average_wait'] * 1000:.2f} ms\n"
+                + f"**Max Wait:** {db_pool['max_wait'] * 1000:.2f} ms",
+            ),
+            (
+                "Load",
+                f"**Level:** {self.bot.admission.level.name.capitalize()}\n"
+                + f"**Loop Lag:** {self.bot.admission.lag * 1000:.1f} ms\n"
+                + f"**Tasks:** {self.bot.admission.pending_tasks}\n"
+                + f"**Shed:** {sum(self.bot.admission.shed.values())}",
+            ),
+            (
+                "Dependencies",
+                "\n".join(
+                    f"{breaker_icons[dependency.state]} **{name}:** {dependency.state.value}"
+                    + (f" ({dependency.stats['failures']} failed)" if dependency.stats["failures"] else "")
+                    for name, dependency in DEPENDENCIES.items()
+                )
+                or "None",
+            ),
+            ("Schedules", prefetch_progress),
             ("Sharding", "Currently not enabled"),
         ]
         for name, value in stats_fields:
             stats_embed.add_field(name=name, value=value, inline=True)
         await ctx.send(embed=stats_embed)
 
+    @commands.command(name="queries", aliases=["sql"], hidden=True)
+    @commands.is_owner()
+    async def query_info(self, ctx: commands.Context, option: str = "") -> None:
+        """Show the slowest database queries and any repeated query patterns
+
+        - Use `reset` to clear the collected stats
+        """
+        if option.lower() == "reset":
+            query_stats.reset()
+            embed: discord.Embed = self.bot.create_embed(description=f"{Icons.SUCCESS} Cleared query stats")
+            await ctx.send(embed=embed)
+            return
+
+        embed: discord.Embed = self.bot.create_embed(title="Database Queries")
+        embed.set_footer(text=f"Slow query threshold: {query_stats.slow_threshold * 1000:.0f} ms")
+        slowest = query_stats.slowest(limit=8)
+        if not slowest:
+            embed.description = f"{Icons.ALERT} No queries have been run yet."
+        for caller, statement, timing in slowest:
+            embed.add_field(
+                name=f"{caller} • {timing.count}x • avg {timing.average * 1000:.2f} ms • max {timing.max * 1000:.2f} ms",
+                value=f"```sql\n{statement[:900]}```",
+                inline=False,
+            )
+        if query_stats.repeated:
+            repeated = "\n".join(
+                f"**{command}:** {count}x `{statement[:80]}`"
+                for (command, statement), count in list(query_stats.repeated.items())[:5]
+            )
+            embed.add_field(name="Repeated Queries (N+1)", value=repeated, inline=False)
+        await ctx.send(embed=embed)
+
     @commands.group(name="yoink", invoke_without_command=True)
     @commands.cooldown(rate=1, per=1.0, type=commands.BucketType.member)
     async def yoink(self, ctx: commands.Context, *, user: discord.Member = None) -> None:
@@ -212,6 +318,7 @@ class Misc(commands.Cog):
 
     @yoink.command(name="banner")
     @commands.cooldown(rate=1, per=10.0, type=commands.BucketType.guild)
+    @concurrency_budget(YOINK_BANNER_BUDGET)
     async def yoink_banner(self, ctx: commands.Context, *, user: discord.Member = None) -> None:
         """Steal someone's banner (but you can't steal the server profile banner)
 
@@ -282,7 +389,7 @@ class Misc(commands.Cog):
                     reply_embed.description = f"{Icons.WARN} This server has no invite background set"
                     await ctx.send(embed=reply_embed)
             case _:
-                reply_embed.description = f"{Icons.ERROR} Unknown option (or it wasn't given). Use `{self.bot.command_prefix}help yoink server` to view all available server assets."
+                reply_embed.description = f"{Icons.ERROR} Unknown option (or it wasn't given). Use `{ctx.clean_prefix}help yoink server` to view all available server assets."
                 await ctx.send(embed=reply_embed)
 
     @yoink.error
@@ -333,35 +440,25 @@ class Misc(commands.Cog):
             return "🔴"
         return "🟢"
 
-    async def get_or_create(self, session: AsyncSession, model, defaults=None, **kwargs) -> Nickname:
-        """Helper function to check if a record exists or not and create one if it does not"""
-        instance = await session.execute(select(model).filter_by(**kwargs))
-        instance = instance.scalar_one_or_none()
-        if instance:
-            return instance
-        else:
-            kwargs |= defaults or {}
-            instance = model(**kwargs)
-            try:
-                await session.add(instance)
-            except Exception:
-                instance = await session.execute(select(model).filter_by(**kwargs))
-                instance = instance.scalar_one()
-                return instance
-            else:
-                return instance
+    async def write_nicknames(self, nicknames: dict[tuple[int, int], str | None]) -> None:
+        """Upsert a batch of buffered nicknames in a single transaction"""
+        rows = [
+            {"guild_id": guild_id, "user_id": user_id, "nick": nick} for (guild_id, user_id), nick in nicknames.items()
+        ]
+        batch_size = 1000  # Stay well under the bind parameter limit
+
+        session: AsyncSession
+        async with async_session() as session:
+            async with session.begin():
+                for idx in range(0, len(rows), batch_size):
+                    await upsert(session, Nickname, rows[idx : idx + batch_size])
+        self.log.debug("Wrote %s nickname(s)", len(rows))
 
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member) -> None:
         """Automation process for a special person"""
         await self.bot.wait_until_ready()
-
-        session: AsyncSession
-        async with async_session() as session:
-            async with session.begin():
-                result = await self.get_or_create(session, Nickname, guild_id=member.guild.id)
-                result.nicknames[str(member.id)] = member.nick
-                await session.commit()
+        self.nickname_buffer.put((member.guild.id, member.id), member.nick)
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member) -> None:
@@ -379,11 +476,14 @@ class Misc(commands.Cog):
             ]
             # await member.add_roles(*roles, atomic=False)
 
-            session: AsyncSession
-            async with async_session() as session:
-                async with session.begin():
-                    result = await self.get_or_create(session, Nickname, guild_id=member.guild.id)
-                    name: str | None = result.nicknames[str(member.id)] if str(member.id) in result.nicknames else None
+            # The member may have left recently enough that the write is still buffered
+            name: str | None = self.nickname_buffer.get((member.guild.id, member.id))
+            if name is MISSING:
+                session: AsyncSession
+                async with async_session() as session:
+                    async with session.begin():
+                        result = await session.get(Nickname, (member.guild.id, member.id))
+                        name = result.nick if result else None
             await member.edit(nick=name, roles=roles)
 
 
@@ -1,13 +1,37 @@
 import asyncio
-import json
+import hashlib
 import logging
+import multiprocessing
+import os
+import random
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
 
 import aiohttp
 import discord
+from discord import app_commands
 from discord.ext import commands, tasks
-
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.budget import ConcurrencyBudget, concurrency_budget
+from common.exception import Overloaded, Unavailable
+from common.resilience import Dependency
+from common.schedules import (
+    CourseSearch,
+    PackedIndex,
+    Section,
+    SectionChange,
+    diff_sections,
+    format_time,
+    load_snapshots,
+    parse_schedule_file,
+    save_snapshot,
+)
 from common.utils import Icons
+from models import SectionWatch, async_session, upsert
 
 
 class Schedules(commands.Cog):
@@ -15,167 +39,405 @@ class Schedules(commands.Cog):
 
     SCHEDULE_URL = "https://uisnetpr01.njit.edu/courseschedule/alltitlecourselist.aspx?term="
     SEMESTER_CODES = {}
-    SEMESTER_DATA = {}
+    # Swapped out as a whole on every refresh so readers never see a partially built index
+    COURSE_INDEX = {}
+    COURSE_SEARCH = {}
     LATEST_SEMESTER = None
     LAST_UPDATE = {}
-    QUEUED_CODES = asyncio.Queue()
+    # ETag / Last-Modified / content hash of the last response for each url
+    VALIDATORS = {}
+    REFRESH_AFTER = timedelta(hours=1)
+    MAX_ATTEMPTS = 3
+    CHUNK_SIZE = 64 * 1024
+    PREFETCH_SEMESTERS = int(os.environ.get("PINGU_PREFETCH_SEMESTERS", 6))
+    PREFETCH_CONCURRENCY = 2
+    CACHE_DIR = Path(os.environ.get("PINGU_CACHE_DIR", ".cache")) / "schedules"
+    MAX_WATCHES = 10
+    # A lookup can mean downloading and parsing a whole semester
+    COURSE_BUDGET = ConcurrencyBudget(limit=4, per_guild=2, queue_size=10)
+    # Covers downloading, parsing and saving a semester (the download itself times out after 20 seconds)
+    NJIT = Dependency("NJIT", timeout=90, max_concurrency=4, failure_threshold=3, reset_after=300)
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.log = logging.getLogger(__name__)
+        self.http_session: aiohttp.ClientSession = None
+        self.parse_executor: ProcessPoolExecutor = None
+        # Fetches that are currently running, keyed by the url's semester code
+        self.pending_fetches: dict[str, asyncio.Task] = {}
+        self.prefetch_task: asyncio.Task = None
+        self.prefetch_stats = {"queued": 0, "done": 0, "failed": 0}
+        # Semester -> (course, section) -> users, so a refresh only looks up the sections that changed
+        self.watchers: dict[str, dict[tuple[str, str], set[int]]] = {}
+        self.user_watches: dict[int, set[tuple[str, str, str]]] = {}
+        self.notify_tasks: set[asyncio.Task] = set()
         self.refresh_cache.start()
 
-    def cog_unload(self) -> None:
+    async def cog_load(self) -> None:
+        """Load the semesters saved by the last run so courses can be looked up right away"""
+        self.http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=20),
+            connector=aiohttp.TCPConnector(limit=4),
+        )
+        # Parsing a semester takes long enough to hold up the gateway heartbeat, so it runs in another process
+        self.parse_executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+        session: AsyncSession
+        async with async_session() as session:
+            async with session.begin():
+                result = await session.execute(select(SectionWatch))
+                for watch in result.scalars():
+                    self.add_watch(watch.user_id, watch.semester, watch.course, watch.section)
+
+        snapshots = await asyncio.to_thread(load_snapshots, Schedules.CACHE_DIR)
+        meta = snapshots.pop("meta", None)
+        if not meta:
+            return
+
+        Schedules.LATEST_SEMESTER = meta["latest"]
+        Schedules.SEMESTER_CODES = meta["codes"]
+        Schedules.VALIDATORS = meta["validators"]
+        course_index = {}
+        for code, snapshot in snapshots.items():
+            if not isinstance(snapshot["index"], PackedIndex):
+                # Saved before indexes were packed; the next refresh replaces it
+                self.log.warning("Ignoring outdated snapshot for '%s'", code)
+                continue
+            course_index[code] = snapshot["index"]
+        Schedules.COURSE_SEARCH = await asyncio.to_thread(
+            lambda: {code: CourseSearch(index) for code, index in course_index.items()}
+        )
+        Schedules.COURSE_INDEX = course_index
+        Schedules.LAST_UPDATE = {code: snapshots[code]["updated"] for code in course_index}
+        self.log.info("Loaded cached semester data from disk: %s", list(Schedules.COURSE_INDEX.keys()))
+
+    def save_semester(self, semester_code: str, snapshot: dict, meta: dict) -> None:
+        """Persist a semester (and the shared metadata) to disk; runs in a worker thread"""
+        try:
+            save_snapshot(Schedules.CACHE_DIR / f"{semester_code}.pickle.gz", snapshot)
+            save_snapshot(Schedules.CACHE_DIR / "meta.pickle.gz", meta)
+        except OSError as exc:
+            self.log.warning("Unable to save '%s' to disk - %s: %s", semester_code, type(exc).__name__, exc)
+
+    async def cog_unload(self) -> None:
         self.refresh_cache.cancel()
+        if self.prefetch_task:
+            self.prefetch_task.cancel()
+        for fetch in self.pending_fetches.values():
+            fetch.cancel()
+        for notify_task in self.notify_tasks:
+            notify_task.cancel()
+        await self.http_session.close()
+        self.parse_executor.shutdown(wait=False, cancel_futures=True)
         self.log.info("Stopped background task and cleared cached data")
 
     @tasks.loop(hours=24)
     async def refresh_cache(self) -> None:
-        await self.get_semester_data()
+        await self.refresh_semester()
+        if not self.prefetch_task or self.prefetch_task.done():
+            self.prefetch_task = asyncio.create_task(self.prefetch_semesters(), name="schedules: prefetch")
+
+    def get_prefetch_order(self) -> list[str]:
+        """The current term first, then upcoming terms (soonest first), then past terms (most recent first)"""
+        current = Schedules.LATEST_SEMESTER
+        upcoming = sorted(code for code in Schedules.SEMESTER_CODES if code > current)
+        past = sorted((code for code in Schedules.SEMESTER_CODES if code < current), reverse=True)
+        return ([current] + upcoming + past)[: Schedules.PREFETCH_SEMESTERS]
+
+    async def prefetch_semesters(self) -> None:
+        """Warm the cache for the most relevant semesters so users don't wait on the first lookup"""
+        if not Schedules.LATEST_SEMESTER:
+            return
+
+        semesters = self.get_prefetch_order()
+        self.prefetch_stats = {"queued": len(semesters), "done": 0, "failed": 0}
+        self.log.info("Prefetching %s semester(s): %s", len(semesters), semesters)
+        limit = asyncio.Semaphore(Schedules.PREFETCH_CONCURRENCY)
+
+        async def prefetch(semester_code: str) -> None:
+            async with limit:
+                if await self.refresh_semester(semester_code, max_age=Schedules.REFRESH_AFTER):
+                    self.prefetch_stats["done"] += 1
+                else:
+                    self.prefetch_stats["failed"] += 1
+            self.log.info(
+                "Prefetched '%s' (%s/%s done, %s failed)",
+                semester_code,
+                self.prefetch_stats["done"],
+                self.prefetch_stats["queued"],
+                self.prefetch_stats["failed"],
+            )
+
+        # Tasks are created in priority order, so the semaphore lets them through in that order too
+        await asyncio.gather(*(prefetch(semester_code) for semester_code in semesters))
 
     @refresh_cache.before_loop
     async def wait_for_bot(self) -> None:
         await self.bot.wait_until_ready()
 
-    async def get_queued_schedule(self) -> None:
-        """Helper function to get schedule data from the queue"""
-        semester_code: str = await Schedules.QUEUED_CODES.get()
-        if semester_code not in Schedules.LAST_UPDATE:
-            Schedules.LAST_UPDATE[semester_code] = datetime.fromtimestamp(0)
+    @staticmethod
+    def get_url_code(semester_code: str | None) -> str:
+        """The latest semester is always fetched without a term, which gets the list of semesters along with it.
 
-        time_difference: timedelta = datetime.utcnow() - Schedules.LAST_UPDATE[semester_code]
-        if time_difference >= timedelta(hours=1):
-            Schedules.LAST_UPDATE[semester_code] = datetime.utcnow()
-            await self.get_semester_data(semester_code)
-        else:
-            self.log.info(
-                "Not updating '%s' since it was updated %s second(s) ago",
-                semester_code,
-                int(time_difference.total_seconds()),
-            )
+        That way asking for it by its code or as the latest shares one fetch and one set of validators.
+        """
+        if not semester_code or semester_code == Schedules.LATEST_SEMESTER:
+            return ""
+        return semester_code
+
+    async def refresh_semester(self, semester_code: str = None, max_age: timedelta = None) -> bool:
+        """Helper function to refresh a semester if its data is older than `max_age` (or always if not given).
 
-    async def get_semester_data(self, semester_code: str = None) -> None:
+        Everyone asking for the same semester at the same time waits on a single fetch.
+        Returns whether the semester is now up to date.
+        """
+        cached_code = semester_code or Schedules.LATEST_SEMESTER
+        if max_age and cached_code in Schedules.LAST_UPDATE:
+            time_difference: timedelta = datetime.utcnow() - Schedules.LAST_UPDATE[cached_code]
+            if time_difference < max_age:
+                self.log.debug(
+                    "Not updating '%s' since it was updated %s second(s) ago",
+                    cached_code,
+                    int(time_difference.total_seconds()),
+                )
+                return True
+
+        url_code = Schedules.get_url_code(semester_code)
+        fetch = self.pending_fetches.get(url_code)
+        if fetch is None:
+            fetch = asyncio.create_task(self.get_semester_data(url_code or None), name=f"schedules: fetch '{url_code}'")
+            self.pending_fetches[url_code] = fetch
+            fetch.add_done_callback(lambda _: self.pending_fetches.pop(url_code, None))
+        # One caller giving up (e.g. the command being cancelled) shouldn't cancel it for everyone else
+        return await asyncio.shield(fetch)
+
+    async def get_semester_data(self, semester_code: str = None) -> bool:
         """Helper function used to update the in-memory cache.
 
         Passing in a semester code will only get update the data for that semester.
         Passing in None for the semester code will update everything.
+        Network errors and server errors are retried with a jittered exponential backoff.
         """
+        for attempt in range(1, Schedules.MAX_ATTEMPTS + 1):
+            try:
+                await Schedules.NJIT.call(self.fetch_semester_data, semester_code)
+            except Unavailable as exc:
+                # Either the breaker is open or it's already too slow, so retrying would only make it worse
+                self.log.warning("Skipped getting data for '%s' - %s", semester_code, exc)
+                return False
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                retryable = not isinstance(exc, aiohttp.ClientResponseError) or exc.status >= 500
+                if not retryable or attempt == Schedules.MAX_ATTEMPTS:
+                    self.log.error(
+                        "Failed to get data for '%s' after %s attempt(s) - %s: %s",
+                        semester_code,
+                        attempt,
+                        type(exc).__name__,
+                        exc,
+                    )
+                    return False
+                delay = 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                self.log.warning(
+                    "Retrying '%s' in %.1f second(s) - %s: %s", semester_code, delay, type(exc).__name__, exc
+                )
+                await asyncio.sleep(delay)
+            except Exception as exc:
+                self.log.error(
+                    "Exception occurred while processing '%s' - %s: %s",
+                    semester_code,
+                    type(exc).__name__,
+                    exc,
+                )
+                return False
+            else:
+                return True
+        return False
+
+    async def fetch_semester_data(self, semester_code: str = None) -> None:
+        """Download and ingest a single semester (or everything if no semester code is given)"""
+        url_code = Schedules.get_url_code(semester_code)
+        semester_code = url_code or None
+        cached_code = semester_code or Schedules.LATEST_SEMESTER
+        # Only ask the server to skip the body if there's already something to fall back on
+        validators = Schedules.VALIDATORS.get(url_code, {}) if cached_code in Schedules.COURSE_INDEX else {}
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("modified"):
+            headers["If-Modified-Since"] = validators["modified"]
+
+        # The body is spooled to disk as it arrives and the worker reads it back the same way,
+        # so neither process (nor the pipe between them) ever holds the whole payload
+        download = tempfile.NamedTemporaryFile(prefix="schedule-", suffix=".jsonp", delete=False)
         try:
-            url_code = "" if not semester_code else semester_code
-            timeout = aiohttp.ClientTimeout(total=20)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(Schedules.SCHEDULE_URL + url_code) as response:
-                    if response.status == 200:
-                        raw_data = await response.text()
-                        # Trim off JSONP and load as dictionary
-                        parsed_data = json.loads(raw_data[7:-1])
-
-                        # fmt: off
-                        schedule_data = parsed_data["ws"]["WSRESPONSE"]["Subject"]
-                        if not semester_code:
-                            semester_code_map = parsed_data["ts"]["WSRESPONSE"]["SOAXREF"]
-                            # Inconsistent string / integer values from JSON :(
-                            Schedules.LATEST_SEMESTER = str(parsed_data["ct"])
-                            Schedules.SEMESTER_CODES = {
-                                semester["EDIVALUE"]: semester["DESCRIPTION"]
-                                for semester in semester_code_map
-                            }
-                            Schedules.SEMESTER_DATA[Schedules.LATEST_SEMESTER] = schedule_data
-                            Schedules.LAST_UPDATE[Schedules.LATEST_SEMESTER] = datetime.utcnow()
-                            self.log.info("Latest semester is '%s'", Schedules.LATEST_SEMESTER)
-                            self.log.info("Found semester codes: %s", list(Schedules.SEMESTER_CODES.keys()))
-                        else:
-                            Schedules.SEMESTER_DATA[semester_code] = schedule_data
-                        # fmt: on
-                        self.log.debug(
-                            "Cached semester data: %s",
-                            list(Schedules.SEMESTER_DATA.keys()),
-                        )
-                    else:
-                        self.log.error(
-                            "Failed to get data for '%s'; server responded with HTTP %s",
-                            semester_code,
-                            response.status,
-                        )
-        except Exception as exc:
-            self.log.error(
-                "Exception occurred while processing '%s' - %s: %s",
-                semester_code,
-                type(exc).__name__,
-                exc,
+            async with self.http_session.get(Schedules.SCHEDULE_URL + url_code, headers=headers) as response:
+                if response.status == 304:
+                    self.log.info("'%s' has not changed since the last refresh", cached_code)
+                    Schedules.LAST_UPDATE[cached_code] = datetime.utcnow()
+                    return
+                response.raise_for_status()
+
+                digest = hashlib.sha256()
+                with download:
+                    # Chunk-sized writes only touch the page cache, so they're fine to do on the event loop
+                    async for chunk in response.content.iter_chunked(Schedules.CHUNK_SIZE):
+                        digest.update(chunk)
+                        download.write(chunk)
+                new_validators = {
+                    "digest": digest.hexdigest(),
+                    "etag": response.headers.get("ETag"),
+                    "modified": response.headers.get("Last-Modified"),
+                }
+            if new_validators["digest"] == validators.get("digest"):
+                self.log.info("'%s' has not changed since the last refresh", cached_code)
+                Schedules.VALIDATORS[url_code] = new_validators
+                Schedules.LAST_UPDATE[cached_code] = datetime.utcnow()
+                return
+
+            # The worker does all the parsing, and the index comes back packed so it loads in one quick step
+            course_index, parsed_data = await asyncio.get_running_loop().run_in_executor(
+                self.parse_executor, parse_schedule_file, download.name, Schedules.CHUNK_SIZE
             )
+        finally:
+            download.close()
+            os.remove(download.name)
+        # Building the search off the loop costs less than sending it back from the worker and unpickling it here
+        course_search = await asyncio.to_thread(CourseSearch, course_index)
+
+        # fmt: off
+        indexed_code = semester_code
+        if not semester_code:
+            semester_code_map = parsed_data["ts"]["WSRESPONSE"]["SOAXREF"]
+            # Inconsistent string / integer values from JSON :(
+            indexed_code = str(parsed_data["ct"])
+            Schedules.LATEST_SEMESTER = indexed_code
+            Schedules.SEMESTER_CODES = {
+                semester["EDIVALUE"]: semester["DESCRIPTION"]
+                for semester in semester_code_map
+            }
+            self.log.info("Latest semester is '%s'", Schedules.LATEST_SEMESTER)
+            self.log.info("Found semester codes: %s", list(Schedules.SEMESTER_CODES.keys()))
+        # Kept around to work out what changed for anyone watching a section
+        previous_index = Schedules.COURSE_INDEX.get(indexed_code)
+        Schedules.COURSE_INDEX = {**Schedules.COURSE_INDEX, indexed_code: course_index}
+        Schedules.COURSE_SEARCH = {**Schedules.COURSE_SEARCH, indexed_code: course_search}
+        Schedules.LAST_UPDATE[indexed_code] = datetime.utcnow()
+        Schedules.VALIDATORS[url_code] = new_validators
+        # fmt: on
+        self.log.debug(
+            "Cached semester data: %s",
+            list(Schedules.COURSE_INDEX.keys()),
+        )
+        await asyncio.to_thread(
+            self.save_semester,
+            indexed_code,
+            {"index": course_index, "updated": Schedules.LAST_UPDATE[indexed_code]},
+            {
+                "latest": Schedules.LATEST_SEMESTER,
+                "codes": dict(Schedules.SEMESTER_CODES),
+                "validators": dict(Schedules.VALIDATORS),
+            },
+        )
+        if not semester_code:
+            self.log.info("Refreshed all data")
         else:
-            if not semester_code:
-                self.log.info("Refreshed all data")
-            else:
-                self.log.info("Updated '%s' with latest data", semester_code)
+            self.log.info("Updated '%s' with latest data", semester_code)
+
+        if previous_index is not None and self.watchers.get(indexed_code):
+            changes = await asyncio.to_thread(diff_sections, previous_index, course_index)
+            self.log.info("Found %s changed section(s) in '%s'", len(changes), indexed_code)
+            self.notify_watchers(indexed_code, changes)
+
+    def add_watch(self, user_id: int, semester_code: str, course_number: str, section_number: str) -> None:
+        self.watchers.setdefault(semester_code, {}).setdefault((course_number, section_number), set()).add(user_id)
+        self.user_watches.setdefault(user_id, set()).add((semester_code, course_number, section_number))
+
+    def remove_watch(self, user_id: int, semester_code: str, course_number: str, section_number: str) -> None:
+        semester_watchers = self.watchers.get(semester_code, {})
+        section_watchers = semester_watchers.get((course_number, section_number), set())
+        section_watchers.discard(user_id)
+        if not section_watchers:
+            semester_watchers.pop((course_number, section_number), None)
+        if not semester_watchers:
+            self.watchers.pop(semester_code, None)
+
+        watches = self.user_watches.get(user_id, set())
+        watches.discard((semester_code, course_number, section_number))
+        if not watches:
+            self.user_watches.pop(user_id, None)
+
+    def notify_watchers(self, semester_code: str, changes: list[SectionChange]) -> None:
+        """Match changed sections against the watches for the semester and DM whoever is affected"""
+        semester_watchers = self.watchers.get(semester_code, {})
+        user_changes: dict[int, list[SectionChange]] = {}
+        for change in changes:
+            for user_id in semester_watchers.get((change.course, change.number), ()):
+                user_changes.setdefault(user_id, []).append(change)
+        if not user_changes:
+            return
 
-    async def get_course_sections(self, course_number: str, semester_code: str) -> list[str]:
-        """Helper function that gets the sections of a course."""
-        await Schedules.QUEUED_CODES.put(semester_code)
-        await self.get_queued_schedule()
+        notify_task = asyncio.create_task(
+            self.send_watch_notifications(semester_code, user_changes), name=f"schedules: notify {semester_code}"
+        )
+        self.notify_tasks.add(notify_task)
+        notify_task.add_done_callback(self.notify_tasks.discard)
+
+    async def send_watch_notifications(self, semester_code: str, user_changes: dict[int, list[SectionChange]]) -> None:
+        for user_id, changes in user_changes.items():
+            embed: discord.Embed = self.bot.create_embed(title="Section Updates")
+            embed.set_footer(text=Schedules.SEMESTER_CODES.get(semester_code, semester_code))
+            for change in changes[:25]:
+                if descriptions := change.describe():
+                    section = change.new or change.old
+                    embed.add_field(
+                        name=f"{change.course}-{change.number} ({section.title})"[:256],
+                        value="\n".join(descriptions),
+                        inline=False,
+                    )
+            if not embed.fields:
+                continue
 
-        # Course number must be capitalized
-        prefix = course_number[:-3]
-        semester_data = Schedules.SEMESTER_DATA[semester_code]
+            try:
+                user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+                await user.send(embed=embed)
+            except discord.HTTPException as exc:
+                self.log.warning("Unable to notify %s about section changes - %s: %s", user_id, type(exc).__name__, exc)
 
-        # Needlessly complicated JSON structure :(
-        matching_course = next(
-            (subject["Course"] for subject in semester_data if subject["SUBJ"] == prefix),
-            [],
-        )
-        matching_sections = [course["Section"] for course in matching_course if course["COURSE"] == course_number]
-
-        # Put all sections into a single list
-        parsed_sections = []
-        for section in matching_sections:
-            # The JSON returns single item instead of an array with one item in it
-            if isinstance(section, list):
-                parsed_sections.extend(section)  # List of sections
-            elif isinstance(section, dict):
-                parsed_sections.append(section)  # One section
-            else:
-                self.log.error(
-                    "Failed to parse %s - %s (%s)",
-                    semester_code,
-                    section,
-                    type(section),
-                )
-        return parsed_sections
+    async def get_course_sections(self, course_number: str, semester_code: str) -> tuple[Section, ...]:
+        """Helper function that gets the sections of a course."""
+        await self.refresh_semester(semester_code, max_age=Schedules.REFRESH_AFTER)
 
-    def get_meeting_times(self, data: list | dict, course_num: str, section_num: str) -> str:
+        # Course number must be capitalized
+        course_index = Schedules.COURSE_INDEX.get(semester_code, {})
+        return course_index.get(course_number, ())
+
+    def get_missing_course_message(self, course_number: str, semester_code: str) -> str:
+        """Helper function that explains a missing course and suggests the closest ones"""
+        message = "Course number is not valid or unavailable for this semester."
+        course_search: CourseSearch = Schedules.COURSE_SEARCH.get(semester_code)
+        if course_search and (suggestions := course_search.suggest(course_number)):
+            message += " Did you mean " + ", ".join(f"`{course}`" for course in suggestions) + "?"
+        return message
+
+    def get_meeting_times(self, section: Section) -> str:
         """Helper function that formats the meeting times of a section."""
-        output = "• N/A"
+        if section.meetings is None:
+            self.log.error("Missing schedule data for %s - %s", section.course, section.number)
+            return "• Missing Data"
+        if not section.meetings:
+            return "• N/A"
         # Format times to standard 12-hour instead of 24-hour
-        try:
-            if isinstance(data, list):
-                meetings = [
-                    (
-                        meeting["MTG_DAYS"],
-                        datetime.strptime(meeting["START_TIME"], "%H%M").strftime("%I:%M %p").lstrip("0"),
-                        datetime.strptime(meeting["END_TIME"], "%H%M").strftime("%I:%M %p").lstrip("0"),
-                    )
-                    for meeting in data
-                ]
-                output = "\n".join("• {}: {} - {}".format(*meeting) for meeting in meetings)
-            elif isinstance(data, dict) and len(data) > 1:
-                output = "• {}: {} - {}".format(
-                    data["MTG_DAYS"],
-                    datetime.strptime(data["START_TIME"], "%H%M").strftime("%I:%M %p").lstrip("0"),
-                    datetime.strptime(data["END_TIME"], "%H%M").strftime("%I:%M %p").lstrip("0"),
-                )
-        except KeyError:
-            self.log.error("Missing schedule data for %s - %s", course_num, section_num)
-            output = "• Missing Data"
-
-        return output
+        return "\n".join(
+            f"• {meeting.days}: {format_time(meeting.start)} - {format_time(meeting.end)}"
+            for meeting in section.meetings
+        )
 
-    def get_schedule_embeds(self, course: str, semester: str, sections: list) -> list[discord.Embed]:
+    def get_schedule_embeds(self, course: str, semester: str, sections: tuple[Section, ...]) -> list[discord.Embed]:
         """Helper function that allows courses with more than 24 sections to display properly."""
         max_limit = 24
 
         # Common embed elements
-        course_titles = set(section["TITLE"] for section in sections if "honors" not in section["TITLE"].lower())
+        course_titles = set(section.title for section in sections if "honors" not in section.title.lower())
         header = "{} - {} ({})".format(
             Schedules.SEMESTER_CODES[semester],
             course,
@@ -206,18 +468,14 @@ class Schedules(commands.Cog):
                 self.setup_embed(continued_embed, course, section)
             return [schedule_embed, continued_embed]
 
-    def setup_embed(self, embed: discord.Embed, course: str, section: dict) -> None:
+    def setup_embed(self, embed: discord.Embed, course: str, section: Section) -> None:
         """Helper function to format the schedule information embeds."""
-        section_number = section["SECTION"]
-        instructor = section["INSTRUCTOR"] if section["INSTRUCTOR"] != ", " else "[Unassigned]"
-        filled_seats = section["ENROLLED"]
-        max_seats = section["CAPACITY"]
-        class_type = section["INSTRUCTIONMETHOD"]
-        meeting_times = self.get_meeting_times(
-            section["Schedule"] if "Schedule" in section else None,
-            course,
-            section_number,
-        )
+        section_number = section.number
+        instructor = section.instructor or "[Unassigned]"
+        filled_seats = section.enrolled
+        max_seats = section.capacity
+        class_type = section.method
+        meeting_times = self.get_meeting_times(section)
 
         section_title = f"{course}-{section_number}"
         section_info = (
@@ -231,8 +489,35 @@ class Schedules(commands.Cog):
             inline=True,
         )
 
-    @commands.command(name="course")
+    def parse_semester(self, semester: str | None) -> str:
+        """Helper function that turns a year and season (e.g. 2017 fall) into a semester code"""
+        # Default to latest if not specified
+        if not semester:
+            return Schedules.LATEST_SEMESTER
+        if semester in Schedules.SEMESTER_CODES:
+            return semester
+
+        season_map = {
+            "winter": "95",
+            "fall": "90",
+            "summer": "50",
+            "spring": "10",
+        }
+        parsed_semester = semester.lower().replace(" ", "")
+        year = parsed_semester[:4]
+        season = parsed_semester[4:]
+        if season not in season_map:
+            raise commands.BadArgument("Type the year first and then the season (e.g. 2017 fall).")
+        parsed_semester = year + season_map[season]
+        self.log.debug("Parsed semester code from user: '%s'", parsed_semester)
+
+        if parsed_semester not in Schedules.SEMESTER_CODES:
+            raise commands.BadArgument("Semester is not valid or data for this term is unavailable.")
+        return parsed_semester
+
+    @commands.group(name="course", invoke_without_command=True)
     @commands.cooldown(rate=1, per=3.0, type=commands.BucketType.member)
+    @concurrency_budget(COURSE_BUDGET)
     async def course_info(self, ctx: commands.Context, course: str, *, semester: str = None) -> None:
         """Get details about a course at NJIT
 
@@ -248,26 +533,7 @@ class Schedules(commands.Cog):
 
         # Validate semester and course
         picked_course = course.upper()
-        parsed_semester = semester
-        if parsed_semester:
-            season_map = {
-                "winter": "95",
-                "fall": "90",
-                "summer": "50",
-                "spring": "10",
-            }
-            parsed_semester = parsed_semester.lower().replace(" ", "")
-            year = parsed_semester[:4]
-            season = parsed_semester[4:]
-            if season not in season_map:
-                raise commands.BadArgument("Type the year first and then the season (e.g. 2017 fall).")
-            parsed_semester = year + season_map[season]
-            self.log.debug("Parsed semester code from user: '%s'", parsed_semester)
-
-        # Default to latest if not specified
-        picked_semester = Schedules.LATEST_SEMESTER if not parsed_semester else parsed_semester
-        if picked_semester not in Schedules.SEMESTER_CODES:
-            raise commands.BadArgument("Semester is not valid or data for this term is unavailable.")
+        picked_semester = self.parse_semester(semester)
 
         self.log.debug(
             "User requested '%s' (%s)",
@@ -281,7 +547,7 @@ class Schedules(commands.Cog):
         found_sections = await self.get_course_sections(picked_course, picked_semester)
         if not found_sections:
             await info_message.delete()
-            raise commands.BadArgument("Course number is not valid or unavailable for this semester.")
+            raise commands.BadArgument(self.get_missing_course_message(picked_course, picked_semester))
 
         # Setup course info embed(s)
         await info_message.delete()
@@ -289,19 +555,208 @@ class Schedules(commands.Cog):
         for embed in schedule_embeds:
             await ctx.send(embed=embed)
 
+    @course_info.command(name="search")
+    @commands.cooldown(rate=1, per=3.0, type=commands.BucketType.member)
+    async def course_search(self, ctx: commands.Context, *, words: str) -> None:
+        """Find courses in the latest semester by their title"""
+        course_search: CourseSearch = Schedules.COURSE_SEARCH.get(Schedules.LATEST_SEMESTER)
+        if not course_search:
+            embed: discord.Embed = self.bot.create_embed(
+                description=f"{Icons.WARN} Schedule data not available yet. Try again later."
+            )
+            await ctx.send(embed=embed)
+            return
+
+        matches = course_search.search(words)
+        if not matches:
+            raise commands.BadArgument("No courses found with a title like that.")
+        results_embed: discord.Embed = self.bot.create_embed(
+            title=f"Courses matching '{words}'"[:256],
+            description="\n".join(f"**{course}** - {course_search.titles[course]}" for course in matches),
+        )
+        results_embed.set_footer(text=Schedules.SEMESTER_CODES[Schedules.LATEST_SEMESTER])
+        await ctx.send(embed=results_embed)
+
+    def parse_section(self, section: str) -> tuple[str, str]:
+        """Helper function that splits a section (e.g. CS100-002) into the course and section numbers"""
+        course_number, _, section_number = section.strip().upper().rpartition("-")
+        if not course_number or not section_number:
+            raise commands.BadArgument("Type the course and section together (e.g. CS100-002).")
+        if section_number.isdigit():
+            section_number = section_number.zfill(3)
+        return course_number, section_number
+
+    @course_info.command(name="watch")
+    @commands.cooldown(rate=1, per=3.0, type=commands.BucketType.member)
+    async def watch_section(self, ctx: commands.Context, section: str, *, semester: str = None) -> None:
+        """Get a DM when a section changes (e.g. seats open up or an instructor is assigned)
+
+        - Type the course and section together (e.g. CS100-002)
+        - You can pick a specific semester by putting a year and season (e.g. 2017 fall)
+        """
+        if not Schedules.LATEST_SEMESTER:
+            embed: discord.Embed = self.bot.create_embed(
+                description=f"{Icons.WARN} Schedule data not available yet. Try again later."
+            )
+            await ctx.send(embed=embed)
+            return
+
+        course_number, section_number = self.parse_section(section)
+        picked_semester = self.parse_semester(semester)
+        if len(self.user_watches.get(ctx.author.id, ())) >= Schedules.MAX_WATCHES:
+            raise commands.BadArgument(f"You can only watch {Schedules.MAX_WATCHES} sections at a time.")
+
+        found_sections = await self.get_course_sections(course_number, picked_semester)
+        if not found_sections:
+            raise commands.BadArgument(self.get_missing_course_message(course_number, picked_semester))
+        if not any(found.number == section_number for found in found_sections):
+            raise commands.BadArgument(f"{course_number} does not have a section {section_number} this semester.")
+
+        session: AsyncSession
+        async with async_session() as session:
+            async with session.begin():
+                await upsert(
+                    session,
+                    SectionWatch,
+                    {
+                        "user_id": ctx.author.id,
+                        "semester": picked_semester,
+                        "course": course_number,
+                        "section": section_number,
+                    },
+                )
+        self.add_watch(ctx.author.id, picked_semester, course_number, section_number)
+
+        embed: discord.Embed = self.bot.create_embed(
+            description=f"{Icons.SUCCESS} You will get a DM when {course_number}-{section_number} "
+            f"({Schedules.SEMESTER_CODES[picked_semester]}) changes."
+        )
+        await ctx.send(embed=embed)
+
+    @course_info.command(name="unwatch")
+    async def unwatch_section(self, ctx: commands.Context, section: str) -> None:
+        """Stop getting DMs about a section"""
+        course_number, section_number = self.parse_section(section)
+        watches = [
+            (semester_code, course, number)
+            for semester_code, course, number in self.user_watches.get(ctx.author.id, ())
+            if (course, number) == (course_number, section_number)
+        ]
+        if not watches:
+            raise commands.BadArgument(f"You are not watching {course_number}-{section_number}.")
+
+        session: AsyncSession
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    delete(SectionWatch).where(
+                        (SectionWatch.user_id == ctx.author.id)
+                        & (SectionWatch.course == course_number)
+                        & (SectionWatch.section == section_number)
+                    )
+                )
+        for watch in watches:
+            self.remove_watch(ctx.author.id, *watch)
+
+        embed: discord.Embed = self.bot.create_embed(
+            description=f"{Icons.SUCCESS} Stopped watching {course_number}-{section_number}."
+        )
+        await ctx.send(embed=embed)
+
+    @course_info.command(name="watching")
+    async def list_watches(self, ctx: commands.Context) -> None:
+        """Show the sections you are watching"""
+        watches = sorted(self.user_watches.get(ctx.author.id, ()))
+        embed: discord.Embed = self.bot.create_embed(title="Watched Sections")
+        if not watches:
+            embed.description = f"{Icons.ALERT} You are not watching any sections."
+        else:
+            embed.description = "\n".join(
+                f"**{course}-{number}** ({Schedules.SEMESTER_CODES.get(semester_code, semester_code)})"
+                for semester_code, course, number in watches
+            )
+        await ctx.send(embed=embed)
+
     @course_info.error
+    @course_search.error
+    @watch_section.error
+    @unwatch_section.error
     async def course_error_handler(self, ctx: commands.Context, error) -> None:
         error_embed: discord.Embed = self.bot.create_embed()
         if isinstance(error, commands.MissingRequiredArgument):
             if error.param.name == "course":
                 error_embed.description = f"{Icons.ERROR} Missing course number."
                 await ctx.send(embed=error_embed)
+            elif error.param.name == "words":
+                error_embed.description = f"{Icons.ERROR} Missing words to search for."
+                await ctx.send(embed=error_embed)
+            elif error.param.name == "section":
+                error_embed.description = f"{Icons.ERROR} Missing section (e.g. CS100-002)."
+                await ctx.send(embed=error_embed)
         elif isinstance(error, commands.BadArgument):
             error_embed.description = f"{Icons.ERROR} {error}"
             await ctx.send(embed=error_embed)
 
+    @app_commands.command(name="course")
+    async def course_slash(self, interaction: discord.Interaction, course: str, semester: str = None) -> None:
+        """Get details about a course at NJIT
+
+        Args:
+            course (str): the course number (e.g. CS100)
+            semester (str): the semester to look in (defaults to the current one)
+        """
+        if not Schedules.LATEST_SEMESTER:
+            await interaction.response.send_message("Schedule data not available yet. Try again later.", ephemeral=True)
+            return
+        try:
+            picked_semester = self.parse_semester(semester)
+        except commands.BadArgument as error:
+            await interaction.response.send_message(str(error), ephemeral=True)
+            return
+
+        await interaction.response.defer()
+        picked_course = course.strip().upper()
+
+        async def on_queued(position: int) -> None:
+            await interaction.followup.send(
+                f"Lots of people are using this right now. You're #{position} in line.", ephemeral=True
+            )
+
+        try:
+            async with Schedules.COURSE_BUDGET.slot(interaction.guild_id, on_queued):
+                found_sections = await self.get_course_sections(picked_course, picked_semester)
+        except Overloaded as error:
+            await interaction.followup.send(str(error))
+            return
+        if not found_sections:
+            await interaction.followup.send(self.get_missing_course_message(picked_course, picked_semester))
+            return
+        for embed in self.get_schedule_embeds(picked_course, picked_semester, found_sections):
+            await interaction.followup.send(embed=embed)
+
+    @course_slash.autocomplete("course")
+    async def course_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice]:
+        # This runs on every keystroke, so only answer from what's already in memory
+        semester_code = interaction.namespace.semester
+        if semester_code not in Schedules.COURSE_SEARCH:
+            semester_code = Schedules.LATEST_SEMESTER
+        course_search: CourseSearch = Schedules.COURSE_SEARCH.get(semester_code)
+        if not course_search:
+            return []
+        return [
+            app_commands.Choice(name=f"{course} - {course_search.titles[course]}"[:100], value=course)
+            for course in course_search.complete(current)
+        ]
+
+    @course_slash.autocomplete("semester")
+    async def semester_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice]:
+        current = current.lower()
+        return [
+            app_commands.Choice(name=description, value=code)
+            for code, description in sorted(Schedules.SEMESTER_CODES.items(), reverse=True)
+            if current in description.lower()
+        ][:25]
+
 
 async def setup(bot: commands.Bot):
-    # file structure changed; this entire module needs to be reworked
-    # await bot.add_cog(Schedules(bot))
-    pass
+    await bot.add_cog(Schedules(bot))
@@ -0,0 +1,111 @@
+import logging
+import re
+
+import discord
+from discord.ext import commands
+
+from common.utils import LINK_HOSTS, Icons
+
+
+class Settings(commands.Cog):
+    """Change how Pingu works in this server"""
+
+    MAX_PREFIX_LENGTH = 5
+    HOSTNAME = re.compile(r"[a-z0-9-]+(\.[a-z0-9-]+)+")
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.log = logging.getLogger(__name__)
+
+    async def cog_check(self, ctx: commands.Context) -> bool:
+        """Only people who can manage the server can change its settings"""
+        if not ctx.guild:
+            raise commands.NoPrivateMessage()
+        return ctx.author.guild_permissions.manage_guild
+
+    @commands.group(name="settings", aliases=["config"], invoke_without_command=True)
+    async def show_settings(self, ctx: commands.Context) -> None:
+        """Show the settings for this server
+
+        - Requires the Manage Server permission
+        """
+        settings = self.bot.guild_settings.get(ctx.guild.id)
+        embed: discord.Embed = self.bot.create_embed(title=f"{ctx.guild.name} Settings")
+        embed.add_field(name="Prefix", value=f"`{settings.prefix or self.bot.default_prefix}`")
+        embed.add_field(name="Link Embeds", value="On" if settings.link_embeds else "Off")
+        embed.add_field(
+            name="Link Hosts",
+            value="\n".join(
+                f"{site.capitalize()}: `{getattr(settings, f'{site}_host') or default_host}`"
+                for site, default_host in LINK_HOSTS.items()
+            ),
+            inline=False,
+        )
+        await ctx.send(embed=embed)
+
+    @show_settings.command(name="prefix")
+    async def set_prefix(self, ctx: commands.Context, prefix: str) -> None:
+        """Change the command prefix for this server
+
+        - Use `reset` to go back to the default prefix
+        """
+        if prefix.lower() == "reset":
+            prefix = None
+        elif len(prefix) > Settings.MAX_PREFIX_LENGTH:
+            raise commands.BadArgument(f"Prefix can't be longer than {Settings.MAX_PREFIX_LENGTH} characters.")
+
+        await self.bot.guild_settings.update(ctx.guild.id, prefix=prefix)
+        embed: discord.Embed = self.bot.create_embed(
+            description=f"{Icons.SUCCESS} Prefix is now `{prefix or self.bot.default_prefix}`."
+        )
+        await ctx.send(embed=embed)
+
+    @show_settings.command(name="links")
+    async def set_link_embeds(self, ctx: commands.Context, enabled: bool) -> None:
+        """Turn reposting social media links with working embeds on or off"""
+        await self.bot.guild_settings.update(ctx.guild.id, link_embeds=enabled)
+        embed: discord.Embed = self.bot.create_embed(
+            description=f"{Icons.SUCCESS} Link embeds are now {'on' if enabled else 'off'}."
+        )
+        await ctx.send(embed=embed)
+
+    @show_settings.command(name="host")
+    async def set_link_host(self, ctx: commands.Context, site: str, host: str) -> None:
+        """Pick the site used to embed links (e.g. twitter fixupx.com)
+
+        - Sites that can be changed: tiktok, twitter, reddit
+        - Use `reset` to go back to the default site
+        """
+        site = site.lower()
+        if site not in LINK_HOSTS:
+            raise commands.BadArgument(f"Site must be one of: {', '.join(LINK_HOSTS)}.")
+        host = host.lower().removeprefix("https://").removeprefix("http://").rstrip("/")
+        if host == "reset":
+            host = None
+        elif not Settings.HOSTNAME.fullmatch(host):
+            raise commands.BadArgument("Not a valid host name (e.g. fixupx.com).")
+
+        await self.bot.guild_settings.update(ctx.guild.id, **{f"{site}_host": host})
+        embed: discord.Embed = self.bot.create_embed(
+            description=f"{Icons.SUCCESS} {site.capitalize()} links will use `{host or LINK_HOSTS[site]}`."
+        )
+        await ctx.send(embed=embed)
+
+    @set_prefix.error
+    @set_link_embeds.error
+    @set_link_host.error
+    async def settings_error_handler(self, ctx: commands.Context, error) -> None:
+        error_embed: discord.Embed = self.bot.create_embed()
+        if isinstance(error, commands.MissingRequiredArgument):
+            error_embed.description = f"{Icons.ERROR} Missing {error.param.name}."
+            await ctx.send(embed=error_embed)
+        elif isinstance(error, commands.BadBoolArgument):
+            error_embed.description = f"{Icons.ERROR} Type `on` or `off`."
+            await ctx.send(embed=error_embed)
+        elif isinstance(error, commands.BadArgument):
+            error_embed.description = f"{Icons.ERROR} {error}"
+            await ctx.send(embed=error_embed)
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(Settings(bot))
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from enum import IntEnum
+
+
+class Priority(IntEnum):
+    CRITICAL = 0  # Never shed (e.g. reminders, interactions)
+    NORMAL = 1
+    LOW = 2  # First to go (e.g. link embeds, ?status)
+
+
+class LoadLevel(IntEnum):
+    NORMAL = 0
+    BUSY = 1
+    OVERLOADED = 2
+
+
+class AdmissionController:
+    """Turns away low priority work when the event loop is falling behind.
+
+    Lag is measured by how late a short sleep wakes up. At `lag_threshold` seconds of lag (or
+    `task_threshold` pending tasks) the bot is busy and only low priority work is shed. At four
+    times the lag (or twice the tasks) it is overloaded and only critical work gets in.
+    """
+
+    def __init__(self, *, lag_threshold: float, task_threshold: int, interval: float = 0.25):
+        self.log = logging.getLogger(__name__)
+        self.lag_threshold = lag_threshold
+        self.task_threshold = task_threshold
+        self.interval = interval
+        self.lag = 0.0
+        self.pending_tasks = 0
+        self.level = LoadLevel.NORMAL
+        self.shed: dict[Priority, int] = {priority: 0 for priority in Priority}
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._monitor(), name="admission: monitor")
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def admit(self, priority: Priority) -> bool:
+        if priority == Priority.CRITICAL or priority + self.level <= Priority.LOW:
+            return True
+        self.shed[priority] += 1
+        return False
+
+    def get_level(self, scale: float = 1.0) -> LoadLevel:
+        lag_threshold = self.lag_threshold * scale
+        task_threshold = self.task_threshold * scale
+        if self.lag >= lag_threshold * 4 or self.pending_tasks >= task_threshold * 2:
+            return LoadLevel.OVERLOADED
+        if self.lag >= lag_threshold or self.pending_tasks >= task_threshold:
+            return LoadLevel.BUSY
+        return LoadLevel.NORMAL
+
+    async def _monitor(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - started - self.interval
+            # React to spikes right away, but only recover once things have been calm for a bit
+            self.lag = max(lag, self.lag * 0.8)
+            self.pending_tasks = len(asyncio.all_tasks(loop))
+
+            level = self.get_level()
+            if level < self.level:
+                # Only step down once well under the thresholds so the level doesn't flap
+                level = min(self.level, self.get_level(scale=0.5))
+            if level != self.level:
+                log = self.log.warning if level > self.level else self.log.info
+                log("Load is now %s (lag: %.0f ms, tasks: %s)", level.name, self.lag * 1000, self.pending_tasks)
+                self.level = level
@@ -0,0 +1,75 @@
+import asyncio
+from collections import deque
+from datetime import datetime
+
+import discord
+
+
+class AuditLogCache:
+    """The latest audit log entries for each guild, fed by the gateway so lookups don't need the API.
+
+    Each guild keeps a ring buffer of its last `size` entries, indexed by (action, target id).
+    Discord merges repeated actions into an existing entry without sending a new event, so a miss
+    here doesn't prove there is no entry (fall back to the API if it matters).
+    """
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self.entries: dict[int, deque[discord.AuditLogEntry]] = {}
+        self.index: dict[int, dict[tuple[discord.AuditLogAction, int], deque[discord.AuditLogEntry]]] = {}
+        self.waiters: dict[tuple[int, discord.AuditLogAction, int], list[asyncio.Future]] = {}
+
+    @staticmethod
+    def get_key(entry: discord.AuditLogEntry) -> tuple[discord.AuditLogAction, int | None]:
+        return entry.action, getattr(entry.target, "id", None)
+
+    def add(self, entry: discord.AuditLogEntry) -> None:
+        guild_id = entry.guild.id
+        entries = self.entries.setdefault(guild_id, deque())
+        index = self.index.setdefault(guild_id, {})
+        if len(entries) >= self.size:
+            # The oldest entry overall is also the oldest one under its key
+            evicted_key = self.get_key(entries.popleft())
+            index[evicted_key].popleft()
+            if not index[evicted_key]:
+                del index[evicted_key]
+
+        key = self.get_key(entry)
+        entries.append(entry)
+        index.setdefault(key, deque()).append(entry)
+        for waiter in self.waiters.pop((guild_id, *key), ()):
+            if not waiter.done():
+                waiter.set_result(entry)
+
+    def remove_guild(self, guild_id: int) -> None:
+        self.entries.pop(guild_id, None)
+        self.index.pop(guild_id, None)
+
+    def find(
+        self, guild_id: int, action: discord.AuditLogAction, target_id: int, *, after: datetime = None
+    ) -> discord.AuditLogEntry | None:
+        """The newest entry for an action on a target (optionally only if it was created after a certain time)"""
+        matches = self.index.get(guild_id, {}).get((action, target_id))
+        if not matches or (after and matches[-1].created_at < after):
+            return None
+        return matches[-1]
+
+    async def wait_for(
+        self, guild_id: int, action: discord.AuditLogAction, target_id: int, *, after: datetime, timeout: float
+    ) -> discord.AuditLogEntry | None:
+        """Like `find`, but give the gateway event a moment to arrive (it can come after the event it explains)"""
+        if entry := self.find(guild_id, action, target_id, after=after):
+            return entry
+
+        key = (guild_id, action, target_id)
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(key, []).append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if key in self.waiters and waiter in self.waiters[key]:
+                self.waiters[key].remove(waiter)
+                if not self.waiters[key]:
+                    del self.waiters[key]
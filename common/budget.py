@@ -0,0 +1,99 @@
+import asyncio
+import functools
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+
+import discord
+from discord.ext import commands
+
+from common.exception import Overloaded
+from common.utils import Icons
+
+
+class ConcurrencyBudget:
+    """Caps how many copies of something run at once, both overall and in any one guild.
+
+    Anything over the cap waits its turn in a FIFO line of at most `queue_size`, and anything past
+    that is turned away right away. Waiters whose guild is at its own cap are passed over (but keep
+    their place) so one busy server can't hold up everyone else.
+    """
+
+    def __init__(self, *, limit: int, per_guild: int, queue_size: int):
+        self.limit = limit
+        self.per_guild = per_guild
+        self.queue_size = queue_size
+        self.running = 0
+        self.guild_running: Counter = Counter()
+        self.waiting: deque[tuple[int | None, asyncio.Future]] = deque()
+
+    def has_room(self, guild_id: int | None) -> bool:
+        return self.running < self.limit and self.guild_running[guild_id] < self.per_guild
+
+    def _start(self, guild_id: int | None) -> None:
+        self.running += 1
+        self.guild_running[guild_id] += 1
+
+    def _release(self, guild_id: int | None) -> None:
+        self.running -= 1
+        self.guild_running[guild_id] -= 1
+        if not self.guild_running[guild_id]:
+            del self.guild_running[guild_id]
+
+        for entry in list(self.waiting):
+            if self.running >= self.limit:
+                break
+            waiting_guild_id, future = entry
+            if self.guild_running[waiting_guild_id] < self.per_guild:
+                self.waiting.remove(entry)
+                self._start(waiting_guild_id)
+                future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, guild_id: int | None, on_queued: Callable[[int], Awaitable[None]] = None):
+        """Wait for a turn (calling `on_queued` with the place in line if there is a wait)"""
+        # Everyone still waiting is blocked by the overall cap or their own guild's, so there's no one to cut ahead of
+        if self.has_room(guild_id):
+            self._start(guild_id)
+        else:
+            if len(self.waiting) >= self.queue_size:
+                raise Overloaded("Too many people are using this right now. Try again in a bit.")
+            future = asyncio.get_running_loop().create_future()
+            self.waiting.append((guild_id, future))
+            try:
+                if on_queued:
+                    await on_queued(len(self.waiting))
+                await future
+            except BaseException:
+                if future.done() and not future.cancelled():
+                    # Got a turn at the same time as being cancelled, so hand it on
+                    self._release(guild_id)
+                else:
+                    future.cancel()
+                    self.waiting.remove((guild_id, future))
+                raise
+
+        try:
+            yield
+        finally:
+            self._release(guild_id)
+
+
+def concurrency_budget(budget: ConcurrencyBudget):
+    """Run a prefix command inside a budget, telling the author their place in line if they have to wait"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, ctx: commands.Context, *args, **kwargs):
+            async def on_queued(position: int) -> None:
+                embed: discord.Embed = ctx.bot.create_embed(
+                    description=f"{Icons.ALERT} Lots of people are using this right now. You're #{position} in line."
+                )
+                await ctx.send(embed=embed)
+
+            async with budget.slot(ctx.guild and ctx.guild.id, on_queued):
+                return await func(self, ctx, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+MISSING = object()
+
+
+class WriteBehindBuffer:
+    """Collects writes in memory and hands them off in batches.
+
+    Only the latest value for each key is kept. A batch is flushed after `delay` seconds or as soon as
+    `max_size` keys are waiting, whichever comes first. Values stay readable through `get` until the
+    flush that writes them has finished.
+
+    A failed batch is kept for the next flush, which waits twice as long after every failure in a row
+    (up to `max_backoff` seconds). While that goes on, at most `max_pending` keys are held; past that
+    the oldest are dropped and counted in `dropped`.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[dict[Hashable, Any]], Awaitable[None]],
+        *,
+        delay: float = 0.25,
+        max_size: int = 500,
+        max_pending: int = 50_000,
+        max_backoff: float = 60.0,
+    ):
+        self.log = logging.getLogger(__name__)
+        self.delay = delay
+        self.max_size = max_size
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        # Flushes that failed in a row, and writes given up on since starting
+        self.failures = 0
+        self.dropped = 0
+        self._flush = flush
+        self._pending: dict[Hashable, Any] = {}
+        self._in_flight: dict[Hashable, Any] = {}
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=f"write-behind: {self._flush.__qualname__}")
+
+    async def close(self) -> None:
+        """Stop the background flusher and write out anything still buffered"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    @property
+    def retry_delay(self) -> float:
+        return min(self.delay * 2**self.failures, self.max_backoff)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        # Moved to the back, so that the oldest writes are always the first ones dropped
+        self._pending.pop(key, None)
+        self._pending[key] = value
+        self._trim()
+        self._wake.set()
+        if len(self._pending) >= self.max_size:
+            self._full.set()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Look up a value that has not been written yet (newest first)"""
+        if key in self._pending:
+            return self._pending[key]
+        return self._in_flight.get(key, default)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            self._wake.clear()
+            self._full.clear()
+            if not self._pending:
+                return
+
+            self._in_flight, self._pending = self._pending, {}
+            try:
+                await self._flush(self._in_flight)
+            except BaseException as exc:
+                # Keep the batch around for the next attempt, ahead of anything newer and without clobbering it
+                self._pending = {
+                    **{key: value for key, value in self._in_flight.items() if key not in self._pending},
+                    **self._pending,
+                }
+                self._trim()
+                self._wake.set()
+                if not isinstance(exc, Exception):
+                    raise
+                self.failures += 1
+                if self.failures == 1:
+                    self.log.exception("Failed to flush %s buffered write(s)", len(self._in_flight))
+                else:
+                    self.log.warning(
+                        "Failed to flush %s buffered write(s) %s times in a row (%s dropped), retrying in %.1fs - %s: %s",
+                        len(self._in_flight),
+                        self.failures,
+                        self.dropped,
+                        self.retry_delay,
+                        type(exc).__name__,
+                        exc,
+                    )
+            else:
+                if self.failures:
+                    self.log.info("Flushed buffered writes again after %s failure(s)", self.failures)
+                self.failures = 0
+            finally:
+                self._in_flight = {}
+
+    def _trim(self) -> None:
+        while len(self._pending) > self.max_pending:
+            del self._pending[next(iter(self._pending))]
+            self.dropped += 1
+
+    async def _run(self) -> None:
+        while True:
+            await self._wake.wait()
+            # Not wait_for, which swallows a cancellation (and so hangs close) that lands just as a batch fills up
+            full = asyncio.create_task(self._full.wait())
+            try:
+                await asyncio.wait((full,), timeout=self.delay)
+            finally:
+                full.cancel()
+            await self.flush()
+            if self.failures:
+                # Give whatever is failing a chance to recover instead of retrying every `delay` seconds
+                await asyncio.sleep(self.retry_delay)
@@ -23,3 +23,15 @@ class MissingVoicePermissions(PinguException):
     """Error raised when the bot is missing permissions for a voice channel."""
 
     pass
+
+
+class Overloaded(commands.CommandError):
+    """Error raised when a command is turned away because the bot is too busy."""
+
+    pass
+
+
+class Unavailable(commands.CommandError):
+    """Error raised when an outside service is down or too slow, so the call was not attempted."""
+
+    pass
@@ -0,0 +1,151 @@
+import copy
+import json
+import logging
+import queue
+import sys
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from time import monotonic, perf_counter
+
+# Set while a command is running so anything it logs says where it came from
+command_context: ContextVar[dict | None] = ContextVar("command_context", default=None)
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] %(name)s: %(message)s"
+TEXT_DATE_FORMAT = "%m-%d-%Y %I:%M:%S %p %Z"
+CONTEXT_FIELDS = ("guild", "command", "latency_ms", "suppressed")
+
+
+def start_command_context(guild_id: int | None, command: str) -> None:
+    command_context.set({"guild": guild_id, "command": command, "started": perf_counter()})
+
+
+def end_command_context() -> None:
+    command_context.set(None)
+
+
+class ContextFilter(logging.Filter):
+    """Adds the guild, command and time since the command started to records logged while a command runs"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if context := command_context.get():
+            if not hasattr(record, "guild"):
+                record.guild = context["guild"]
+            if not hasattr(record, "command"):
+                record.command = context["command"]
+            if not hasattr(record, "latency_ms"):
+                record.latency_ms = round((perf_counter() - context["started"]) * 1000, 1)
+        return True
+
+
+class DuplicateFilter(logging.Filter):
+    """Lets through at most `burst` copies of the same warning or error every `window` seconds.
+
+    Records count as the same if they come from the same logger with the same message template (and
+    exception type), whatever the arguments were. The first record let through after some were dropped
+    says how many, so nothing disappears without a trace.
+    """
+
+    def __init__(self, *, window: float = 60, burst: int = 3, max_keys: int = 1024):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [window start, records seen in the window, records dropped since the last one let through]
+        self.seen: dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+
+        exc_type = record.exc_info[0] if record.exc_info else None
+        key = (record.name, record.levelno, str(record.msg), exc_type)
+        now = monotonic()
+        entry = self.seen.get(key)
+        if not entry or now - entry[0] >= self.window:
+            if len(self.seen) >= self.max_keys:
+                self.seen = {k: v for k, v in self.seen.items() if now - v[0] < self.window}
+            suppressed = entry[2] if entry else 0
+            entry = self.seen[key] = [now, 0, suppressed]
+
+        entry[1] += 1
+        if entry[1] > self.burst:
+            entry[2] += 1
+            return False
+        if entry[2]:
+            record.suppressed = entry[2]
+            entry[2] = 0
+        return True
+
+
+class LogQueueHandler(QueueHandler):
+    """Hands records to the writer thread without formatting them first.
+
+    The message is filled in right away (its arguments could change before the writer gets to it),
+    but tracebacks and the final layout are left for the writer thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """The usual one line format, with any context fields tacked on the end"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        fields = " ".join(f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS if hasattr(record, field))
+        if not fields:
+            return message
+        # Keep tracebacks after the fields rather than splitting them up
+        first_line, newline, rest = message.partition("\n")
+        return f"{first_line} [{fields}]{newline}{rest}"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log collectors"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(
+    *, level: int = logging.INFO, json_output: bool = False, duplicate_window: float = 60
+) -> QueueListener:
+    """Send all logging through a queue to a writer thread, so logging never blocks the event loop on I/O.
+
+    Returns the listener that owns the writer thread (stop it on shutdown to flush what's left).
+    """
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if json_output else TextFormatter(TEXT_FORMAT, TEXT_DATE_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    if duplicate_window > 0:
+        queue_handler.addFilter(DuplicateFilter(window=duplicate_window))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
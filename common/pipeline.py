@@ -0,0 +1,95 @@
+import logging
+from dataclasses import dataclass
+from operator import attrgetter
+from typing import Awaitable, Callable
+
+import discord
+
+from common.admission import AdmissionController, Priority
+
+
+@dataclass(slots=True)
+class MessageFacts:
+    """Cheap things about a message that are worked out once and shared by every stage"""
+
+    message: discord.Message
+    in_guild: bool
+    from_user: bool  # Not a bot (or webhook)
+    has_prefix: bool
+    has_url: bool
+
+
+@dataclass(slots=True)
+class MessageStage:
+    name: str
+    handler: Callable[[MessageFacts], Awaitable[None]]
+    # Facts that all have to be true for the stage to run
+    requires: tuple[str, ...]
+    order: int
+    priority: Priority
+
+    def wants(self, facts: MessageFacts) -> bool:
+        for fact in self.requires:
+            if not getattr(facts, fact):
+                return False
+        return True
+
+
+class MessagePipeline:
+    """One pass over every message the bot sees, split into ordered stages.
+
+    Stages run one after the other, lowest `order` first, and are skipped without being
+    called unless every fact they require is true (or the admission controller sheds them).
+    """
+
+    def __init__(
+        self,
+        get_prefix: Callable[[discord.Message], Awaitable[str | list[str]]],
+        admission: AdmissionController = None,
+    ):
+        self.log = logging.getLogger(__name__)
+        self.get_prefix = get_prefix
+        self.admission = admission
+        self.stages: list[MessageStage] = []
+
+    def add_stage(
+        self,
+        name: str,
+        handler: Callable[[MessageFacts], Awaitable[None]],
+        *,
+        requires: tuple[str, ...] = (),
+        order: int = 100,
+        priority: Priority = Priority.NORMAL,
+    ) -> None:
+        for fact in requires:
+            if fact not in MessageFacts.__dataclass_fields__ or fact == "message":
+                raise ValueError(f"Unknown message fact '{fact}'")
+        self.remove_stage(name)
+        self.stages.append(MessageStage(name, handler, tuple(requires), order, priority))
+        self.stages.sort(key=attrgetter("order"))
+
+    def remove_stage(self, name: str) -> None:
+        self.stages = [stage for stage in self.stages if stage.name != name]
+
+    async def get_facts(self, message: discord.Message) -> MessageFacts:
+        in_guild = message.guild is not None
+        from_user = not message.author.bot
+        content = message.content
+        has_prefix = False
+        # Nothing handles DMs or bots, so don't bother looking up the prefix for them
+        if in_guild and from_user and content:
+            prefix = await self.get_prefix(message)
+            has_prefix = content.startswith(prefix if isinstance(prefix, str) else tuple(prefix))
+        return MessageFacts(message, in_guild, from_user, has_prefix, "://" in content)
+
+    async def process(self, message: discord.Message) -> None:
+        facts = await self.get_facts(message)
+        for stage in self.stages:
+            if not stage.wants(facts):
+                continue
+            if self.admission and not self.admission.admit(stage.priority):
+                continue
+            try:
+                await stage.handler(facts)
+            except Exception:
+                self.log.exception("Message stage '%s' failed", stage.name)
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from enum import Enum
+from time import monotonic
+from typing import Any, Awaitable, Callable
+
+from common.exception import Unavailable
+
+log = logging.getLogger(__name__)
+
+
+class BreakerState(Enum):
+    CLOSED = "closed"  # Calls go through
+    OPEN = "open"  # Calls fail right away
+    HALF_OPEN = "half-open"  # One call is let through to see if the service is back
+
+
+class Dependency:
+    """Guards calls to an outside service with a timeout, a bulkhead, and a circuit breaker.
+
+    After `failure_threshold` failures in a row the breaker opens and every call fails immediately
+    for `reset_after` seconds. Then a single trial call decides whether it closes or opens again.
+    At most `max_concurrency` calls are in flight; anything past that is turned away instead of
+    piling up behind a slow service.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        timeout: float,
+        max_concurrency: int,
+        failure_threshold: int = 5,
+        reset_after: float = 30.0,
+        ignore: tuple[type[BaseException], ...] = (),
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        # Exceptions that mean the call was wrong rather than the service being unhealthy
+        self.ignore = ignore
+
+        self.state = BreakerState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.in_flight = 0
+        self.stats = {"calls": 0, "failures": 0, "timeouts": 0, "rejected": 0}
+        DEPENDENCIES[name] = self
+
+    def check(self) -> None:
+        """Raise right away if a call shouldn't be attempted (this also reserves the trial call when half-open)"""
+        if self.state == BreakerState.HALF_OPEN or (
+            self.state == BreakerState.OPEN and monotonic() - self.opened_at < self.reset_after
+        ):
+            self.stats["rejected"] += 1
+            raise Unavailable(f"{self.name} is unavailable right now. Try again later.")
+        if self.in_flight >= self.max_concurrency:
+            self.stats["rejected"] += 1
+            raise Unavailable(f"{self.name} is busy right now. Try again in a bit.")
+        # Only once the call is sure to go ahead, or nothing would ever finish the trial
+        if self.state == BreakerState.OPEN:
+            self.state = BreakerState.HALF_OPEN
+            log.info("Trying %s again", self.name)
+
+    def record_success(self) -> None:
+        self.stats["calls"] += 1
+        self.consecutive_failures = 0
+        if self.state != BreakerState.CLOSED:
+            log.info("%s is back, closing its circuit breaker", self.name)
+            self.state = BreakerState.CLOSED
+
+    def record_failure(self, exc: BaseException) -> None:
+        self.stats["calls"] += 1
+        self.stats["failures"] += 1
+        self.consecutive_failures += 1
+        if self.state == BreakerState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != BreakerState.OPEN:
+                log.warning(
+                    "Opening circuit breaker for %s after %s failure(s) - %s: %s",
+                    self.name,
+                    self.consecutive_failures,
+                    type(exc).__name__,
+                    exc,
+                )
+            self.state = BreakerState.OPEN
+            self.opened_at = monotonic()
+
+    def release_trial(self) -> None:
+        # A trial call that ended without an answer (e.g. cancelled) shouldn't leave the breaker stuck half-open
+        if self.state == BreakerState.HALF_OPEN:
+            self.state = BreakerState.OPEN
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        self.check()
+        self.in_flight += 1
+        started = monotonic()
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), timeout=self.timeout)
+        except asyncio.TimeoutError as exc:
+            if monotonic() - started < self.timeout:
+                # The call timed out on its own (e.g. a shorter request timeout), so let the caller decide to retry
+                self.record_failure(exc)
+                raise
+            self.stats["timeouts"] += 1
+            self.record_failure(exc)
+            raise Unavailable(f"{self.name} took too long to respond. Try again later.") from exc
+        except self.ignore:
+            self.record_success()
+            raise
+        except Exception as exc:
+            self.record_failure(exc)
+            raise
+        except BaseException:
+            self.release_trial()
+            raise
+        else:
+            self.record_success()
+            return result
+        finally:
+            self.in_flight -= 1
+
+
+# Every dependency by name, for ?status
+DEPENDENCIES: dict[str, Dependency] = {}
@@ -0,0 +1,502 @@
+import codecs
+import gzip
+import heapq
+import json
+import logging
+import os
+import pickle
+import re
+import sys
+from bisect import bisect_left
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+log = logging.getLogger(__name__)
+
+
+class Meeting(NamedTuple):
+    days: str
+    start: int  # Minutes after midnight
+    end: int
+
+
+class Section(NamedTuple):
+    """The parts of a section that the schedule embeds actually use.
+
+    A named tuple rather than a slotted dataclass because a semester's worth of these gets pickled back
+    from the parse worker, and tuples unpickle without calling any Python code per record.
+    """
+
+    course: str
+    number: str
+    title: str
+    instructor: str  # Empty if nobody has been assigned yet
+    enrolled: int
+    capacity: int
+    method: str
+    meetings: tuple[Meeting, ...] | None  # None if the meeting data is incomplete
+
+
+def parse_time(value: str) -> int:
+    """Convert a 24-hour HHMM time into minutes after midnight"""
+    hours, minutes = divmod(int(value), 100)
+    return hours * 60 + minutes
+
+
+def format_time(minutes: int) -> str:
+    """Format minutes after midnight as a 12-hour time (e.g. 2:30 PM)"""
+    hours, minutes = divmod(minutes, 60)
+    suffix = "AM" if hours < 12 else "PM"
+    return f"{(hours % 12) or 12}:{minutes:02d} {suffix}"
+
+
+def parse_meetings(schedule: list | dict | None) -> tuple[Meeting, ...] | None:
+    # A lone dict with nothing useful in it means there are no set meeting times
+    if not schedule or (isinstance(schedule, dict) and len(schedule) <= 1):
+        return ()
+    if isinstance(schedule, dict):
+        schedule = [schedule]
+
+    try:
+        return build_meetings(
+            tuple((meeting["MTG_DAYS"], meeting["START_TIME"], meeting["END_TIME"]) for meeting in schedule)
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=4096)
+def build_meetings(times: tuple[tuple[str, str, str], ...]) -> tuple[Meeting, ...]:
+    """Sections that meet at the same times share one tuple, so it's only stored (and pickled) once"""
+    return tuple(Meeting(sys.intern(days), parse_time(start), parse_time(end)) for days, start, end in times)
+
+
+def parse_count(value: str | int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_section(course: str, section: dict) -> Section:
+    instructor = section.get("INSTRUCTOR", "")
+    return Section(
+        course=course,
+        number=section["SECTION"],
+        title=sys.intern(section.get("TITLE", "")),
+        instructor=sys.intern(instructor if instructor != ", " else ""),
+        enrolled=parse_count(section.get("ENROLLED")),
+        capacity=parse_count(section.get("CAPACITY")),
+        method=sys.intern(section.get("INSTRUCTIONMETHOD", "")),
+        meetings=parse_meetings(section.get("Schedule")),
+    )
+
+
+def normalize_sections(section: list | dict) -> list[dict]:
+    """The JSON returns a single item instead of an array when there is only one section"""
+    if isinstance(section, list):
+        return section
+    if isinstance(section, dict):
+        return [section]
+    log.error("Failed to parse section %s (%s)", section, type(section))
+    return []
+
+
+class PackedIndex(Mapping[str, tuple[Section, ...]]):
+    """A semester's course index with each course's sections kept pickled until they're looked up.
+
+    A few thousand bytes objects instead of tens of thousands of tuples: they cost less memory, come back
+    from the parse worker and load from disk in one quick step, and aren't tracked by the garbage collector,
+    so holding a few semesters doesn't make every full collection (which pauses the event loop) slower.
+    """
+
+    __slots__ = ("packed",)
+
+    def __init__(self, packed: dict[str, bytes]):
+        self.packed = packed
+
+    @classmethod
+    def pack(cls, course_index: Mapping[str, tuple[Section, ...]]) -> "PackedIndex":
+        return cls(
+            {
+                course: pickle.dumps(sections, protocol=pickle.HIGHEST_PROTOCOL)
+                for course, sections in course_index.items()
+            }
+        )
+
+    def __getitem__(self, course: str) -> tuple[Section, ...]:
+        return pickle.loads(self.packed[course])
+
+    def __iter__(self):
+        return iter(self.packed)
+
+    def __len__(self) -> int:
+        return len(self.packed)
+
+
+class CourseIndexBuilder:
+    """Builds the course number -> sections map for a semester one subject at a time"""
+
+    def __init__(self):
+        self.index: dict[str, list[Section]] = {}
+
+    def add_subject(self, subject: dict) -> None:
+        courses = subject.get("Course", [])
+        if isinstance(courses, dict):
+            courses = [courses]
+        for course in courses:
+            course_number = sys.intern(course["COURSE"])
+            sections = self.index.setdefault(course_number, [])
+            sections.extend(
+                parse_section(course_number, section) for section in normalize_sections(course.get("Section"))
+            )
+
+    def build(self) -> Mapping[str, tuple[Section, ...]]:
+        return MappingProxyType({course: tuple(sections) for course, sections in self.index.items()})
+
+
+class JsonpScheduleParser:
+    """Incrementally parses the JSONP schedule payload one chunk at a time.
+
+    Every subject in `ws.WSRESPONSE.Subject` is decoded on its own and handed to the index builder once it
+    has fully arrived, so the whole payload is never decoded (or held as one string) at once. Everything
+    else in the payload is small and gets decoded at the end, with the subject list left empty.
+    """
+
+    SUBJECT_PATH = ("ws", "WSRESPONSE", "Subject")
+    # Strings are matched whole so brackets inside them are skipped; `closed` is missing if it got cut off
+    TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(?P<closed>")?|[{}\[\]:,]')
+    SEPARATOR = re.compile(r"[\s,]*")
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.builder = CourseIndexBuilder()
+        self.buffer = ""
+        self.pos = 0
+        self.final = False
+        self.started = False  # Past the opening "callback("
+        self.finished = False  # Past the closing brace of the payload
+        self.in_subjects = False
+        self.expecting_key = False
+        self.stack: list[list] = []  # [bracket, current key] for each open object / array
+        self.skeleton: list[str] = []
+        self.retry_at = 0
+
+    def feed(self, chunk: bytes) -> None:
+        self.buffer += self.decoder.decode(chunk)
+        self.parse()
+
+    def close(self) -> tuple[Mapping[str, tuple[Section, ...]], dict]:
+        """Finish parsing and return the course index along with the rest of the payload"""
+        self.final = True
+        self.buffer += self.decoder.decode(b"", final=True)
+        self.parse()
+        if not self.finished:
+            raise ValueError("Schedule payload ended unexpectedly")
+        return self.builder.build(), json.loads("".join(self.skeleton))
+
+    def parse(self) -> None:
+        if not self.started:
+            start = self.buffer.find("(")
+            if start == -1:
+                self.buffer = ""
+                return
+            self.started = True
+            self.pos = start + 1
+
+        while not self.finished:
+            parse_step = self.parse_subjects if self.in_subjects else self.parse_structure
+            if not parse_step():
+                break
+
+        # Only hold on to what hasn't been consumed yet
+        self.buffer = self.buffer[self.pos :]
+        self.retry_at = max(0, self.retry_at - self.pos)
+        self.pos = 0
+
+    def parse_structure(self) -> bool:
+        """Walk the brackets and keys until the subject list starts; returns False when out of data"""
+        buffer = self.buffer
+        for match in JsonpScheduleParser.TOKEN.finditer(buffer, self.pos):
+            token = match.group()
+            if token[0] == '"':
+                if match.group("closed") is None:
+                    # Cut off mid-string, so wait for the rest of it
+                    self.skeleton.append(buffer[self.pos : match.start()])
+                    self.pos = match.start()
+                    return False
+                if self.expecting_key:
+                    self.stack[-1][1] = json.loads(token)
+            elif token == "{":
+                self.stack.append(["{", None])
+                self.expecting_key = True
+            elif token == "[":
+                if tuple(key for _, key in self.stack) == JsonpScheduleParser.SUBJECT_PATH:
+                    self.skeleton.append(buffer[self.pos : match.end()])
+                    self.pos = match.end()
+                    self.in_subjects = True
+                    return True
+                self.stack.append(["[", None])
+                self.expecting_key = False
+            elif token in "}]":
+                self.stack.pop()
+                self.expecting_key = False
+                if not self.stack:
+                    self.skeleton.append(buffer[self.pos : match.end()])
+                    self.pos = match.end()
+                    self.finished = True
+                    return False
+            elif token == ",":
+                self.expecting_key = self.stack[-1][0] == "{"
+            else:
+                self.expecting_key = False
+
+        self.skeleton.append(buffer[self.pos :])
+        self.pos = len(buffer)
+        return False
+
+    def parse_subjects(self) -> bool:
+        """Decode subjects one by one until the list ends; returns False when out of data"""
+        buffer = self.buffer
+        while True:
+            self.pos = JsonpScheduleParser.SEPARATOR.match(buffer, self.pos).end()
+            if self.pos >= len(buffer):
+                return False
+            if buffer[self.pos] == "]":
+                self.skeleton.append("]")
+                self.pos += 1
+                self.in_subjects = False
+                self.expecting_key = False
+                return True
+            if len(buffer) < self.retry_at and not self.final:
+                return False
+
+            try:
+                subject, self.pos = self.json_decoder.raw_decode(buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.final:
+                    raise
+                # Most likely the subject hasn't fully arrived yet, so wait until there's twice as much of it
+                self.retry_at = 2 * len(buffer) - self.pos
+                return False
+            self.retry_at = 0
+            self.builder.add_subject(subject)
+
+
+class SectionChange(NamedTuple):
+    """A section that differs between two refreshes (`old` or `new` is None if it was added or removed)"""
+
+    course: str
+    number: str
+    old: Section | None
+    new: Section | None
+
+    def describe(self) -> list[str]:
+        """The changes worth telling someone about (enrollment going up or down by itself isn't one)"""
+        old, new = self.old, self.new
+        if old is None:
+            return ["Section was added to the schedule"]
+        if new is None:
+            return ["Section was removed from the schedule"]
+
+        changes = []
+        was_full = old.enrolled >= old.capacity
+        is_full = new.enrolled >= new.capacity
+        if was_full and not is_full:
+            changes.append(f"Seats opened up ({new.enrolled}/{new.capacity} taken)")
+        elif is_full and not was_full:
+            changes.append(f"Section is now full ({new.enrolled}/{new.capacity} taken)")
+        if old.instructor != new.instructor:
+            if not old.instructor:
+                changes.append(f"Instructor assigned: {new.instructor}")
+            elif not new.instructor:
+                changes.append(f"Instructor unassigned (was {old.instructor})")
+            else:
+                changes.append(f"Instructor changed from {old.instructor} to {new.instructor}")
+        if old.meetings != new.meetings:
+            changes.append("Meeting times changed")
+        if old.method != new.method:
+            changes.append(f"Instruction method changed to {new.method or 'N/A'}")
+        return changes
+
+
+def diff_sections(old_index: Mapping[str, tuple], new_index: Mapping[str, tuple]) -> list[SectionChange]:
+    """Every section that was added, removed, or changed between two course indexes.
+
+    Most courses don't change between refreshes, so whole courses are compared first and only the ones
+    that differ are broken down by section.
+    """
+    changes = []
+    for course in old_index.keys() | new_index.keys():
+        old_sections = old_index.get(course, ())
+        new_sections = new_index.get(course, ())
+        if old_sections == new_sections:
+            continue
+
+        old_by_number = {section.number: section for section in old_sections}
+        new_by_number = {section.number: section for section in new_sections}
+        for number in old_by_number.keys() | new_by_number.keys():
+            old_section = old_by_number.get(number)
+            new_section = new_by_number.get(number)
+            if old_section != new_section:
+                changes.append(SectionChange(course, number, old_section, new_section))
+    return changes
+
+
+def get_course_title(sections: tuple[Section, ...]) -> str:
+    """Pick a representative title (honors sections usually have their own)"""
+    titles = [section.title for section in sections]
+    return next((title for title in titles if "honors" not in title.lower()), titles[0] if titles else "")
+
+
+def get_trigrams(text: str) -> set[str]:
+    """Trigrams of every word, padded so that the start and end of a word count for more"""
+    return {
+        padded[idx : idx + 3]
+        for word in text.lower().split()
+        for padded in [f"  {word} "]
+        for idx in range(len(padded) - 2)
+    }
+
+
+class TrigramIndex:
+    """Ranks keys by how many trigrams their text shares with a query (Dice coefficient).
+
+    Trigrams that a large share of the keys have (like the padded first letter of a word) would make
+    most queries walk most of the index, so candidates are looked up by the less common trigrams only and
+    the common ones are checked against those candidates with set lookups. That means a key has to share
+    at least one less common trigram with the query to be found, unless the query has none to share.
+    """
+
+    # A trigram is common once more than this share of the keys (and more than MIN_COMMON keys) have it
+    COMMON_SHARE = 0.02
+    MIN_COMMON = 64
+
+    def __init__(self, entries: dict[str, str]):
+        postings: dict[str, list[str]] = {}
+        self.sizes: dict[str, int] = {}
+        for key, text in entries.items():
+            trigrams = get_trigrams(text)
+            self.sizes[key] = len(trigrams)
+            for trigram in trigrams:
+                postings.setdefault(trigram, []).append(key)
+
+        max_postings = max(TrigramIndex.MIN_COMMON, len(entries) * TrigramIndex.COMMON_SHARE)
+        self.postings = {trigram: tuple(keys) for trigram, keys in postings.items() if len(keys) <= max_postings}
+        self.common = {trigram: frozenset(keys) for trigram, keys in postings.items() if len(keys) > max_postings}
+
+    def search(self, text: str, limit: int, threshold: float = 0.3) -> list[str]:
+        trigrams = get_trigrams(text)
+        common = sorted((self.common[trigram] for trigram in trigrams if trigram in self.common), key=len)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self.postings.get(trigram, ()))
+        if not shared and common:
+            # Nothing but common trigrams to go on, so the rarest of them will have to do
+            shared.update(common.pop(0))
+        for keys in common:
+            shared.update(keys.intersection(shared))
+
+        # Best score first, then alphabetical, so that equally close keys always come out in the same order
+        scores = ((-2 * count / (len(trigrams) + self.sizes[key]), key) for key, count in shared.items())
+        return [key for score, key in heapq.nsmallest(limit, scores) if -score >= threshold]
+
+
+# Letters that are easy to type in place of digits (e.g. CS1OO instead of CS100)
+LOOKALIKE_DIGITS = str.maketrans({"O": "0", "I": "1", "L": "1"})
+LOOKALIKE_NUMBER = re.compile(r"[0-9OIL]+")
+
+
+class CourseSearch:
+    """Search structures for a semester's courses, built once per ingest"""
+
+    def __init__(self, course_index: Mapping[str, tuple[Section, ...]]):
+        self.titles = {course: get_course_title(sections) for course, sections in course_index.items()}
+
+        # Sorted keys with a parallel list of courses, so a prefix lookup is a bisect and a short scan
+        self.number_keys = sorted(course.lower() for course in self.titles)
+        self.numbers = [key.upper() for key in self.number_keys]
+        title_entries = sorted(
+            (key, course)
+            for course, title in self.titles.items()
+            for key in {title.lower(), *title.lower().split()}
+            if key
+        )
+        self.title_keys = [key for key, _ in title_entries]
+        self.title_courses = [course for _, course in title_entries]
+
+        self.number_trigrams = TrigramIndex({course: course for course in self.titles})
+        self.title_trigrams = TrigramIndex(self.titles)
+
+    def complete(self, text: str, limit: int = 25) -> list[str]:
+        """Courses whose number, title or a word in the title starts with `text` (course numbers first)"""
+        prefix = text.strip().lower()
+        matches: dict[str, None] = {}
+        for keys, courses in ((self.number_keys, self.numbers), (self.title_keys, self.title_courses)):
+            for idx in range(bisect_left(keys, prefix), len(keys)):
+                if len(matches) >= limit or not keys[idx].startswith(prefix):
+                    break
+                matches[courses[idx]] = None
+        return list(matches)
+
+    def suggest(self, course: str, limit: int = 5) -> list[str]:
+        """The closest course numbers to one that doesn't exist"""
+        course = course.strip().upper()
+        suggestions = []
+        # Subjects can end in O, I or L too (e.g. PHIL, BIOL), so try each place the number could start,
+        # longest subject first, and only correct the digits after it
+        subject_length = len(course) - len(course.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+        for split in range(subject_length, 0, -1):
+            if not LOOKALIKE_NUMBER.fullmatch(course[split:]):
+                continue
+            corrected = course[:split] + course[split:].translate(LOOKALIKE_DIGITS)
+            if corrected != course and corrected in self.titles:
+                suggestions.append(corrected)
+                break
+        suggestions.extend(match for match in self.number_trigrams.search(course, limit) if match not in suggestions)
+        return suggestions[:limit]
+
+    def search(self, words: str, limit: int = 10) -> list[str]:
+        """Courses ranked by how closely their title matches the given words"""
+        return self.title_trigrams.search(words, limit, threshold=0.2)
+
+
+def parse_schedule_file(path: str, chunk_size: int = 64 * 1024) -> tuple[PackedIndex, dict]:
+    """Decode, normalize and index a downloaded payload; meant to run in a worker process.
+
+    The file is read a chunk at a time, so the raw payload is never all in memory. The index comes back
+    packed, since unpickling a semester of sections in one go holds the GIL, and with it the bot's event
+    loop, for as long as that takes.
+    """
+    parser = JsonpScheduleParser()
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            parser.feed(chunk)
+    course_index, rest = parser.close()
+    return PackedIndex.pack(course_index), rest
+
+
+def save_snapshot(path: Path, snapshot: dict) -> None:
+    """Write a compressed snapshot, replacing the old one only once the new one is complete"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + ".tmp")
+    with gzip.open(temp_path, "wb", compresslevel=6) as file:
+        pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def load_snapshots(directory: Path) -> dict[str, dict]:
+    """Load every snapshot in a directory, keyed by file name (without the extension)"""
+    snapshots = {}
+    for path in directory.glob("*.pickle.gz"):
+        try:
+            with gzip.open(path, "rb") as file:
+                snapshots[path.name.removesuffix(".pickle.gz")] = pickle.load(file)
+        except Exception as exc:
+            # Corrupt or written by an older version with a different record layout
+            log.warning("Ignoring unreadable snapshot '%s' - %s: %s", path, type(exc).__name__, exc)
+    return snapshots
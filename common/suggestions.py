@@ -0,0 +1,117 @@
+from discord.ext import commands
+
+
+def edit_distance(first: str, second: str) -> int:
+    """Damerau-Levenshtein distance: Levenshtein distance, except swapping two adjacent letters only counts as one edit.
+
+    Letters can still be edited after being swapped (so "ca" to "abc" is 2 edits), which the cheaper
+    "optimal string alignment" version leaves out. Without that it isn't a metric, and the BK-tree needs one.
+    """
+    infinity = len(first) + len(second)
+    # rows[i + 1][j + 1] is the distance between first[:i] and second[:j], with a border of infinity around it
+    rows = [[infinity] * (len(second) + 2), [infinity, *range(len(second) + 1)]]
+    # The last row each letter of `first` was seen in
+    last_row = {}
+    for i, first_char in enumerate(first, 1):
+        row = [infinity, i] + [0] * len(second)
+        last_match_col = 0
+        for j, second_char in enumerate(second, 1):
+            swap_row, swap_col = last_row.get(second_char, 0), last_match_col
+            if first_char == second_char:
+                cost, last_match_col = 0, j
+            else:
+                cost = 1
+            row[j + 1] = min(
+                rows[i][j] + cost,
+                row[j] + 1,
+                rows[i][j + 1] + 1,
+                # Swap the two letters, and insert or delete whatever was between them
+                rows[swap_row][swap_col] + (i - swap_row - 1) + 1 + (j - swap_col - 1),
+            )
+        rows.append(row)
+        last_row[first_char] = i
+    return rows[-1][-1]
+
+
+class BKTree:
+    """Finds every word within an edit distance of a query without comparing against all of them"""
+
+    def __init__(self, words):
+        self.root: tuple[str, dict] | None = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str) -> None:
+        if self.root is None:
+            self.root = (word, {})
+            return
+
+        node_word, children = self.root
+        while True:
+            distance = edit_distance(word, node_word)
+            if distance == 0:
+                return
+            if distance not in children:
+                children[distance] = (word, {})
+                return
+            node_word, children = children[distance]
+
+    def search(self, word: str, max_distance: int) -> list[tuple[int, str]]:
+        results = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_word, children = stack.pop()
+            distance = edit_distance(word, node_word)
+            if distance <= max_distance:
+                results.append((distance, node_word))
+            # The triangle inequality rules out every subtree outside of this range
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(results)
+
+
+class CommandSuggestions:
+    """Spelling suggestions for every way of typing a visible command (aliases and subcommands included)"""
+
+    def __init__(self):
+        self.generation = None
+        # Every name and alias path (e.g. "remindme ls") -> the command's qualified name
+        self.names: dict[str, str] = {}
+        self.depth = 0
+        self.tree = BKTree(())
+
+    def refresh(self, bot: commands.Bot) -> None:
+        if self.generation == bot.extension_generation:
+            return
+
+        names = {}
+        for command in bot.walk_commands():
+            if command.hidden or any(parent.hidden for parent in command.parents):
+                continue
+            for path in self.get_paths(command):
+                names.setdefault(path, command.qualified_name)
+        self.names = names
+        self.depth = max((name.count(" ") + 1 for name in names), default=0)
+        self.tree = BKTree(names)
+        self.generation = bot.extension_generation
+
+    def get_paths(self, command: commands.Command) -> list[str]:
+        words = [command.name, *command.aliases]
+        if not command.parent:
+            return words
+        return [f"{parent} {word}" for parent in self.get_paths(command.parent) for word in words]
+
+    def suggest(self, text: str, limit: int = 3) -> list[str]:
+        """The closest commands to what was typed, by qualified name"""
+        words = text.lower().split()
+        # Anything past the deepest command has to be arguments
+        queries = {" ".join(words[:depth]) for depth in range(1, min(len(words), self.depth) + 1)}
+        matches = sorted(
+            match for query in queries for match in self.tree.search(query, max_distance=1 if len(query) <= 5 else 2)
+        )
+
+        suggestions = {}
+        for _, name in matches:
+            suggestions[self.names[name]] = None
+        return list(suggestions)[:limit]
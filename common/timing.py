@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from datetime import datetime, time, timedelta, timezone
+from time import monotonic
+from typing import Awaitable, Callable, TypeVar
+from zoneinfo import ZoneInfo
+
+from discord.utils import sleep_until
+
+log = logging.getLogger(__name__)
+T = TypeVar("T")
+
+# Never start more than this much ahead of the deadline, however slow the warm-up request was
+MAX_LEAD = 0.25
+# Taken off the estimated one-way trip so that landing a little late is more likely than landing early
+SAFETY_MARGIN = 0.01
+# How long before firing to stop sleeping and keep checking the monotonic clock instead
+SPIN_WINDOW = 0.05
+
+
+def next_local_time(times: list[time], tz: ZoneInfo, after: datetime) -> datetime:
+    """The first of the given wall clock times that comes after `after`.
+
+    Days are stepped through as calendar dates and only then combined with the time zone,
+    so month ends and daylight saving changes land on the right instant.
+    """
+    local_after = after.astimezone(tz)
+    for days in range(3):
+        day = local_after.date() + timedelta(days=days)
+        for wall_time in sorted(times):
+            candidate = datetime.combine(day, wall_time, tzinfo=tz)
+            if candidate > local_after:
+                return candidate
+    raise ValueError("No times given")
+
+
+async def send_at(
+    deadline: datetime,
+    send: Callable[[], Awaitable[T]],
+    *,
+    warm: Callable[[], Awaitable] = None,
+    warm_before: float = 5.0,
+) -> T:
+    """Call `send` so that its request reaches the server as close to `deadline` as possible.
+
+    The long wait uses the wall clock and the last few seconds use the monotonic clock, which can't jump.
+    `warm` is called `warm_before` seconds ahead to open the connection and time a round trip, and `send`
+    then starts early by about half of that round trip (the time it takes the request to get there).
+    """
+    await sleep_until(deadline - timedelta(seconds=warm_before))
+    fire_at = monotonic() + (deadline - datetime.now(timezone.utc)).total_seconds()
+
+    if warm:
+        started = monotonic()
+        try:
+            await warm()
+        except Exception as exc:
+            log.warning("Unable to warm up the connection - %s: %s", type(exc).__name__, exc)
+        else:
+            one_way = (monotonic() - started) / 2
+            fire_at -= min(max(0.0, one_way - SAFETY_MARGIN), MAX_LEAD)
+
+    # The event loop's timers can wake up late, so sleep most of the way and then keep yielding until it's time
+    remaining = fire_at - monotonic()
+    if remaining > SPIN_WINDOW:
+        await asyncio.sleep(remaining - SPIN_WINDOW)
+    while monotonic() < fire_at:
+        await asyncio.sleep(0)
+    return await send()
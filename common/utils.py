@@ -1,5 +1,8 @@
 from enum import Enum
 
+# Sites that embed social media links properly, used unless a guild picks its own
+LINK_HOSTS = {"tiktok": "tnktok.com", "twitter": "fxtwitter.com", "reddit": "vxreddit.com"}
+
 
 class Icons(Enum):
     ALERT = ":information_source:"
@@ -1,13 +1,18 @@
+import asyncio
 import os
+from time import perf_counter
 
 from dotenv import load_dotenv
-from sqlalchemy import BigInteger, Column, Date, DateTime, Integer, Unicode
-from sqlalchemy.dialects.postgresql import HSTORE
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.ext.mutable import MutableDict
+from sqlalchemy import BigInteger, Boolean, Column, Date, DateTime, Integer, Unicode, exc, inspect, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.sql.functions import now
 
+from common.resilience import Dependency
+from models.instrumentation import QueryStats
+
 load_dotenv()
 
 Base = declarative_base()
@@ -32,9 +37,29 @@ class Reminder(Base):
 
 
 class Nickname(Base):
-    __tablename__ = "nicknames"
+    __tablename__ = "member_nicknames"
     guild_id: int = Column(BigInteger, primary_key=True)
-    nicknames: dict = Column(MutableDict.as_mutable(HSTORE), nullable=False, default={}, server_default="")
+    user_id: int = Column(BigInteger, primary_key=True)
+    nick: str = Column(Unicode)
+
+
+class GuildSettings(Base):
+    __tablename__ = "guild_settings"
+    guild_id: int = Column(BigInteger, primary_key=True)
+    # Anything left as null falls back to the bot's defaults
+    prefix: str = Column(Unicode)
+    link_embeds: bool = Column(Boolean, nullable=False, default=True, server_default=text("true"))
+    tiktok_host: str = Column(Unicode)
+    twitter_host: str = Column(Unicode)
+    reddit_host: str = Column(Unicode)
+
+
+class SectionWatch(Base):
+    __tablename__ = "section_watches"
+    user_id: int = Column(BigInteger, primary_key=True)
+    semester: str = Column(Unicode, primary_key=True)
+    course: str = Column(Unicode, primary_key=True)
+    section: str = Column(Unicode, primary_key=True)
 
 
 user = os.environ.get("POSTGRES_USER")
@@ -49,9 +74,172 @@ elif os.environ.get("DATABASE_URL") is None:
     if None in (user, pw, db, db_host, db_port):
         raise ValueError("Missing database environment variable")
 
+# Pool sizing; the defaults match SQLAlchemy except for pre-ping and recycling. Throughput stops growing once there's
+# a connection per Postgres core (see test_pool_size_sweep), so raise these only for a bigger database server
+pool_size = int(os.environ.get("POSTGRES_POOL_SIZE", 5))
+max_overflow = int(os.environ.get("POSTGRES_MAX_OVERFLOW", 10))
+pool_timeout = float(os.environ.get("POSTGRES_POOL_TIMEOUT", 30))
+pool_recycle = int(os.environ.get("POSTGRES_POOL_RECYCLE", 1800))
+# SQLAlchemy's cache of prepared statements and asyncpg's own cache underneath it
+# (pgbouncer in transaction mode can't keep prepared statements around, so set both to 0 behind it)
+statement_cache_size = int(os.environ.get("POSTGRES_STATEMENT_CACHE_SIZE", 100))
+asyncpg_statement_cache_size = int(os.environ.get("POSTGRES_ASYNCPG_STATEMENT_CACHE_SIZE", 100))
+connect_timeout = float(os.environ.get("POSTGRES_CONNECT_TIMEOUT", 5))
+command_timeout = float(os.environ.get("POSTGRES_COMMAND_TIMEOUT", 30))
+
+# The pool already limits how many connections are in use, so it acts as the bulkhead
+database = Dependency("Postgres", timeout=command_timeout, max_concurrency=pool_size + max_overflow)
+
+
+class PoolMetrics:
+    """Running totals of how long checkouts had to wait for a connection"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, elapsed: float) -> None:
+        self.checkouts += 1
+        self.total_wait += elapsed
+        self.max_wait = max(self.max_wait, elapsed)
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.checkouts if self.checkouts else 0.0
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that times every checkout (including any time spent opening an overflow connection).
+
+    Checkouts also go through the database's circuit breaker, so sessions fail right away while Postgres is down.
+    The whole checkout counts, including reconnecting a recycled connection and the pre-ping, since an idle
+    connection comes out of the queue just fine even when Postgres is gone. Timing out waiting for a free
+    connection doesn't count, since that means the bot is busy rather than Postgres being down.
+    """
+
+    def connect(self):
+        database.check()
+        start = perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            database.release_trial()
+            raise
+        except Exception as error:
+            database.record_failure(error)
+            raise
+        except BaseException:
+            database.release_trial()
+            raise
+        else:
+            database.record_success()
+            return connection
+        finally:
+            pool_metrics.record_wait(perf_counter() - start)
+
+
 engine = create_async_engine(
     database_url,
     # echo=True,
     future=True,
+    poolclass=InstrumentedPool,
+    pool_size=pool_size,
+    max_overflow=max_overflow,
+    pool_timeout=pool_timeout,
+    pool_recycle=pool_recycle,
+    pool_pre_ping=True,
+    connect_args={
+        "prepared_statement_cache_size": statement_cache_size,
+        "statement_cache_size": asyncpg_statement_cache_size,
+        "timeout": connect_timeout,
+        "command_timeout": command_timeout,
+    },
+)
+query_stats = QueryStats(
+    slow_threshold=float(os.environ.get("PINGU_SLOW_QUERY_MS", 100)) / 1000,
+    repeat_threshold=int(os.environ.get("PINGU_REPEATED_QUERY_THRESHOLD", 5)),
 )
+query_stats.attach(engine.sync_engine)
 async_session = sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession, future=True)
+
+
+async def warm_pool(connections: int = pool_size) -> None:
+    """Open connections up front so the first burst of queries doesn't pay for the handshakes"""
+
+    async def ping() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    # Checking them out concurrently forces the pool to open separate connections
+    await asyncio.gather(*(ping() for _ in range(connections)))
+
+
+async def upsert(
+    session: AsyncSession,
+    model,
+    values: dict | list[dict],
+    *,
+    index_elements: list[str] = None,
+    set_: dict = None,
+) -> None:
+    """Insert one or more rows, updating the ones that conflict, in a single statement.
+
+    Conflicting rows take the new values for every given column that isn't part of the conflict target.
+    Anything in `set_` overrides that (e.g. to copy a column from the existing row).
+    """
+    statement = insert(model).values(values)
+    if index_elements is None:
+        index_elements = [column.name for column in model.__table__.primary_key]
+
+    first_row = values[0] if isinstance(values, list) else values
+    updates = {name: statement.excluded[name] for name in first_row if name not in index_elements}
+    updates |= set_ or {}
+    if updates:
+        statement = statement.on_conflict_do_update(index_elements=index_elements, set_=updates)
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+    await session.execute(statement)
+
+
+async def insert_returning(session: AsyncSession, model, **values):
+    """Insert a row and get it back with its server-generated columns (e.g. the id) filled in"""
+    return await session.scalar(insert(model).values(**values).returning(model))
+
+
+async def migrate_legacy_nicknames(conn: AsyncConnection) -> int:
+    """Move nicknames out of the old per-guild HSTORE table into one row per member.
+
+    The old table is dropped afterwards, so this only does any work on the first start after upgrading.
+    """
+    has_legacy_table = await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table("nicknames"))
+    if not has_legacy_table:
+        return 0
+
+    result = await conn.execute(
+        text(
+            "INSERT INTO member_nicknames (guild_id, user_id, nick) "
+            "SELECT legacy.guild_id, entry.key::bigint, entry.value "
+            "FROM nicknames AS legacy CROSS JOIN LATERAL each(legacy.nicknames) AS entry(key, value) "
+            "ON CONFLICT (guild_id, user_id) DO NOTHING"
+        )
+    )
+    await conn.execute(text("DROP TABLE nicknames"))
+    return result.rowcount
+
+
+def pool_status() -> dict:
+    """Snapshot of the connection pool for status displays"""
+    pool: InstrumentedPool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        "checkouts": pool_metrics.checkouts,
+        "average_wait": pool_metrics.average_wait,
+        "max_wait": pool_metrics.max_wait,
+    }
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import re
+from collections import Counter
+from contextvars import ContextVar
+from functools import lru_cache
+from time import perf_counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Set while a command is running so its statements can be attributed to it
+current_command: ContextVar[str | None] = ContextVar("current_command", default=None)
+command_queries: ContextVar[Counter | None] = ContextVar("command_queries", default=None)
+
+PARAMETER = re.compile(r"\$\d+|%\(\w+\)s|'(?:[^']|'')*'|\b\d+\b")
+VALUES_LIST = re.compile(r"\(\?(?:::\w+)?(?:, \?(?:::\w+)?)*\)(?:, \(\?(?:::\w+)?(?:, \?(?:::\w+)?)*\))*")
+WHITESPACE = re.compile(r"\s+")
+DEFAULT_TASK_NAME = re.compile(r"Task-\d+")
+# Timings past this many (caller, statement) pairs are lumped together so the table can't grow forever
+MAX_TIMINGS = 500
+OVERFLOW_KEY = ("other", f"(everything past the first {MAX_TIMINGS} caller/statement pairs)")
+
+
+@lru_cache(maxsize=1024)
+def normalize_statement(statement: str) -> str:
+    """Strip out parameters so the same query with different values is grouped together"""
+    statement = WHITESPACE.sub(" ", statement).strip()
+    statement = PARAMETER.sub("?", statement)
+    return VALUES_LIST.sub("(...)", statement)
+
+
+def get_caller() -> str:
+    """The command running the query, or the task name (discord.py names them after the event or loop)"""
+    if command := current_command.get():
+        return command
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if not task:
+        return "unknown"
+    name = task.get_name()
+    if DEFAULT_TASK_NAME.fullmatch(name):
+        # Unnamed tasks get a new number every time, so group them by the coroutine they run instead
+        return getattr(task.get_coro(), "__qualname__", "unknown")
+    return name
+
+
+class QueryTiming:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class QueryStats:
+    """Times every statement the engine runs, grouped by caller and normalized SQL.
+
+    Statements slower than `slow_threshold` seconds are logged, and commands that run the same
+    statement at least `repeat_threshold` times are flagged as likely N+1 queries.
+    """
+
+    def __init__(self, slow_threshold: float, repeat_threshold: int):
+        self.log = logging.getLogger(__name__)
+        self.slow_threshold = slow_threshold
+        self.repeat_threshold = repeat_threshold
+        self.timings: dict[tuple[str, str], QueryTiming] = {}
+        self.repeated: dict[tuple[str, str], int] = {}
+
+    def attach(self, sync_engine: Engine) -> None:
+        event.listen(sync_engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", self.after_cursor_execute)
+        event.listen(sync_engine, "handle_error", self.handle_error)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault("query_start", []).append(perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        elapsed = perf_counter() - conn.info["query_start"].pop()
+        normalized = normalize_statement(statement)
+        caller = get_caller()
+
+        key = (caller, normalized)
+        if key not in self.timings and len(self.timings) >= MAX_TIMINGS:
+            key = OVERFLOW_KEY
+        timing = self.timings.get(key)
+        if timing is None:
+            timing = self.timings[key] = QueryTiming()
+        timing.count += 1
+        timing.total += elapsed
+        timing.max = max(timing.max, elapsed)
+
+        if (queries := command_queries.get()) is not None:
+            queries[normalized] += 1
+
+        if elapsed >= self.slow_threshold:
+            self.log.warning("Slow query (%.1f ms) from '%s': %s", elapsed * 1000, caller, normalized)
+
+    def handle_error(self, exception_context) -> None:
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_start"):
+            connection.info["query_start"].pop()
+
+    def begin_command(self, command: str) -> None:
+        current_command.set(command)
+        command_queries.set(Counter())
+
+    def end_command(self) -> None:
+        command = current_command.get()
+        queries = command_queries.get()
+        current_command.set(None)
+        command_queries.set(None)
+        if not queries:
+            return
+
+        for statement, count in queries.items():
+            if count >= self.repeat_threshold:
+                key = (command, statement)
+                self.repeated[key] = max(count, self.repeated.get(key, 0))
+                self.log.warning("'%s' ran the same query %s times (N+1?): %s", command, count, statement)
+
+    def slowest(self, limit: int = 10) -> list[tuple[str, str, QueryTiming]]:
+        ranked = sorted(self.timings.items(), key=lambda item: item[1].total, reverse=True)
+        return [(caller, statement, timing) for (caller, statement), timing in ranked[:limit]]
+
+    def reset(self) -> None:
+        self.timings.clear()
+        self.repeated.clear()
@@ -0,0 +1,45 @@
+import logging
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import GuildSettings, async_session
+
+
+class GuildSettingsCache:
+    """Every guild's settings, kept in memory so the message path never has to ask the database.
+
+    All of the rows are loaded at startup and every change goes through `update`, so a guild
+    that isn't in the cache has never changed anything and gets the defaults.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger(__name__)
+        self.defaults = GuildSettings(link_embeds=True)
+        self.settings: dict[int, GuildSettings] = {}
+
+    async def load(self) -> None:
+        session: AsyncSession
+        async with async_session() as session:
+            async with session.begin():
+                result = await session.execute(select(GuildSettings))
+                self.settings = {settings.guild_id: settings for settings in result.scalars()}
+        self.log.info("Loaded settings for %s guild(s)", len(self.settings))
+
+    def get(self, guild_id: int) -> GuildSettings:
+        return self.settings.get(guild_id, self.defaults)
+
+    async def update(self, guild_id: int, **values) -> GuildSettings:
+        """Change some of a guild's settings and get back the whole row"""
+        statement = insert(GuildSettings).values(guild_id=guild_id, **values)
+        statement = statement.on_conflict_do_update(index_elements=["guild_id"], set_=values)
+
+        session: AsyncSession
+        async with async_session() as session:
+            async with session.begin():
+                settings = await session.scalar(
+                    statement.returning(GuildSettings), execution_options={"populate_existing": True}
+                )
+        self.settings[guild_id] = settings
+        return settings
@@ -2,8 +2,6 @@
 import asyncio
 import logging
 import os
-import sys
-import traceback
 
 import discord
 from discord.ext import commands
@@ -11,8 +9,15 @@ from discord.utils import utcnow
 from dotenv import load_dotenv
 
 from cogs.auto import EmbedView
+from common.admission import AdmissionController, Priority
+from common.audit import AuditLogCache
+from common.exception import Overloaded, Unavailable
+from common.logs import end_command_context, setup_logging, start_command_context
+from common.pipeline import MessageFacts, MessagePipeline
+from common.suggestions import CommandSuggestions
 from common.utils import Icons
-from models import Base, engine
+from models import Base, engine, migrate_legacy_nicknames, pool_size, query_stats, warm_pool
+from models.settings import GuildSettingsCache
 
 
 class Pingu(commands.Bot):
@@ -21,9 +26,16 @@ class Pingu(commands.Bot):
     Commands must be created in a cog and not in here.
     """
 
+    # Events that can be dropped when the bot is falling behind (anything else is never shed)
+    LISTENER_PRIORITIES = {
+        # Only once overloaded, since a dropped one means a deleted snipe goes unnoticed
+        "message_delete": Priority.NORMAL,
+    }
+
     def __init__(
         self,
         *args,
+        default_prefix: str,
         pingu_cogs: list[str],
         lavalink_host: str,
         lavalink_port: str,
@@ -33,10 +45,12 @@ class Pingu(commands.Bot):
         pingu_version: str,
         **kwargs,
     ):
-        super().__init__(*args, **kwargs)
+        super().__init__(*args, command_prefix=Pingu.get_guild_prefix, **kwargs)
         self.log = logging.getLogger("pingu")
         self.log.info("Starting instance")
 
+        self.default_prefix = default_prefix
+        self.guild_settings = GuildSettingsCache()
         self.pingu_cogs = pingu_cogs
         self.lavalink_host = lavalink_host
         self.lavalink_port = lavalink_port
@@ -44,11 +58,82 @@ class Pingu(commands.Bot):
         self.boot_time = boot_time
         self.embed_colour = embed_colour
         self.pingu_version = pingu_version
+        # Bumped whenever commands may have changed so anything derived from them can be rebuilt
+        self.extension_generation = 0
+        self.command_suggestions = CommandSuggestions()
+        self.audit_log = AuditLogCache()
+        self.admission = AdmissionController(
+            lag_threshold=float(os.environ.get("PINGU_MAX_LOOP_LAG_MS", 100)) / 1000,
+            task_threshold=int(os.environ.get("PINGU_MAX_PENDING_TASKS", 1000)),
+        )
+        self.message_pipeline = MessagePipeline(self.get_prefix, self.admission)
+        # Commands are admitted (or turned away with a reply) by their own priority in invoke
+        self.message_pipeline.add_stage(
+            "commands",
+            self.run_commands,
+            requires=("in_guild", "from_user", "has_prefix"),
+            order=0,
+            priority=Priority.CRITICAL,
+        )
+
+        self.before_invoke(self.start_command_tracking)
+        self.after_invoke(self.stop_command_tracking)
 
     def create_embed(self, **kwargs) -> discord.Embed:
         embed_template = discord.Embed(colour=self.embed_colour, **kwargs)
         return embed_template
 
+    async def start_command_tracking(self, ctx: commands.Context) -> None:
+        """Attribute database queries and log records to the command that is running"""
+        query_stats.begin_command(ctx.command.qualified_name)
+        start_command_context(ctx.guild and ctx.guild.id, ctx.command.qualified_name)
+
+    async def stop_command_tracking(self, ctx: commands.Context) -> None:
+        query_stats.end_command()
+        end_command_context()
+
+    def get_guild_prefix(self, message: discord.Message) -> str:
+        """The prefix for the guild a message was sent in (straight from memory, since it's checked for every message)"""
+        if message.guild:
+            return self.guild_settings.get(message.guild.id).prefix or self.default_prefix
+        return self.default_prefix
+
+    def get_command_priority(self, command: commands.Command) -> Priority:
+        """Commands can set their priority with `extras={"priority": ...}` (subcommands inherit it)"""
+        for parent in (command, *command.parents):
+            if "priority" in parent.extras:
+                return parent.extras["priority"]
+        return Priority.NORMAL
+
+    def dispatch(self, event_name: str, /, *args, **kwargs) -> None:
+        priority = Pingu.LISTENER_PRIORITIES.get(event_name, Priority.CRITICAL)
+        if priority != Priority.CRITICAL and not self.admission.admit(priority):
+            return
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def invoke(self, ctx: commands.Context) -> None:
+        if ctx.command is not None and not self.admission.admit(self.get_command_priority(ctx.command)):
+            self.dispatch("command_error", ctx, Overloaded("Pingu is really busy right now. Try again in a bit."))
+            return
+        await super().invoke(ctx)
+
+    def extensions_changed(self) -> None:
+        self.extension_generation += 1
+        self.command_suggestions.refresh(self)
+        self.dispatch("extensions_changed")
+
+    async def load_extension(self, name: str, *, package: str = None) -> None:
+        await super().load_extension(name, package=package)
+        self.extensions_changed()
+
+    async def reload_extension(self, name: str, *, package: str = None) -> None:
+        await super().reload_extension(name, package=package)
+        self.extensions_changed()
+
+    async def unload_extension(self, name: str, *, package: str = None) -> None:
+        await super().unload_extension(name, package=package)
+        self.extensions_changed()
+
     async def setup_hook(self) -> None:
         self.add_view(EmbedView())
 
@@ -56,7 +141,13 @@ class Pingu(commands.Bot):
         async with engine.begin() as conn:
             # await conn.run_sync(Base.metadata.drop_all)
             await conn.run_sync(Base.metadata.create_all)
+            if migrated := await migrate_legacy_nicknames(conn):
+                self.log.info("Migrated %s nickname(s) from the legacy table", migrated)
+        await self.guild_settings.load()
         # await engine.dispose()
+        self.admission.start()
+        self.log.info("Warming up %s database connection(s)", pool_size)
+        await warm_pool()
 
         self.log.info("Loading 'jishaku'")
         await self.load_extension("jishaku")
@@ -64,6 +155,10 @@ class Pingu(commands.Bot):
             self.log.info("Loading '%s' (cogs.%s)", cog, cog)
             await self.load_extension(f"cogs.{cog}")
 
+    async def close(self) -> None:
+        self.admission.stop()
+        await super().close()
+
     async def on_ready(self):
         """Runs when the bot is ready to receive commands.
 
@@ -72,25 +167,33 @@ class Pingu(commands.Bot):
         """
         self.log.info("Instance is ready to receive commands")
 
+    async def on_audit_log_entry_create(self, entry: discord.AuditLogEntry) -> None:
+        """Keep recent audit log entries around so moderation features don't have to page through the API"""
+        self.audit_log.add(entry)
+
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        self.audit_log.remove_guild(guild.id)
+
     async def on_message(self, message: discord.Message) -> None:
-        """Actions that are performed for any message that the bot can see."""
-        # Ignore DMs or other bots
-        if not message.guild or message.author.bot:
-            return
+        """Actions that are performed for any message that the bot can see.
+
+        Cogs add stages to the message pipeline instead of listening for messages themselves.
+        """
+        await self.message_pipeline.process(message)
 
+    async def run_commands(self, facts: MessageFacts) -> None:
         # This makes sure the owner_id gets set and the query is only run once
         if not self.owner_id:
-            await self.is_owner(message.author)
+            await self.is_owner(facts.message.author)
 
         # Let the library parse the text
-        await super().process_commands(message)
+        await self.process_commands(facts.message)
 
     async def on_command_error(self, ctx: commands.Context, error) -> None:
         """Errors that occur while processing or executing a command."""
         # Errors that are unnecessary or handled locally
         ignored_errors = (
             commands.BadArgument,
-            commands.CommandNotFound,
             commands.DisabledCommand,
             commands.MissingRequiredArgument,
             commands.TooManyArguments,
@@ -100,7 +203,21 @@ class Pingu(commands.Bot):
             return
 
         error_embed = self.create_embed()
-        if isinstance(error, commands.CommandOnCooldown):
+        if isinstance(error, commands.CommandNotFound):
+            # Stay quiet unless it looks like a typo, since plenty of messages just happen to start with the prefix
+            self.command_suggestions.refresh(self)
+            suggestions = self.command_suggestions.suggest(ctx.message.content[len(ctx.prefix) :])
+            if suggestions:
+                formatted_suggestions = "`, `".join(suggestions)
+                error_embed.description = f"{Icons.HMM} There's no command called `{ctx.invoked_with}`. Did you mean `{formatted_suggestions}`?"
+                await ctx.send(embed=error_embed)
+            else:
+                self.log.debug("Ignored %s: %s", type(error).__name__, error)
+        elif isinstance(error, (Overloaded, Unavailable)):
+            self.log.debug("Turned away '%s': %s", ctx.command.qualified_name, error)
+            error_embed.description = f"{Icons.WARN} {error}"
+            await ctx.send(embed=error_embed)
+        elif isinstance(error, commands.CommandOnCooldown):
             error_embed.description = (
                 f"{Icons.WARN} Don't spam commands. Try again after {error.retry_after:.1f} second(s)."
             )
@@ -111,7 +228,17 @@ class Pingu(commands.Bot):
             await ctx.send(embed=error_embed)
         # Catch unhandled exceptions from a command
         elif isinstance(error, commands.CommandError):
-            traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+            # Error handlers run after the command has finished, so its log context has to be filled in here
+            self.log.error(
+                "Unhandled error in '%s'",
+                ctx.command.qualified_name,
+                exc_info=error,
+                extra={
+                    "guild": ctx.guild and ctx.guild.id,
+                    "command": ctx.command.qualified_name,
+                    "latency_ms": round((utcnow() - ctx.message.created_at).total_seconds() * 1000, 1),
+                },
+            )
             error_embed.description = f"{Icons.ERROR} Unexpected error occurred."
             await ctx.send(embed=error_embed)
 
@@ -123,17 +250,16 @@ async def main():
     if not TOKEN:
         raise ValueError("Token not set in $PINGU_TOKEN")
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format="[%(asctime)s] [%(levelname)s] %(name)s: %(message)s",
-        datefmt="%m-%d-%Y %I:%M:%S %p %Z",
-        stream=sys.stdout,
+    log_listener = setup_logging(
+        json_output=os.environ.get("PINGU_LOG_FORMAT", "text").lower() == "json",
+        duplicate_window=float(os.environ.get("PINGU_LOG_DUPLICATE_WINDOW", 60)),
     )
     logging.getLogger("sqlalchemy.engine.Engine").setLevel(logging.ERROR)
 
     settings = {
         "activity": discord.Activity(type=discord.ActivityType.watching, name="you 👀"),
         "description": "noot noot",
+        "default_prefix": os.environ.get("PINGU_PREFIX"),
         "intents": discord.Intents.all(),
         "status": discord.Status.online,
         "pingu_cogs": [cog[:-3] for cog in sorted(os.listdir("./cogs")) if cog.endswith(".py")],
@@ -145,8 +271,12 @@ async def main():
         "pingu_version": "2.1",
     }
 
-    async with Pingu(os.environ.get("PINGU_PREFIX"), **settings) as pingu:
-        await pingu.start(TOKEN)
+    try:
+        async with Pingu(**settings) as pingu:
+            await pingu.start(TOKEN)
+    finally:
+        # Write out anything still in the queue
+        log_listener.stop()
 
 
 if __name__ == "__main__":
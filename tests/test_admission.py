@@ -0,0 +1,122 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from common.admission import AdmissionController, LoadLevel, Priority
+from common.pipeline import MessagePipeline
+
+# Messages per second, and how long each link embed blocks the loop (about twice what the loop can keep up with)
+FLOOD_RATE = 2000
+FLOOD_SECONDS = 1.0
+LINK_EMBED_COST = 0.001
+
+
+def test_admission_levels():
+    admission = AdmissionController(lag_threshold=0.1, task_threshold=100)
+    assert all(admission.admit(priority) for priority in Priority)
+
+    admission.level = LoadLevel.BUSY
+    assert admission.admit(Priority.NORMAL) and not admission.admit(Priority.LOW)
+    admission.level = LoadLevel.OVERLOADED
+    assert admission.admit(Priority.CRITICAL) and not admission.admit(Priority.NORMAL)
+    assert admission.shed == {Priority.CRITICAL: 0, Priority.NORMAL: 1, Priority.LOW: 1}
+
+    admission.lag = 0.4
+    assert admission.get_level() == LoadLevel.OVERLOADED
+    admission.lag, admission.pending_tasks = 0, 100
+    assert admission.get_level() == LoadLevel.BUSY
+
+
+def test_commands_are_never_shed_by_the_pipeline(make_bot):
+    stages = {stage.name: stage for stage in make_bot().message_pipeline.stages}
+    # Pingu.invoke sheds commands by their own priority, which it can't do if the stage never runs
+    assert stages["commands"].priority == Priority.CRITICAL
+
+
+def test_deleted_messages_are_only_dropped_when_overloaded(make_bot):
+    async def main() -> list:
+        deleted = []
+
+        async def on_message_delete(message) -> None:
+            deleted.append(message)
+
+        async with make_bot() as bot:
+            bot.add_listener(on_message_delete)
+            for level in LoadLevel:
+                bot.admission.level = level
+                bot.dispatch("message_delete", level)
+            await asyncio.sleep(0)
+        return deleted
+
+    assert asyncio.run(main()) == [LoadLevel.NORMAL, LoadLevel.BUSY]
+
+
+async def flood(admission: AdmissionController | None) -> tuple[list[float], dict[str, int]]:
+    """Push a flood of messages with links through the pipeline, timing a heartbeat-like tick as it goes"""
+    handled = {"commands": 0, "link embeds": 0}
+
+    async def run_commands(facts) -> None:
+        handled["commands"] += 1
+
+    async def rewrite_links(facts) -> None:
+        time.sleep(LINK_EMBED_COST)
+        handled["link embeds"] += 1
+
+    async def get_prefix(message) -> str:
+        return "?"
+
+    pipeline = MessagePipeline(get_prefix, admission)
+    pipeline.add_stage(
+        "commands", run_commands, requires=("in_guild", "from_user", "has_prefix"), order=0, priority=Priority.CRITICAL
+    )
+    pipeline.add_stage("link embeds", rewrite_links, requires=("has_url",), order=100, priority=Priority.LOW)
+
+    # The gateway heartbeat is acknowledged on the loop, so its latency goes up by however far behind the loop is
+    lags = []
+
+    async def heartbeat() -> None:
+        while True:
+            expected = loop.time() + 0.02
+            await asyncio.sleep(0.02)
+            lags.append(loop.time() - expected)
+
+    loop = asyncio.get_running_loop()
+    if admission:
+        admission.start()
+    ticker = asyncio.create_task(heartbeat())
+
+    author = SimpleNamespace(bot=False)
+    message = SimpleNamespace(guild=object(), author=author, content="?help https://example.com")
+    started = loop.time()
+    total = int(FLOOD_RATE * FLOOD_SECONDS)
+    sent = 0
+    tasks = set()
+    # Messages arrive at a fixed rate however far behind the loop is, the way they would from Discord
+    while sent < total:
+        for _ in range(min(int((loop.time() - started) * FLOOD_RATE), total) - sent):
+            task = asyncio.create_task(pipeline.process(message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+        await asyncio.sleep(0.001)
+    while tasks:
+        await asyncio.gather(*tasks)
+
+    ticker.cancel()
+    if admission:
+        admission.stop()
+    assert handled["commands"] == total
+    return lags, handled
+
+
+def test_a_flood_of_messages_keeps_heartbeats_on_time():
+    admission = AdmissionController(lag_threshold=0.02, task_threshold=10_000, interval=0.02)
+    lags, handled = asyncio.run(flood(admission))
+    # Link embeds get shed as soon as the loop falls behind, so the heartbeat never does by much
+    assert admission.shed[Priority.LOW] > 0 and handled["link embeds"] > 0
+    assert max(lags) < 0.15
+
+    # Without shedding the backlog only ever grows, so the last heartbeats are the latest
+    unshed_lags, unshed_handled = asyncio.run(flood(None))
+    assert unshed_handled["link embeds"] == unshed_handled["commands"]
+    assert max(unshed_lags) > 0.3
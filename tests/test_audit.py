@@ -0,0 +1,91 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from discord import AuditLogAction
+
+from common.audit import AuditLogCache
+
+START = datetime(2024, 9, 1, tzinfo=timezone.utc)
+
+
+def get_entry(target_id: int, action: AuditLogAction = AuditLogAction.message_delete, minutes: int = 0, guild_id=1):
+    return SimpleNamespace(
+        guild=SimpleNamespace(id=guild_id),
+        action=action,
+        target=SimpleNamespace(id=target_id),
+        created_at=START + timedelta(minutes=minutes),
+    )
+
+
+def test_only_the_latest_entries_are_kept():
+    cache = AuditLogCache(size=3)
+    entries = [get_entry(5), get_entry(5, minutes=1), get_entry(6, minutes=2), get_entry(7, AuditLogAction.ban)]
+    for entry in entries:
+        cache.add(entry)
+
+    # The oldest entry went first, and its key only has the newer one left
+    assert list(cache.entries[1]) == entries[1:]
+    assert list(cache.index[1][(AuditLogAction.message_delete, 5)]) == [entries[1]]
+    cache.add(get_entry(8, minutes=4))
+    assert (AuditLogAction.message_delete, 5) not in cache.index[1]
+    assert sum(len(entries) for entries in cache.index[1].values()) == 3
+
+
+def test_find_goes_by_guild_action_target_and_time():
+    cache = AuditLogCache()
+    old, new = get_entry(5), get_entry(5, minutes=10)
+    cache.add(old)
+    cache.add(new)
+    cache.add(get_entry(5, guild_id=2))
+
+    assert cache.find(1, AuditLogAction.message_delete, 5) is new
+    assert cache.find(1, AuditLogAction.message_delete, 5, after=START + timedelta(minutes=5)) is new
+    assert cache.find(1, AuditLogAction.message_delete, 5, after=START + timedelta(minutes=15)) is None
+    assert cache.find(1, AuditLogAction.ban, 5) is None
+    assert cache.find(3, AuditLogAction.message_delete, 5) is None
+
+    cache.remove_guild(1)
+    assert cache.find(1, AuditLogAction.message_delete, 5) is None
+    assert cache.find(2, AuditLogAction.message_delete, 5) is not None
+
+
+def test_waiters_get_the_entry_when_it_arrives():
+    async def main():
+        cache = AuditLogCache()
+        waiting = [
+            asyncio.create_task(cache.wait_for(1, AuditLogAction.message_delete, 5, after=START, timeout=1))
+            for _ in range(2)
+        ]
+        other = asyncio.create_task(cache.wait_for(1, AuditLogAction.ban, 5, after=START, timeout=0.05))
+        await asyncio.sleep(0)
+        entry = get_entry(5)
+        cache.add(entry)
+
+        assert await asyncio.gather(*waiting) == [entry, entry]
+        # Nobody is left waiting once the entry shows up, or once it's been long enough
+        assert await other is None
+        assert not cache.waiters
+
+        # An entry that's already there comes back without waiting
+        assert await cache.wait_for(1, AuditLogAction.message_delete, 5, after=START, timeout=0) is entry
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiters_are_cleaned_up():
+    async def main():
+        cache = AuditLogCache()
+        waiter = asyncio.create_task(cache.wait_for(1, AuditLogAction.kick, 5, after=START, timeout=1))
+        await asyncio.sleep(0)
+        assert len(cache.waiters[(1, AuditLogAction.kick, 5)]) == 1
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert not cache.waiters
+        # Adding the entry afterwards doesn't trip over the cancelled waiter
+        cache.add(get_entry(5, AuditLogAction.kick))
+
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from common.budget import ConcurrencyBudget
+from common.exception import Overloaded
+
+
+async def hold(budget: ConcurrencyBudget, guild_id: int, started: list, release: asyncio.Event, positions: list = None):
+    async def on_queued(position: int) -> None:
+        positions.append((guild_id, position))
+
+    async with budget.slot(guild_id, on_queued if positions is not None else None):
+        started.append(guild_id)
+        await release.wait()
+
+
+def test_a_busy_guild_cant_hold_up_everyone_else():
+    async def main():
+        budget = ConcurrencyBudget(limit=2, per_guild=1, queue_size=5)
+        started, positions = [], []
+        release = {guild_id: asyncio.Event() for guild_id in (1, 2, 3)}
+        tasks = [asyncio.create_task(hold(budget, 1, started, release[1], positions))]
+        await asyncio.sleep(0)
+        # Guild 1 is at its own cap, so its second run waits even though there is room overall
+        tasks.append(asyncio.create_task(hold(budget, 1, started, release[1], positions)))
+        tasks.append(asyncio.create_task(hold(budget, 2, started, release[2], positions)))
+        await asyncio.sleep(0)
+        assert started == [1, 2] and positions == [(1, 1)]
+
+        # The next turn goes to guild 3, which is behind guild 1 in line but not at its cap
+        tasks.append(asyncio.create_task(hold(budget, 3, started, release[3], positions)))
+        await asyncio.sleep(0)
+        assert positions == [(1, 1), (3, 2)]
+        release[2].set()
+        # One pass for guild 2 to finish and one for guild 3 to start
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert started == [1, 2, 3] and budget.running == 2
+
+        release[1].set()
+        release[3].set()
+        await asyncio.gather(*tasks)
+        assert started == [1, 2, 3, 1]
+        assert budget.running == 0 and not budget.guild_running and not budget.waiting
+
+    asyncio.run(main())
+
+
+def test_a_full_line_turns_people_away():
+    async def main():
+        budget = ConcurrencyBudget(limit=1, per_guild=1, queue_size=1)
+        started, release = [], asyncio.Event()
+        running = asyncio.create_task(hold(budget, 1, started, release))
+        waiting = asyncio.create_task(hold(budget, 2, started, release))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await hold(budget, 3, started, release)
+
+        release.set()
+        await asyncio.gather(running, waiting)
+        assert started == [1, 2]
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiters_give_up_their_place():
+    async def main():
+        budget = ConcurrencyBudget(limit=1, per_guild=1, queue_size=5)
+        started, release = [], asyncio.Event()
+        running = asyncio.create_task(hold(budget, 1, started, release))
+        gave_up = asyncio.create_task(hold(budget, 2, started, release))
+        behind = asyncio.create_task(hold(budget, 3, started, release))
+        await asyncio.sleep(0)
+
+        gave_up.cancel()
+        await asyncio.sleep(0)
+        assert len(budget.waiting) == 1
+        release.set()
+        await asyncio.gather(running, behind)
+        assert started == [1, 3]
+
+        # A waiter cancelled right after being handed a turn passes the turn on instead of keeping it
+        release.clear()
+        running = asyncio.create_task(hold(budget, 1, started, release))
+        unlucky = asyncio.create_task(hold(budget, 2, started, release))
+        behind = asyncio.create_task(hold(budget, 3, started, release))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.sleep(0)
+        unlucky.cancel()
+        await asyncio.gather(running, behind)
+        assert unlucky.cancelled() and started == [1, 3, 1, 3]
+        assert budget.running == 0
+
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+import asyncio
+
+from common.buffer import MISSING, WriteBehindBuffer
+
+
+class Store:
+    """Where flushed batches end up, failing for as long as `down` is set"""
+
+    def __init__(self):
+        self.batches = []
+        self.down = False
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def write(self, batch: dict) -> None:
+        await self.release.wait()
+        if self.down:
+            raise ConnectionError("connection refused")
+        self.batches.append(dict(batch))
+
+
+def test_writes_are_readable_until_they_are_flushed():
+    async def main():
+        store = Store()
+        buffer = WriteBehindBuffer(store.write, delay=60)
+        buffer.put("a", 1)
+        assert buffer.get("a") == 1 and buffer.get("b") is MISSING and buffer.get("b", None) is None
+
+        # Still readable while the flush that writes it is waiting on the database
+        store.release.clear()
+        flushing = asyncio.create_task(buffer.flush())
+        await asyncio.sleep(0)
+        assert len(buffer) == 0 and buffer.get("a") == 1
+        buffer.put("a", 2)
+        store.release.set()
+        await flushing
+        assert store.batches == [{"a": 1}]
+        # The newer value is still waiting for its own flush, so it's the one that comes back
+        assert buffer.get("a") == 2
+
+        await buffer.flush()
+        assert buffer.get("a") is MISSING and store.batches == [{"a": 1}, {"a": 2}]
+
+    asyncio.run(main())
+
+
+def test_only_the_last_write_for_a_key_is_flushed():
+    async def main():
+        store = Store()
+        buffer = WriteBehindBuffer(store.write, delay=60, max_size=3)
+        buffer.start()
+        for value in range(100):
+            buffer.put("a", value)
+        buffer.put("b", "first")
+        buffer.put("b", None)
+        await buffer.flush()
+        assert store.batches == [{"a": 99, "b": None}]
+
+        # A full batch goes out without waiting for the delay
+        for key in "cde":
+            buffer.put(key, key)
+        await asyncio.sleep(0.01)
+        assert store.batches[-1] == {"c": "c", "d": "d", "e": "e"}
+        await buffer.close()
+
+    asyncio.run(main())
+
+
+def test_failed_flushes_are_retried_with_backoff():
+    async def main():
+        store = Store()
+        buffer = WriteBehindBuffer(store.write, delay=0.01, max_pending=3, max_backoff=0.04)
+        store.down = True
+        buffer.put("a", 1)
+        buffer.put("b", 1)
+        await buffer.flush()
+        assert buffer.failures == 1 and len(buffer) == 2 and buffer.get("a") == 1
+
+        # A write made while the batch was failing isn't overwritten by the batch going back in line
+        store.release.clear()
+        flushing = asyncio.create_task(buffer.flush())
+        await asyncio.sleep(0)
+        buffer.put("a", 2)
+        buffer.put("c", 1)
+        store.release.set()
+        await flushing
+        assert buffer.failures == 2 and buffer.get("a") == 2
+        assert buffer.retry_delay == 0.04
+
+        # Past max_pending the oldest writes are the ones given up on
+        buffer.put("d", 1)
+        assert len(buffer) == 3 and buffer.dropped == 1 and buffer.get("b") is MISSING
+
+        # The background flusher waits between attempts instead of trying again every `delay` seconds
+        buffer.start()
+        await asyncio.sleep(0.1)
+        assert buffer.failures < 8
+        store.down = False
+        await asyncio.sleep(0.1)
+        assert buffer.failures == 0 and len(buffer) == 0
+        assert store.batches == [{"a": 2, "c": 1, "d": 1}]
+        await buffer.close()
+
+    asyncio.run(main())
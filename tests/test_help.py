@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+from discord.ext import commands
+
+import cogs.help
+from cogs.help import Help, HelpCache, PinguHelp
+
+MODERATOR_ROLE = 10
+OWNER = 99
+
+
+@pytest.fixture
+def help_command(make_bot) -> PinguHelp:
+    """The help command of a bot with a public, a role-checked, an owner-only and a hidden command"""
+    bot = make_bot()
+    bot.owner_id = OWNER
+    bot.checked = []
+
+    async def counted(ctx: commands.Context) -> bool:
+        bot.checked.append(ctx.command.name)
+        return True
+
+    @commands.command()
+    @commands.check(counted)
+    async def ping(ctx: commands.Context) -> None:
+        """Pong"""
+
+    @commands.command()
+    @commands.has_role(MODERATOR_ROLE)
+    async def purge(ctx: commands.Context) -> None:
+        """Delete messages"""
+
+    @commands.command()
+    @commands.is_owner()
+    async def reload(ctx: commands.Context) -> None:
+        """Reload everything"""
+
+    @commands.command(hidden=True)
+    async def secret(ctx: commands.Context) -> None:
+        pass
+
+    for command in (ping, purge, reload, secret):
+        bot.add_command(command)
+    Help(bot)
+    return bot.help_command
+
+
+def visible_to(help_command: PinguHelp, user_id: int = 1, roles: tuple[int, ...] = (), guild_id: int = 1) -> set:
+    roles = [SimpleNamespace(id=role_id) for role_id in (guild_id, *roles)]
+    author = SimpleNamespace(
+        id=user_id, roles=roles, get_role=lambda role_id: next((role for role in roles if role.id == role_id), None)
+    )
+    channel = SimpleNamespace(permissions_for=lambda member: discord.Permissions(1024))
+    bot = help_command.cog.bot
+    help_command.context = SimpleNamespace(
+        bot=bot, guild=SimpleNamespace(id=guild_id), channel=channel, author=author, command=None
+    )
+    return {command.name for command in asyncio.run(help_command.get_visible_commands())}
+
+
+def test_visible_commands_are_memoized(help_command):
+    checked = help_command.cog.bot.checked
+    assert visible_to(help_command) == {"help", "ping"}
+    assert checked == ["ping"]
+    # Someone else with the same roles and permissions gets the same answer without the checks running again
+    assert visible_to(help_command, user_id=2) == {"help", "ping"}
+    assert checked == ["ping"]
+    assert visible_to(help_command, user_id=OWNER) == {"help", "ping", "reload"}
+
+
+def test_role_checks_arent_shared_between_roles(help_command):
+    # Same permissions either way, so only the roles tell these apart
+    assert visible_to(help_command) == {"help", "ping"}
+    assert visible_to(help_command, user_id=2, roles=(MODERATOR_ROLE,)) == {"help", "ping", "purge"}
+    assert visible_to(help_command, user_id=3) == {"help", "ping"}
+
+
+def test_memoized_commands_expire(help_command, monkeypatch):
+    checked = help_command.cog.bot.checked
+    now = 1000.0
+    monkeypatch.setattr(cogs.help, "monotonic", lambda: now)
+    visible_to(help_command)
+    visible_to(help_command)
+    assert checked == ["ping"]
+
+    now += HelpCache.VISIBLE_TTL + 1
+    visible_to(help_command)
+    assert checked == ["ping", "ping"]
+
+
+def test_memoized_commands_are_bounded(help_command, monkeypatch):
+    monkeypatch.setattr(HelpCache, "MAX_VISIBLE", 2)
+    for guild_id in range(1, 6):
+        visible_to(help_command, guild_id=guild_id)
+        assert len(help_command.cache.visible) <= 2
+
+
+def test_loading_extensions_starts_over(help_command):
+    bot = help_command.cog.bot
+    assert visible_to(help_command) == {"help", "ping"}
+
+    @commands.command()
+    async def pong(ctx: commands.Context) -> None:
+        """Ping"""
+
+    bot.add_command(pong)
+    # Nothing changes until the bot says its extensions changed
+    assert visible_to(help_command) == {"help", "ping"}
+    bot.extension_generation += 1
+    assert visible_to(help_command) == {"help", "ping", "pong"}
+    assert bot.checked == ["ping", "ping"]
@@ -0,0 +1,59 @@
+import asyncio
+
+from sqlalchemy import create_engine, text
+
+from models.instrumentation import MAX_TIMINGS, OVERFLOW_KEY, QueryStats, normalize_statement
+
+
+def get_engine(stats: QueryStats):
+    engine = create_engine("sqlite://")
+    stats.attach(engine)
+    return engine
+
+
+def test_statements_are_grouped_by_shape():
+    assert normalize_statement("SELECT * FROM t WHERE id = 1") == normalize_statement("SELECT * FROM t WHERE id = 22")
+    assert normalize_statement("INSERT INTO t VALUES ($1, $2), ($3, $4)") == "INSERT INTO t VALUES (...)"
+
+
+def test_commands_count_their_statements_and_flag_repeats():
+    stats = QueryStats(slow_threshold=60, repeat_threshold=3)
+    engine = get_engine(stats)
+
+    stats.begin_command("nick")
+    with engine.connect() as conn:
+        for value in range(3):
+            conn.execute(text(f"SELECT {value}"))
+    stats.end_command()
+
+    assert stats.timings[("nick", "SELECT ?")].count == 3
+    assert stats.repeated == {("nick", "SELECT ?"): 3}
+
+
+def test_unnamed_tasks_share_one_entry():
+    stats = QueryStats(slow_threshold=60, repeat_threshold=100)
+    engine = get_engine(stats)
+
+    async def setup_reminder(value: int) -> None:
+        with engine.connect() as conn:
+            conn.execute(text(f"SELECT {value}"))
+
+    async def main() -> None:
+        await asyncio.gather(*(asyncio.create_task(setup_reminder(value)) for value in range(20)))
+        await asyncio.create_task(setup_reminder(0), name="auto: reminder")
+
+    asyncio.run(main())
+    callers = {caller for caller, _ in stats.timings}
+    assert callers == {"test_unnamed_tasks_share_one_entry.<locals>.setup_reminder", "auto: reminder"}
+
+
+def test_timings_stop_growing():
+    stats = QueryStats(slow_threshold=60, repeat_threshold=100)
+    engine = get_engine(stats)
+
+    with engine.connect() as conn:
+        for value in range(MAX_TIMINGS + 50):
+            conn.execute(text(f"SELECT {value} AS column_{value}"))
+
+    assert len(stats.timings) == MAX_TIMINGS + 1
+    assert stats.timings[OVERFLOW_KEY].count == 50
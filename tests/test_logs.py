@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import sys
+
+import pytest
+
+import common.logs
+import pingu
+from common.logs import (
+    ContextFilter,
+    DuplicateFilter,
+    JsonFormatter,
+    LogQueueHandler,
+    TextFormatter,
+    end_command_context,
+    start_command_context,
+)
+
+
+@pytest.fixture(autouse=True)
+def restore_root_logger():
+    """setup_logging replaces the root logger's handlers, so put back whatever pytest had there"""
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def get_record(msg: str, *args, level: int = logging.WARNING, exc_info=None) -> logging.LogRecord:
+    return logging.LogRecord("pingu.test", level, __file__, 1, msg, args, exc_info)
+
+
+def test_repeated_warnings_are_held_back_and_counted(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(common.logs, "monotonic", lambda: now)
+    duplicates = DuplicateFilter(window=60, burst=3)
+
+    # The same template counts as the same warning whatever the arguments are
+    passed = [duplicates.filter(get_record("Guild %s is gone", guild_id)) for guild_id in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    # Other messages, and anything below a warning, aren't held back by it
+    assert duplicates.filter(get_record("Something else"))
+    assert all(duplicates.filter(get_record("Guild %s is gone", 1, level=logging.INFO)) for _ in range(10))
+
+    now += 60
+    record = get_record("Guild %s is gone", 11)
+    assert duplicates.filter(record) and record.suppressed == 7
+    formatted = TextFormatter(common.logs.TEXT_FORMAT).format(record)
+    assert formatted.endswith("pingu.test: Guild 11 is gone [suppressed=7]")
+    # The count is only reported once
+    record = get_record("Guild %s is gone", 12)
+    assert duplicates.filter(record) and not hasattr(record, "suppressed")
+
+
+def test_json_lines_have_the_command_context():
+    try:
+        raise ValueError("bad value")
+    except ValueError:
+        exc_info = sys.exc_info()
+
+    start_command_context(1234, "course search")
+    try:
+        record = get_record("Failed to look up %s", "CS100", level=logging.ERROR, exc_info=exc_info)
+        ContextFilter().filter(record)
+    finally:
+        end_command_context()
+    # The message is filled in before the record leaves for the writer thread
+    record = LogQueueHandler(None).prepare(record)
+    assert record.msg == "Failed to look up CS100" and record.args is None
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["level"] == "ERROR" and entry["logger"] == "pingu.test"
+    assert entry["message"] == "Failed to look up CS100"
+    assert entry["guild"] == 1234 and entry["command"] == "course search" and entry["latency_ms"] >= 0
+    assert entry["exception"].endswith("ValueError: bad value")
+    assert "\n" not in JsonFormatter().format(record)
+
+    # Nothing is added to records logged outside of a command
+    record = get_record("Outside")
+    ContextFilter().filter(record)
+    assert "guild" not in json.loads(JsonFormatter().format(record))
+
+
+def test_the_log_writer_is_stopped_on_shutdown(monkeypatch, capsys):
+    listeners = []
+
+    def setup_logging(**kwargs):
+        listeners.append(common.logs.setup_logging(**kwargs))
+        return listeners[-1]
+
+    async def start(self, token: str) -> None:
+        logging.getLogger("pingu.test").error("Login failed")
+        raise RuntimeError("Login failed")
+
+    monkeypatch.setattr(pingu, "load_dotenv", lambda **kwargs: None)
+    monkeypatch.setattr(pingu, "setup_logging", setup_logging)
+    monkeypatch.setattr(pingu.Pingu, "start", start)
+    monkeypatch.setenv("PINGU_TOKEN", "token")
+    monkeypatch.setenv("LAVALINK_PORT", "2333")
+    monkeypatch.setenv("PINGU_LOG_FORMAT", "json")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(pingu.main())
+    # Stopping it writes out whatever was still queued and ends the writer thread
+    assert listeners[0]._thread is None
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert {"level": "ERROR", "logger": "pingu.test", "message": "Login failed"}.items() <= lines[-1].items()
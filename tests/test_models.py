@@ -0,0 +1,302 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+import discord
+import pytest
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import QueuePool
+
+import cogs.auto
+import common.resilience
+import models
+from cogs.auto import Auto
+from common.exception import Unavailable
+from common.resilience import BreakerState, Dependency
+from models import Clown, InstrumentedPool, Nickname, PoolMetrics, Reminder, SectionWatch, upsert
+
+
+class StatementSpy:
+    """Stands in for a session and keeps every statement it's asked to run, along with any other round trip"""
+
+    def __init__(self, returning=None):
+        self.statements = []
+        self.other_calls = []
+        self.returning = returning
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def begin(self):
+        return self
+
+    async def execute(self, statement, *args, **kwargs):
+        self.statements.append(statement)
+
+    async def scalar(self, statement, *args, **kwargs):
+        self.statements.append(statement)
+        return self.returning
+
+    def add(self, instance) -> None:
+        self.other_calls.append("add")
+
+    async def flush(self) -> None:
+        self.other_calls.append("flush")
+
+    async def refresh(self, instance) -> None:
+        self.other_calls.append("refresh")
+
+    async def commit(self) -> None:
+        self.other_calls.append("commit")
+
+    @property
+    def sql(self) -> list[str]:
+        return [" ".join(str(statement.compile(dialect=postgresql.dialect())).split()) for statement in self.statements]
+
+
+def test_upsert_writes_many_rows_in_one_statement():
+    session = StatementSpy()
+    rows = [{"guild_id": 1, "user_id": user_id, "nick": f"nick {user_id}"} for user_id in range(100)]
+    asyncio.run(upsert(session, Nickname, rows))
+
+    assert len(session.statements) == 1
+    assert "ON CONFLICT (guild_id, user_id) DO UPDATE SET nick = excluded.nick" in session.sql[0]
+
+
+def test_upsert_with_only_key_columns_does_nothing_on_conflict():
+    session = StatementSpy()
+    asyncio.run(
+        upsert(session, SectionWatch, {"user_id": 1, "semester": "202490", "course": "CS100", "section": "002"})
+    )
+
+    assert len(session.statements) == 1
+    assert session.sql[0].endswith("ON CONFLICT (user_id, semester, course, section) DO NOTHING")
+
+
+def test_upsert_can_read_the_existing_row():
+    session = StatementSpy()
+    asyncio.run(
+        upsert(
+            session,
+            Clown,
+            {"guild_id": 1, "clown_id": 2, "previous_clown_id": 2},
+            set_={"previous_clown_id": Clown.clown_id},
+        )
+    )
+
+    assert len(session.statements) == 1
+    assert "SET clown_id = excluded.clown_id, previous_clown_id = clowns.clown_id" in session.sql[0]
+
+
+def test_a_reminder_is_saved_and_read_back_in_one_statement(make_bot, monkeypatch):
+    session = StatementSpy(returning=Reminder(reminder_id=7))
+    monkeypatch.setattr(cogs.auto, "async_session", lambda: session)
+    sent = []
+
+    async def send(embed: discord.Embed) -> None:
+        sent.append(embed.description)
+
+    async def main():
+        cog = Auto(make_bot())
+        cog.check_reminders.cancel()
+        ctx = SimpleNamespace(author=SimpleNamespace(id=1, mention="<@1>"), channel=SimpleNamespace(id=2), send=send)
+        await cog.remind.callback(cog, ctx, when="2 hours to stretch")
+
+    asyncio.run(main())
+    assert len(session.statements) == 1 and not session.other_calls
+    assert session.sql[0].startswith("INSERT INTO reminders") and "RETURNING reminders.reminder_id" in session.sql[0]
+    assert sent[0].endswith("<@1>, you will be reminded about this in 2 hours")
+    # Far enough out that the reminder loop picks it up instead of a task of its own
+    assert 7 not in Auto.QUEUED_REMINDERS
+
+
+def test_nicknames_are_written_a_thousand_rows_per_statement(monkeypatch):
+    pytest.importorskip("playwright")
+    import cogs.misc
+
+    session = StatementSpy()
+    monkeypatch.setattr(cogs.misc, "async_session", lambda: session)
+    cog = SimpleNamespace(log=logging.getLogger(__name__))
+    nicknames = {(1, user_id): f"nick {user_id}" for user_id in range(2500)}
+    asyncio.run(cogs.misc.Misc.write_nicknames(cog, nicknames))
+
+    assert len(session.statements) == 3 and not session.other_calls
+    assert all("ON CONFLICT (guild_id, user_id) DO UPDATE SET nick = excluded.nick" in sql for sql in session.sql)
+    assert [len(statement.compile().params) for statement in session.statements] == [3000, 3000, 1500]
+
+
+def test_a_passed_nomination_changes_the_clown_in_one_statement(make_bot, monkeypatch):
+    pytest.importorskip("wavelink")
+    import cogs.clown
+    from cogs.clown import ClownWeek
+
+    session = StatementSpy()
+    monkeypatch.setattr(cogs.clown, "async_session", lambda: session)
+    monkeypatch.setattr(ClownWeek, "GUILD_CLOWNS", [])
+    monkeypatch.setattr(ClownWeek, "NOMINATION_POLLS", {})
+    updated = []
+
+    async def sleep_until(when) -> None:
+        pass
+
+    async def update_cache() -> None:
+        updated.append(True)
+
+    class Message:
+        id = 3
+        reactions = [SimpleNamespace(emoji="✅", count=4), SimpleNamespace(emoji="❌", count=1)]
+
+        async def delete(self) -> None:
+            pass
+
+        async def add_reaction(self, emoji: str) -> None:
+            pass
+
+    async def send(embed: discord.Embed) -> Message:
+        return Message()
+
+    async def fetch_message(message_id: int) -> Message:
+        return Message()
+
+    async def wait_for(event: str, timeout: float, check) -> SimpleNamespace:
+        return SimpleNamespace(content="honk")
+
+    monkeypatch.setattr(cogs.clown, "sleep_until", sleep_until)
+    bot = make_bot()
+    monkeypatch.setattr(bot, "wait_for", wait_for)
+    cog = ClownWeek.__new__(ClownWeek)
+    cog.bot, cog.log, cog.update_cache = bot, logging.getLogger(__name__), update_cache
+    author = SimpleNamespace(id=1, mention="<@1>", guild_avatar=None)
+    user = SimpleNamespace(id=2, bot=False, mention="<@2>", display_avatar=None)
+    ctx = SimpleNamespace(
+        guild=SimpleNamespace(id=5),
+        author=author,
+        channel=SimpleNamespace(id=4, fetch_message=fetch_message),
+        prefix="?",
+        send=send,
+    )
+    asyncio.run(cog.nominate_clown.callback(cog, ctx, user=user))
+
+    assert len(session.statements) == 1 and not session.other_calls
+    assert "SET clown_id = excluded.clown_id, previous_clown_id = clowns.clown_id" in session.sql[0]
+    assert updated and not ClownWeek.NOMINATION_POLLS
+
+
+class BlockingInstrumentedPool(InstrumentedPool):
+    """The bot's pool with a plain queue, so it can check out connections without an event loop"""
+
+    _queue_class = QueuePool._queue_class
+    _is_asyncio = False
+
+
+def test_failed_reconnects_on_checkout_trip_the_breaker(monkeypatch):
+    monkeypatch.setattr(common.resilience, "DEPENDENCIES", {})
+    database = Dependency("Postgres", timeout=1, max_concurrency=5, failure_threshold=2, reset_after=60)
+    monkeypatch.setattr(models, "database", database)
+
+    server = {"up": True, "connections": []}
+
+    def connect() -> sqlite3.Connection:
+        if not server["up"]:
+            raise sqlite3.OperationalError("unable to open database file")
+        server["connections"].append(sqlite3.connect(":memory:", check_same_thread=False))
+        return server["connections"][-1]
+
+    engine = create_engine(
+        "sqlite://", creator=connect, poolclass=BlockingInstrumentedPool, pool_size=1, pool_pre_ping=True
+    )
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    # The idle connection still comes out of the pool, but its pre-ping fails and so does reconnecting
+    server["up"] = False
+    for connection in server["connections"]:
+        connection.close()
+    for _ in range(2):
+        with pytest.raises(exc.OperationalError):
+            with engine.connect():
+                pass
+    assert database.state == BreakerState.OPEN
+    with pytest.raises(Unavailable):
+        with engine.connect():
+            pass
+
+
+def test_waiting_for_a_free_connection_doesnt_trip_the_breaker(monkeypatch):
+    monkeypatch.setattr(common.resilience, "DEPENDENCIES", {})
+    database = Dependency("Postgres", timeout=1, max_concurrency=5, failure_threshold=2, reset_after=60)
+    monkeypatch.setattr(models, "database", database)
+
+    engine = create_engine(
+        "sqlite://",
+        creator=lambda: sqlite3.connect(":memory:", check_same_thread=False),
+        poolclass=BlockingInstrumentedPool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.01,
+    )
+    with engine.connect():
+        for _ in range(3):
+            with pytest.raises(exc.TimeoutError):
+                with engine.connect():
+                    pass
+    assert database.state == BreakerState.CLOSED and database.stats["failures"] == 0
+
+
+# A Postgres that runs as many queries at once as it has cores, with what a query and a new connection cost it
+SERVER_CORES = 4
+QUERY_TIME = 0.005
+CONNECT_TIME = 0.02
+
+
+def run_pool_load(pool_size: int, max_overflow: int, clients: int = 16, queries: int = 10) -> float:
+    """Queries per second with `clients` threads each checking out a connection for `queries` queries in a row"""
+    cores = threading.Semaphore(SERVER_CORES)
+
+    def connect() -> sqlite3.Connection:
+        time.sleep(CONNECT_TIME)
+        return sqlite3.connect(":memory:", check_same_thread=False)
+
+    def client() -> None:
+        for _ in range(queries):
+            connection = engine.raw_connection()
+            try:
+                with cores:
+                    time.sleep(QUERY_TIME)
+            finally:
+                connection.close()
+
+    engine = create_engine(
+        "sqlite://", creator=connect, poolclass=BlockingInstrumentedPool, pool_size=pool_size, max_overflow=max_overflow
+    )
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+    return clients * queries / elapsed
+
+
+def test_pool_size_sweep(monkeypatch):
+    monkeypatch.setattr(common.resilience, "DEPENDENCIES", {})
+    monkeypatch.setattr(models, "database", Dependency("Postgres", timeout=1, max_concurrency=100))
+    monkeypatch.setattr(models, "pool_metrics", PoolMetrics())
+
+    sweep = {size: run_pool_load(size, 0) for size in (1, 2, 4, 8)}
+    defaults = run_pool_load(models.pool_size, models.max_overflow)
+    # Throughput follows the pool until there's a connection per server core, and more connections don't add any
+    assert sweep[1] < sweep[2] * 0.7 and sweep[2] < sweep[4] * 0.7
+    assert sweep[8] < sweep[4] * 1.3
+    # So the defaults (5 kept open, up to 15 under load) already get everything the server has to give
+    assert defaults > max(sweep.values()) * 0.8
+    assert models.pool_metrics.checkouts == 16 * 10 * 5
@@ -0,0 +1,94 @@
+import asyncio
+from time import perf_counter
+from types import SimpleNamespace
+
+from cogs.auto import Auto
+from common.pipeline import MessagePipeline
+
+LINK_PATTERNS = (Auto.TIKTOK_LINK, Auto.TWITTER_LINK, Auto.REDDIT_LINK)
+MESSAGES = 20_000
+
+
+def get_messages() -> list[SimpleNamespace]:
+    """A guild's worth of traffic: mostly chatter, with some commands, links, bots and DMs mixed in"""
+    guild = object()
+    user, bot = SimpleNamespace(bot=False), SimpleNamespace(bot=True)
+    kinds = [
+        *[(guild, user, "did anyone finish the homework for tomorrow? i'm so lost on the last part")] * 16,
+        (guild, user, "?help remindme"),
+        (guild, user, "lmao https://x.com/someone/status/1234567890"),
+        (guild, bot, "Now playing: something"),
+        (None, user, "hey can you help me out"),
+    ]
+    return [SimpleNamespace(guild=guild, author=author, content=content) for guild, author, content in kinds] * (
+        MESSAGES // len(kinds)
+    )
+
+
+async def get_prefix(message) -> str:
+    return "?"
+
+
+async def run_unstaged(messages: list, handled: dict) -> None:
+    """The way it was before the pipeline: a listener per cog, each run as its own task and doing its own checks"""
+
+    async def on_message(message) -> None:
+        if not message.guild or message.author.bot:
+            return
+        if message.content.startswith(await get_prefix(message)):
+            handled["commands"] += 1
+
+    async def on_message_links(message) -> None:
+        if not message.guild or message.author.bot:
+            return
+        for pattern in LINK_PATTERNS:
+            if pattern.search(message.content):
+                handled["links"] += 1
+                return
+
+    for message in messages:
+        for listener in (on_message, on_message_links):
+            asyncio.create_task(listener(message))
+    await asyncio.sleep(0)
+
+
+async def run_pipeline(messages: list, handled: dict) -> None:
+    async def run_commands(facts) -> None:
+        handled["commands"] += 1
+
+    async def rewrite_links(facts) -> None:
+        for pattern in LINK_PATTERNS:
+            if pattern.search(facts.message.content):
+                handled["links"] += 1
+                return
+
+    pipeline = MessagePipeline(get_prefix)
+    pipeline.add_stage("commands", run_commands, requires=("in_guild", "from_user", "has_prefix"), order=0)
+    pipeline.add_stage("link embeds", rewrite_links, requires=("in_guild", "from_user", "has_url"), order=100)
+    for message in messages:
+        asyncio.create_task(pipeline.process(message))
+    await asyncio.sleep(0)
+
+
+def messages_per_second(dispatch) -> tuple[float, dict]:
+    messages = get_messages()
+    handled = {"commands": 0, "links": 0}
+
+    async def main() -> float:
+        started = perf_counter()
+        await dispatch(messages, handled)
+        # Everything was scheduled, so wait until all of it has run
+        while len(asyncio.all_tasks()) > 1:
+            await asyncio.sleep(0)
+        return len(messages) / (perf_counter() - started)
+
+    return asyncio.run(main()), handled
+
+
+def test_pipeline_handles_more_messages_per_second_than_a_listener_per_cog():
+    # Best of a few runs, so a slow moment on the machine doesn't decide it
+    unstaged = [messages_per_second(run_unstaged) for _ in range(3)]
+    staged = [messages_per_second(run_pipeline) for _ in range(3)]
+    assert all(handled == {"commands": MESSAGES // 20, "links": MESSAGES // 20} for _, handled in unstaged + staged)
+    # One task per message instead of one per listener, and no link regexes for messages without a url
+    assert max(rate for rate, _ in staged) > max(rate for rate, _ in unstaged) * 1.2
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+import common.resilience
+from common.exception import Unavailable
+from common.resilience import BreakerState, Dependency
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry(monkeypatch):
+    monkeypatch.setattr(common.resilience, "DEPENDENCIES", {})
+
+
+async def fail(exc: BaseException):
+    raise exc
+
+
+async def answer(value=None, delay: float = 0):
+    await asyncio.sleep(delay)
+    return value
+
+
+def test_breaker_opens_and_recovers():
+    async def main():
+        service = Dependency("Service", timeout=1, max_concurrency=5, failure_threshold=2, reset_after=0.05)
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await service.call(fail, ConnectionError("refused"))
+        assert service.state == BreakerState.OPEN
+        with pytest.raises(Unavailable):
+            await service.call(answer)
+
+        await asyncio.sleep(0.05)
+        # One trial call gets through once the breaker has been open for long enough, and closes it
+        assert await service.call(answer, "back") == "back"
+        assert service.state == BreakerState.CLOSED
+        assert service.stats == {"calls": 3, "failures": 2, "timeouts": 0, "rejected": 1}
+
+    asyncio.run(main())
+
+
+def test_failed_trial_opens_the_breaker_again():
+    async def main():
+        service = Dependency("Service", timeout=1, max_concurrency=5, failure_threshold=1, reset_after=0.05)
+        with pytest.raises(ConnectionError):
+            await service.call(fail, ConnectionError("refused"))
+        await asyncio.sleep(0.05)
+
+        trial = asyncio.create_task(service.call(answer, delay=1))
+        await asyncio.sleep(0)
+        assert service.state == BreakerState.HALF_OPEN
+        with pytest.raises(Unavailable):
+            await service.call(answer)
+        # A trial that never finishes doesn't leave the breaker half-open
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert service.state == BreakerState.OPEN
+
+    asyncio.run(main())
+
+
+def test_only_the_deadline_is_unavailable():
+    async def main():
+        service = Dependency("Service", timeout=0.05, max_concurrency=5)
+        with pytest.raises(Unavailable):
+            await service.call(answer, delay=1)
+        assert service.stats["timeouts"] == 1
+
+        # A timeout from inside the call (like a request's own timeout) is left for the caller to retry
+        with pytest.raises(asyncio.TimeoutError) as exc_info:
+            await service.call(fail, asyncio.TimeoutError())
+        assert not isinstance(exc_info.value, Unavailable)
+        assert service.stats == {"calls": 2, "failures": 2, "timeouts": 1, "rejected": 0}
+
+    asyncio.run(main())
+
+
+def test_ignored_errors_and_the_bulkhead():
+    async def main():
+        service = Dependency("Service", timeout=1, max_concurrency=1, failure_threshold=1, ignore=(KeyError,))
+        with pytest.raises(KeyError):
+            await service.call(fail, KeyError("missing"))
+        assert service.state == BreakerState.CLOSED
+
+        slow = asyncio.create_task(service.call(answer, delay=0.05))
+        await asyncio.sleep(0)
+        with pytest.raises(Unavailable):
+            await service.call(answer)
+        await slow
+        assert service.in_flight == 0 and service.stats["rejected"] == 1
+
+    asyncio.run(main())
+
+
+def test_turning_away_a_call_for_being_busy_leaves_the_trial_for_later():
+    async def main():
+        service = Dependency("Service", timeout=1, max_concurrency=1, failure_threshold=1, reset_after=0.05)
+        slow = asyncio.create_task(service.call(answer, delay=1))
+        await asyncio.sleep(0)
+        # Something else using the service (like a pool checkout) fails while that call is still going
+        service.record_failure(ConnectionError("refused"))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(Unavailable, match="busy"):
+            await service.call(answer)
+        assert service.state == BreakerState.OPEN
+        slow.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await slow
+        assert await service.call(answer, "back") == "back"
+        assert service.state == BreakerState.CLOSED
+
+    asyncio.run(main())
@@ -0,0 +1,165 @@
+import gc
+import json
+import tracemalloc
+
+import pytest
+
+from common.schedules import (
+    CourseIndexBuilder,
+    CourseSearch,
+    TrigramIndex,
+    JsonpScheduleParser,
+    Meeting,
+    PackedIndex,
+    Section,
+    diff_sections,
+    format_time,
+    get_trigrams,
+    parse_meetings,
+    parse_schedule_file,
+)
+
+
+def parse_in_chunks(payload: bytes, chunk_size: int):
+    parser = JsonpScheduleParser()
+    for idx in range(0, len(payload), chunk_size):
+        parser.feed(payload[idx : idx + chunk_size])
+    return parser.close()
+
+
+def parse_all_at_once(payload: bytes):
+    """What the parser replaced: decode everything, then walk it"""
+    data = json.loads(payload.decode()[payload.index(b"(") + 1 : -1])
+    builder = CourseIndexBuilder()
+    for subject in data["ws"]["WSRESPONSE"]["Subject"]:
+        builder.add_subject(subject)
+    data["ws"]["WSRESPONSE"]["Subject"] = []
+    return builder.build(), data
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096, 64 * 1024])
+def test_chunk_boundaries_dont_change_the_result(schedule_payload, chunk_size):
+    payload = schedule_payload(subjects=3, courses=3, sections=4)
+    index, rest = parse_in_chunks(payload, chunk_size)
+    expected_index, expected_rest = parse_all_at_once(payload)
+
+    assert dict(index) == dict(expected_index)
+    assert rest == expected_rest
+    assert rest["ct"] == 202490
+
+
+def test_single_sections_and_subjects_are_normalized(schedule_payload):
+    index, _ = parse_in_chunks(schedule_payload(subjects=1, courses=1, sections=1), 64)
+    assert list(index) == ["AA100"]
+    assert [section.number for section in index["AA100"]] == ["001"]
+
+
+def test_truncated_payload_is_an_error(schedule_payload):
+    payload = schedule_payload()
+    with pytest.raises(ValueError):
+        parse_in_chunks(payload[: len(payload) // 2], 1024)
+
+
+def test_peak_memory_stays_close_to_the_finished_index(schedule_payload):
+    # Around 5 MB, which is the size of a real semester
+    payload = schedule_payload(subjects=80, courses=40, sections=6)
+
+    tracemalloc.start()
+    try:
+        result = parse_in_chunks(payload, 64 * 1024)
+        retained, peak = tracemalloc.get_traced_memory()
+        del result
+        tracemalloc.reset_peak()
+        result = parse_all_at_once(payload)
+        _, naive_peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+
+    # Beyond what it returns, parsing only ever holds a chunk or so and one subject at a time
+    assert peak - retained < len(payload) / 4
+    assert peak < naive_peak / 2
+
+
+def test_index_comes_back_from_the_worker_packed(schedule_payload, tmp_path):
+    payload = schedule_payload(subjects=20, courses=30, sections=2)
+    (tmp_path / "payload.jsonp").write_bytes(payload)
+    course_index, rest = parse_schedule_file(str(tmp_path / "payload.jsonp"), chunk_size=4096)
+
+    index, expected_rest = parse_in_chunks(payload, 4096)
+    assert isinstance(course_index, PackedIndex) and len(course_index) == 600
+    assert course_index == index and rest == expected_rest
+    assert course_index["BA100"] == index["BA100"] and course_index.get("ZZ100") is None
+    # Nothing in it is tracked by the garbage collector, however many courses there are
+    assert not any(gc.is_tracked(packed) for packed in course_index.packed.values())
+    assert CourseSearch(course_index).complete("ba10") == [f"BA10{digit}" for digit in range(10)]
+
+
+def test_meetings():
+    assert parse_meetings({"MTG_DAYS": ""}) == ()
+    meetings = parse_meetings({"MTG_DAYS": "MW", "START_TIME": "1000", "END_TIME": "1120"})
+    assert meetings == (Meeting("MW", 600, 680),)
+    # Sections that meet at the same times share the same tuple
+    assert parse_meetings([{"MTG_DAYS": "MW", "START_TIME": "1000", "END_TIME": "1120"}]) is meetings
+    assert parse_meetings([{"MTG_DAYS": "F", "START_TIME": "TBA"}, {"MTG_DAYS": "M"}]) is None
+    assert format_time(0) == "12:00 AM"
+    assert format_time(14 * 60 + 5) == "2:05 PM"
+
+
+def test_diff_sections_finds_every_kind_of_change(schedule_payload):
+    old_index, _ = parse_in_chunks(schedule_payload(subjects=1, courses=3, sections=2), 4096)
+    new_index = dict(old_index)
+    full = old_index["AA100"][0]._replace(enrolled=30)
+    new_index["AA100"] = (full, old_index["AA100"][1])
+    new_index["AA101"] = old_index["AA101"][:1]
+    del new_index["AA102"]
+
+    changes = {(change.course, change.number): change for change in diff_sections(old_index, new_index)}
+    assert set(changes) == {("AA100", "001"), ("AA101", "002"), ("AA102", "001"), ("AA102", "002")}
+    assert changes["AA100", "001"].describe() == ["Section is now full (30/30 taken)"]
+    assert changes["AA101", "002"].describe() == ["Section was removed from the schedule"]
+    assert diff_sections(old_index, old_index) == []
+
+
+def test_suggestions_break_ties_in_order(schedule_payload):
+    # Enough courses that the leading trigrams are too common to look candidates up by
+    index, _ = parse_in_chunks(schedule_payload(subjects=2, courses=100, sections=1), 64 * 1024)
+    course_search = CourseSearch(index)
+    assert "  a" in course_search.number_trigrams.common
+
+    assert course_search.suggest("AA1OO") == ["AA100", "AA101", "AA102", "AA103", "AA104"]
+    assert course_search.suggest("aa10") == ["AA100", "AA101", "AA102", "AA103", "AA104"]
+    assert course_search.suggest("BA19") == ["BA119", "BA190", "BA191", "BA192", "BA193"]
+
+
+def test_lookalike_digits_after_subjects_ending_in_o_i_or_l():
+    # PHIL001 looks as close to PHILIOO as PHIL100 does by trigrams and sorts first, so only the correction finds it
+    courses = ("BIOL200", "CIO101", "CS100", "PHIL001", "PHIL100", "PHIL334", "SOI100")
+    course_search = CourseSearch(
+        {course: (Section(course, "001", f"{course} Topics", "", 0, 30, "FACE-TO-FACE", ()),) for course in courses}
+    )
+
+    assert course_search.suggest("PHIL1OO")[0] == "PHIL100"
+    assert course_search.suggest("PHILIOO")[0] == "PHIL100"
+    assert course_search.suggest("BIOL2OO")[0] == "BIOL200"
+    assert course_search.suggest("CIOIOI")[0] == "CIO101"
+    assert course_search.suggest("SOIIOO")[0] == "SOI100"
+    assert course_search.suggest("CSIOO")[0] == "CS100"
+
+
+def test_trigram_scores_match_a_full_scan():
+    subjects = ("BIO", "CHEM", "CS", "MATH", "PHYS", "YWCC")
+    entries = {f"{subject}{number}": f"{subject}{number}" for subject in subjects for number in range(100, 500, 7)}
+    trigram_index = TrigramIndex(entries)
+    assert "  c" in trigram_index.common and " cs" not in trigram_index.common
+
+    for query in ("CS1OO", "math15", "phys 199", "chem"):
+        query_trigrams = get_trigrams(query)
+        scores = {
+            key: 2 * len(query_trigrams & get_trigrams(text)) / (len(query_trigrams) + len(get_trigrams(text)))
+            for key, text in entries.items()
+            # Keys are only looked up by the trigrams that aren't common
+            if query_trigrams & get_trigrams(text) - set(trigram_index.common)
+        }
+        expected = sorted((key for key in scores if scores[key] >= 0.3), key=lambda key: (-scores[key], key))
+        assert trigram_index.search(query, 10) == expected[:10]
@@ -0,0 +1,324 @@
+import asyncio
+import gc
+import json
+import multiprocessing
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from types import SimpleNamespace
+
+import psutil
+import pytest
+from aiohttp import web
+
+import cogs.schedules
+from cogs.schedules import Schedules
+from common.schedules import CourseSearch, parse_schedule_file
+from pingu import Pingu
+
+
+class FakeSession:
+    """Enough of an AsyncSession for the cog to load (and save) section watches without Postgres"""
+
+    def __init__(self, rows: list):
+        self.rows = rows
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def begin(self):
+        return self
+
+    async def execute(self, statement, *args, **kwargs):
+        rows = self.rows
+
+        class Result:
+            def scalars(self):
+                return iter(rows)
+
+        return Result()
+
+
+class ScheduleServer:
+    """Serves whatever payload it's given for every term, counting the requests"""
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+        self.requests = []
+        self.runner: web.AppRunner = None
+        self.url = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests.append(request.query.get("term"))
+        return web.Response(body=self.payload, content_type="text/javascript")
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/?term="
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch, tmp_path):
+    """The cog keeps its data on the class, so give every test its own copy (and its own disk cache)"""
+    monkeypatch.setattr(Schedules, "SEMESTER_CODES", {})
+    monkeypatch.setattr(Schedules, "COURSE_INDEX", {})
+    monkeypatch.setattr(Schedules, "COURSE_SEARCH", {})
+    monkeypatch.setattr(Schedules, "LATEST_SEMESTER", None)
+    monkeypatch.setattr(Schedules, "LAST_UPDATE", {})
+    monkeypatch.setattr(Schedules, "VALIDATORS", {})
+    monkeypatch.setattr(Schedules, "CACHE_DIR", tmp_path / "schedules")
+    monkeypatch.setattr(cogs.schedules, "async_session", lambda: FakeSession([]))
+
+
+async def start_cog(bot: Pingu) -> Schedules:
+    cog = Schedules(bot)
+    # Refreshes are driven by hand here rather than by the daily loop
+    cog.refresh_cache.cancel()
+    await cog.cog_load()
+    return cog
+
+
+def test_refresh_indexes_and_caches_a_semester(schedule_payload, monkeypatch, make_bot):
+    async def main():
+        server = ScheduleServer(schedule_payload(subjects=2, courses=3, sections=3))
+        await server.start()
+        monkeypatch.setattr(Schedules, "SCHEDULE_URL", server.url)
+        cog = await start_cog(make_bot())
+        try:
+            assert await cog.refresh_semester()
+            assert Schedules.LATEST_SEMESTER == "202490"
+            assert Schedules.SEMESTER_CODES == {"202490": "Fall 2024", "202450": "Summer 2024"}
+            assert len(Schedules.COURSE_INDEX["202490"]) == 6
+
+            sections = await cog.get_course_sections("AA101", "202490")
+            assert [section.number for section in sections] == ["001", "002", "003"]
+            assert sections[2].instructor == ""
+            assert sections[0].meetings == (("MW", 600, 680),)
+
+            embeds = cog.get_schedule_embeds("AA101", "202490", sections)
+            assert len(embeds) == 1 and len(embeds[0].fields) == 3
+            assert "`AA101`" in cog.get_missing_course_message("AA1O1", "202490")
+
+            # An unchanged body is recognized from its hash and the existing index is kept
+            index = Schedules.COURSE_INDEX["202490"]
+            assert await cog.refresh_semester()
+            assert Schedules.COURSE_INDEX["202490"] is index
+            assert server.requests == ["", ""]
+        finally:
+            await cog.cog_unload()
+            await server.stop()
+
+    asyncio.run(main())
+
+
+def test_the_latest_semester_is_one_fetch_however_it_is_asked_for(schedule_payload, monkeypatch, make_bot):
+    async def main():
+        server = ScheduleServer(schedule_payload(subjects=1, courses=2, sections=1))
+        await server.start()
+        monkeypatch.setattr(Schedules, "SCHEDULE_URL", server.url)
+        cog = await start_cog(make_bot())
+        try:
+            assert await cog.refresh_semester()
+            # The daily refresh and the prefetch of the current term land at the same time
+            assert await asyncio.gather(cog.refresh_semester(), cog.refresh_semester("202490")) == [True, True]
+            assert await cog.refresh_semester("202450")
+            assert server.requests == ["", "", "202450"]
+            assert set(Schedules.VALIDATORS) == {"", "202450"}
+        finally:
+            await cog.cog_unload()
+            await server.stop()
+
+    asyncio.run(main())
+
+
+def test_snapshots_are_loaded_on_the_next_start(schedule_payload, monkeypatch, make_bot):
+    async def main():
+        server = ScheduleServer(schedule_payload(subjects=1, courses=2, sections=1))
+        await server.start()
+        monkeypatch.setattr(Schedules, "SCHEDULE_URL", server.url)
+        cog = await start_cog(make_bot())
+        try:
+            assert await cog.refresh_semester()
+            index = dict(Schedules.COURSE_INDEX["202490"])
+        finally:
+            await cog.cog_unload()
+
+        Schedules.COURSE_INDEX = {}
+        Schedules.LATEST_SEMESTER = None
+        cog = await start_cog(make_bot())
+        try:
+            assert Schedules.LATEST_SEMESTER == "202490"
+            assert dict(Schedules.COURSE_INDEX["202490"]) == index
+            assert Schedules.COURSE_SEARCH["202490"].complete("aa") == ["AA100", "AA101"]
+            assert len(server.requests) == 1
+        finally:
+            await cog.cog_unload()
+            await server.stop()
+
+    asyncio.run(main())
+
+
+def test_watchers_hear_about_changed_sections(schedule_payload, monkeypatch, make_bot):
+    async def main():
+        server = ScheduleServer(schedule_payload(subjects=1, courses=2, sections=2))
+        await server.start()
+        monkeypatch.setattr(Schedules, "SCHEDULE_URL", server.url)
+        cog = await start_cog(make_bot())
+        notified = asyncio.Event()
+        sent = {}
+
+        async def send_watch_notifications(semester_code, user_changes):
+            sent.update(user_changes)
+            notified.set()
+
+        monkeypatch.setattr(cog, "send_watch_notifications", send_watch_notifications)
+        try:
+            assert await cog.refresh_semester()
+            cog.add_watch(1, "202490", "AA100", "002")
+            cog.add_watch(2, "202490", "AA101", "001")
+
+            payload = json.loads(server.payload[len("jQuery(") : -1])
+            section = payload["ws"]["WSRESPONSE"]["Subject"][0]["Course"][0]["Section"][1]
+            section["ENROLLED"] = section["CAPACITY"]
+            server.payload = f"jQuery({json.dumps(payload)})".encode()
+
+            assert await cog.refresh_semester()
+            await asyncio.wait_for(notified.wait(), timeout=5)
+            assert list(sent) == [1]
+            assert sent[1][0].describe() == ["Section is now full (30/30 taken)"]
+        finally:
+            await cog.cog_unload()
+            await server.stop()
+
+    asyncio.run(main())
+
+
+def test_extension_registers_its_commands(make_bot):
+    async def main():
+        async with make_bot() as bot:
+            await cogs.schedules.setup(bot)
+            assert {command.name for command in bot.get_command("course").commands} == {
+                "search",
+                "watch",
+                "unwatch",
+                "watching",
+            }
+            assert bot.tree.get_command("course") is not None
+            await bot.remove_cog("Schedules")
+
+    asyncio.run(main())
+
+
+def test_full_refresh_keeps_the_event_loop_responsive(schedule_payload, monkeypatch, make_bot):
+    async def main():
+        # Around 5 MB, which is the size of a real semester
+        server = ScheduleServer(schedule_payload(subjects=80, courses=40, sections=6))
+        await server.start()
+        monkeypatch.setattr(Schedules, "SCHEDULE_URL", server.url)
+        cog = await start_cog(make_bot())
+        lags = []
+
+        async def measure_lag() -> None:
+            loop = asyncio.get_running_loop()
+            while True:
+                expected = loop.time() + 0.005
+                await asyncio.sleep(0.005)
+                lags.append(loop.time() - expected)
+
+        tracked = len(gc.get_objects())
+        ticker = asyncio.create_task(measure_lag())
+        try:
+            assert await cog.refresh_semester()
+            assert len(Schedules.COURSE_INDEX["202490"]) == 3200
+        finally:
+            ticker.cancel()
+            await cog.cog_unload()
+            await server.stop()
+        return lags, len(gc.get_objects()) - tracked
+
+    # A full collection takes the bot about as long as the limit, and one could already be owed for whatever earlier
+    # tests left behind, so start from nothing owed. Whether the refresh itself brings one on is what's being tested.
+    gc.collect()
+    lags, tracked = asyncio.run(main())
+    # Parsing on the loop stalls it for about half a second, and unpickling the whole result at once for 40-100 ms
+    assert max(lags) < 0.05
+    # Unpacked sections would be a few tracked objects each, and enough of them to set off a full collection
+    assert tracked < 5000
+
+
+def cached_semesters_rss(path: str, semesters: int, compact: bool) -> int:
+    """How much a process grows holding a payload `semesters` times, either as the raw JSON or the way the cog does"""
+    process = psutil.Process()
+    gc.collect()
+    before = process.memory_info().rss
+    cache = []
+    for _ in range(semesters):
+        if compact:
+            course_index, _ = parse_schedule_file(path)
+            cache.append((course_index, CourseSearch(course_index)))
+        else:
+            with open(path, "rb") as file:
+                payload = file.read()
+            cache.append(json.loads(payload[payload.index(b"(") + 1 : payload.rindex(b")")]))
+    gc.collect()
+    return process.memory_info().rss - before
+
+
+def test_ten_cached_semesters_take_a_fraction_of_the_memory(schedule_payload, tmp_path):
+    # Around 1.5 MB each, a quarter of a real semester
+    path = tmp_path / "payload.jsonp"
+    path.write_bytes(schedule_payload(subjects=20, courses=40, sections=6))
+
+    # Each in a fresh process, so memory one of them freed doesn't get reused by the other
+    rss = {}
+    for compact in (False, True):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            rss[compact] = executor.submit(cached_semesters_rss, str(path), 10, compact).result()
+    # About 6 MB a semester as nested dicts of every field, and about 2 MB packed (most of that is the search index)
+    assert rss[True] < rss[False] / 2
+
+
+def test_course_autocomplete_over_a_full_catalog(schedule_payload, tmp_path, make_bot):
+    path = tmp_path / "payload.jsonp"
+    path.write_bytes(schedule_payload(subjects=80, courses=40, sections=6))
+    course_index, _ = parse_schedule_file(str(path))
+    Schedules.COURSE_SEARCH = {"202490": CourseSearch(course_index)}
+    Schedules.LATEST_SEMESTER = "202490"
+    # Every keystroke of a few course numbers and title words, and some that match nothing
+    typed = [text[:end] for text in ("cs101", "ba139", "topics 12", "special", "édition", "zz999") for end in range(6)]
+
+    async def main() -> list[float]:
+        cog = Schedules(make_bot())
+        cog.refresh_cache.cancel()
+        interaction = SimpleNamespace(namespace=SimpleNamespace(semester=None))
+        timings, answered = [], 0
+        for _ in range(20):
+            for current in typed:
+                started = perf_counter()
+                choices = await cog.course_autocomplete(interaction, current)
+                timings.append(perf_counter() - started)
+                assert len(choices) <= 25
+                answered += bool(choices)
+        assert [choice.value for choice in await cog.course_autocomplete(interaction, "ba13")] == [
+            f"BA13{digit}" for digit in range(10)
+        ]
+        assert answered > len(timings) / 2
+        return timings
+
+    timings = asyncio.run(main())
+    assert len(Schedules.COURSE_SEARCH["202490"].titles) == 3200
+    # Discord gives an autocomplete 3 seconds, but it runs on the loop for every keystroke of everyone typing
+    assert statistics.median(timings) < 0.0002
+    assert statistics.quantiles(timings, n=100)[98] < 0.001
@@ -0,0 +1,112 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+from discord.ext import commands
+from sqlalchemy.dialects import postgresql
+
+import models.settings
+from cogs.settings import Settings
+from models import GuildSettings
+from models.settings import GuildSettingsCache
+
+
+class SettingsSession:
+    """Stands in for a session, answering selects with `rows` and upserts with whatever was written"""
+
+    def __init__(self, rows: list[GuildSettings]):
+        self.rows = rows
+        self.statements = []
+        self.options = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def begin(self):
+        return self
+
+    async def execute(self, statement, *args, **kwargs):
+        self.statements.append(statement)
+        rows = self.rows
+        return SimpleNamespace(scalars=lambda: iter(rows))
+
+    async def scalar(self, statement, *args, execution_options=None, **kwargs):
+        self.statements.append(statement)
+        self.options.append(execution_options)
+        columns = GuildSettings.__table__.columns.keys()
+        return GuildSettings(**{name: value for name, value in statement.compile().params.items() if name in columns})
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = SettingsSession([GuildSettings(guild_id=1, prefix="!", link_embeds=False)])
+    monkeypatch.setattr(models.settings, "async_session", lambda: session)
+    return session
+
+
+def test_everything_is_loaded_up_front(session):
+    cache = GuildSettingsCache()
+    asyncio.run(cache.load())
+
+    assert len(session.statements) == 1
+    assert cache.get(1).prefix == "!" and not cache.get(1).link_embeds
+    # Guilds that never changed anything get the defaults without a query
+    assert cache.get(2) is cache.defaults and cache.get(2).link_embeds
+    assert len(session.statements) == 1
+
+
+def test_updates_write_through_in_one_statement(session):
+    cache = GuildSettingsCache()
+    asyncio.run(cache.load())
+    settings = asyncio.run(cache.update(2, twitter_host="fixupx.com"))
+
+    sql = " ".join(str(session.statements[-1].compile(dialect=postgresql.dialect())).split())
+    assert "ON CONFLICT (guild_id) DO UPDATE SET twitter_host = %(param_1)s" in sql and " RETURNING " in sql
+    # The row that comes back replaces whatever the session might already have had for it
+    assert session.options[-1] == {"populate_existing": True}
+    assert cache.get(2) is settings and settings.twitter_host == "fixupx.com"
+    assert cache.get(1).prefix == "!"
+
+
+def test_prefix_comes_from_the_guild_or_the_default(session, make_bot):
+    bot = make_bot()
+    asyncio.run(bot.guild_settings.load())
+
+    def message(guild_id: int | None):
+        return SimpleNamespace(guild=guild_id and SimpleNamespace(id=guild_id))
+
+    assert bot.get_guild_prefix(message(1)) == "!"
+    assert bot.get_guild_prefix(message(2)) == "?"
+    assert bot.get_guild_prefix(message(None)) == "?"
+    # discord.py calls the prefix function as command_prefix(bot, message)
+    assert bot.command_prefix(bot, message(1)) == "!"
+
+
+def test_link_hosts_are_checked_and_cleaned_up(make_bot, monkeypatch):
+    bot = make_bot()
+    updates = []
+
+    async def update(guild_id: int, **values) -> None:
+        updates.append((guild_id, values))
+
+    async def send(embed: discord.Embed) -> None:
+        sent.append(embed.description)
+
+    monkeypatch.setattr(bot.guild_settings, "update", update)
+    sent = []
+    ctx = SimpleNamespace(guild=SimpleNamespace(id=1), send=send)
+    cog = Settings(bot)
+
+    asyncio.run(cog.set_link_host.callback(cog, ctx, "Twitter", "https://fixupx.com/"))
+    asyncio.run(cog.set_link_host.callback(cog, ctx, "reddit", "reset"))
+    assert updates == [(1, {"twitter_host": "fixupx.com"}), (1, {"reddit_host": None})]
+    assert "`vxreddit.com`" in sent[-1]
+
+    with pytest.raises(commands.BadArgument):
+        asyncio.run(cog.set_link_host.callback(cog, ctx, "youtube", "yt.com"))
+    with pytest.raises(commands.BadArgument):
+        asyncio.run(cog.set_link_host.callback(cog, ctx, "tiktok", "not a host"))
@@ -0,0 +1,34 @@
+import itertools
+import random
+
+from common.suggestions import BKTree, edit_distance
+
+
+def test_edit_distance():
+    assert edit_distance("", "") == 0
+    assert edit_distance("help", "") == 4
+    assert edit_distance("kitten", "sitting") == 3
+    assert edit_distance("hlep", "help") == 1
+    # Swapping "ca" and then inserting "b" in between, which restricted Damerau-Levenshtein calls 3 edits
+    assert edit_distance("ca", "abc") == 2
+
+
+def test_edit_distance_is_a_metric():
+    words = ["".join(letters) for size in range(4) for letters in itertools.product("abc", repeat=size)]
+    for first, second, third in itertools.product(words, repeat=3):
+        assert edit_distance(first, third) <= edit_distance(first, second) + edit_distance(second, third)
+
+
+def test_search_finds_matches_past_a_distant_root():
+    # Restricted Damerau-Levenshtein puts "cba" 4 edits from "aadb" but "cab" only 2, so the subtree got pruned
+    assert BKTree(["aadb", "cba"]).search("cab", max_distance=1) == [(1, "cba")]
+
+
+def test_search_matches_a_full_scan():
+    words = ["".join(letters) for size in range(1, 5) for letters in itertools.product("abcd", repeat=size)]
+    random.Random(42).shuffle(words)
+    tree = BKTree(words)
+    for query in random.Random(7).sample(words, 60) + ["", "abcde", "dcba"]:
+        for max_distance in (1, 2):
+            expected = sorted((edit_distance(query, word), word) for word in words)
+            assert tree.search(query, max_distance) == [match for match in expected if match[0] <= max_distance]
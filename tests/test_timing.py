@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, time, timedelta, timezone
+from time import monotonic
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from common.timing import next_local_time, send_at
+
+NEW_YORK = ZoneInfo("America/New_York")
+
+
+def test_next_local_time_crosses_days_and_months():
+    after = datetime(2024, 1, 31, 12, 35, tzinfo=NEW_YORK)
+    assert next_local_time([time(0, 34), time(12, 34)], NEW_YORK, after) == datetime(2024, 2, 1, 0, 34, tzinfo=NEW_YORK)
+    assert next_local_time([time(12, 34)], NEW_YORK, after - timedelta(minutes=2)) == after - timedelta(minutes=1)
+    with pytest.raises(ValueError):
+        next_local_time([], NEW_YORK, after)
+
+
+def test_next_local_time_follows_daylight_saving():
+    # Clocks went forward overnight, so the same wall clock time is an hour less apart in UTC
+    before = next_local_time([time(12, 34)], NEW_YORK, datetime(2024, 3, 9, 12, 0, tzinfo=timezone.utc))
+    after = next_local_time([time(12, 34)], NEW_YORK, before)
+    assert before.utcoffset() == timedelta(hours=-5) and after.utcoffset() == timedelta(hours=-4)
+    assert after - before == timedelta(days=1)
+    assert after.astimezone(timezone.utc) - before.astimezone(timezone.utc) == timedelta(hours=23)
+
+
+def test_send_at_leads_by_half_the_round_trip():
+    async def main():
+        fired = {}
+
+        async def warm() -> None:
+            await asyncio.sleep(0.1)
+
+        async def send() -> str:
+            fired["at"] = monotonic()
+            return "sent"
+
+        deadline = datetime.now(timezone.utc) + timedelta(seconds=0.5)
+        deadline_at = monotonic() + 0.5
+        assert await send_at(deadline, send, warm=warm, warm_before=0.3) == "sent"
+        return fired["at"] - deadline_at
+
+    # A 100 ms round trip means sending about 40 ms early (half of it, less the safety margin)
+    assert -0.06 < asyncio.run(main()) < -0.02
+
+
+def test_send_at_still_fires_if_warming_up_fails():
+    async def main():
+        async def warm() -> None:
+            raise ConnectionError("refused")
+
+        async def send() -> float:
+            return monotonic()
+
+        deadline_at = monotonic() + 0.2
+        deadline = datetime.now(timezone.utc) + timedelta(seconds=0.2)
+        return await send_at(deadline, send, warm=warm, warm_before=0.1) - deadline_at
+
+    assert 0 <= asyncio.run(main()) < 0.02